@@ -0,0 +1,164 @@
+import os
+import gzip
+import json
+import stat
+import hashlib
+import logging
+from pathlib import Path
+import anyio
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = Path(__file__).parent.parent / "frontend" / "static"
+STATIC_URL_PREFIX = "/static"
+
+# Fingerprinted copies (and their .gz/.br siblings) are written here; never edit by hand
+BUILD_DIR_NAME = "dist"
+# Directories that are served as-is rather than fingerprinted
+UNFINGERPRINTED_DIRS = {BUILD_DIR_NAME, "uploads"}
+
+COMPRESSIBLE_SUFFIXES = {".css", ".js", ".svg", ".json", ".txt", ".html", ".map"}
+ASSET_MIN_COMPRESS_BYTES = int(os.getenv("ASSET_MIN_COMPRESS_BYTES", "256"))
+FINGERPRINT_LENGTH = 12
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Anything not fingerprinted may change under the same URL: cache, but revalidate with the ETag
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def _brotli():
+    try:
+        import brotli
+        return brotli
+    except ImportError:
+        return None
+
+
+def _write_if_missing(path: Path, data: bytes):
+    # Names are content hashes, so an existing file already has these exact bytes
+    if path.exists():
+        return
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+class AssetManifest:
+    """Maps static asset paths to content-hashed copies under ``dist/``.
+
+    ``build`` is idempotent and keeps copies from earlier builds, so pages
+    rendered before a deploy keep resolving their old asset URLs.
+    """
+
+    def __init__(self, static_dir: Path = STATIC_DIR):
+        self.static_dir = static_dir
+        self.build_dir = static_dir / BUILD_DIR_NAME
+        self.entries = {}
+
+    def _sources(self):
+        for path in sorted(self.static_dir.rglob("*")):
+            relative = path.relative_to(self.static_dir)
+            if relative.parts[0] in UNFINGERPRINTED_DIRS or relative.name.startswith("."):
+                continue
+            if path.is_file():
+                yield path, relative
+
+    def build(self) -> dict:
+        brotli = _brotli()
+        if brotli is None:
+            logger.warning("brotli is not installed; serving gzip-only precompressed assets")
+
+        entries = {}
+        for path, relative in self._sources():
+            data = path.read_bytes()
+            digest = hashlib.sha256(data).hexdigest()[:FINGERPRINT_LENGTH]
+            hashed = Path(BUILD_DIR_NAME) / relative.parent / f"{relative.stem}.{digest}{relative.suffix}"
+            target = self.static_dir / hashed
+            target.parent.mkdir(parents=True, exist_ok=True)
+            _write_if_missing(target, data)
+
+            if relative.suffix in COMPRESSIBLE_SUFFIXES and len(data) >= ASSET_MIN_COMPRESS_BYTES:
+                _write_if_missing(target.with_name(target.name + ".gz"), gzip.compress(data, 9, mtime=0))
+                if brotli is not None:
+                    _write_if_missing(target.with_name(target.name + ".br"), brotli.compress(data, quality=11))
+            entries[relative.as_posix()] = hashed.as_posix()
+
+        self.build_dir.mkdir(parents=True, exist_ok=True)
+        (self.build_dir / "manifest.json").write_text(json.dumps(entries, indent=2, sort_keys=True))
+        self.entries = entries
+        logger.info(f"Fingerprinted {len(entries)} static assets")
+        return entries
+
+    def url(self, path: str) -> str:
+        path = path.lstrip("/")
+        return f"{STATIC_URL_PREFIX}/{self.entries.get(path, path)}"
+
+
+asset_manifest = AssetManifest()
+
+
+def asset_url(path: str) -> str:
+    """Template helper: the fingerprinted URL for a static asset, e.g. asset_url('base.css')."""
+    return asset_manifest.url(path)
+
+
+def _is_immutable(path: str) -> bool:
+    parts = Path(path).parts
+    if not parts:
+        return False
+    if parts[0] == BUILD_DIR_NAME:
+        return parts[-1] != "manifest.json"
+    # Uploads live under their content hash (see images.py)
+    return parts[0] == "uploads" and len(parts) > 2 and len(parts[1]) == 64
+
+
+def _accepted_encodings(header: str) -> set:
+    accepted = set()
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        try:
+            quality = float(params.strip()[2:]) if params.strip().startswith("q=") else 1.0
+        except ValueError:
+            quality = 1.0
+        if name and quality > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+class AssetStaticFiles(StaticFiles):
+    """StaticFiles that serves precompressed siblings and sets long-lived caching headers.
+
+    A request for ``x.css`` from a client that accepts br (or gzip) gets
+    ``x.css.br`` (or ``x.css.gz``) when one exists. Fingerprinted and
+    content-addressed files are immutable; everything else is revalidated
+    with its ETag and answered with 304 when unchanged.
+    """
+
+    async def get_response(self, path: str, scope):
+        compressible = Path(path).suffix in COMPRESSIBLE_SUFFIXES
+        response = None
+        if compressible and scope["method"] in ("GET", "HEAD"):
+            accepted = _accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+            for encoding, suffix in ENCODINGS:
+                if encoding not in accepted:
+                    continue
+                full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path + suffix)
+                if stat_result and stat.S_ISREG(stat_result.st_mode):
+                    response = self.file_response(full_path, stat_result, scope)
+                    # The media type is still guessed from x.css: mimetypes treats .br/.gz as encodings
+                    if response.status_code == 200:
+                        response.headers["content-encoding"] = encoding
+                    break
+
+        if response is None:
+            response = await super().get_response(path, scope)
+        if compressible:
+            response.headers["vary"] = "Accept-Encoding"
+        response.headers["cache-control"] = IMMUTABLE_CACHE_CONTROL if _is_immutable(path) else REVALIDATE_CACHE_CONTROL
+        return response
@@ -0,0 +1,160 @@
+import os
+import hmac
+import time
+import asyncio
+import logging
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+from dotenv import load_dotenv
+from jose import JWTError, jwt
+from passlib.context import CryptContext
+from pymongo import ASCENDING
+from starlette.requests import HTTPConnection
+from cache import TTLCache
+from database import sessions_collection
+
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# bcrypt is deliberately slow (~0.3 s per hash at the default cost) and releases the GIL,
+# so it runs on its own small pool: at most this many hashes at once, never on the event loop
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+SESSION_COOKIE = "session"
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "10000"))
+# Also how long a logout or rename can take to reach the other workers' caches
+SESSION_CACHE_TTL_SECONDS = float(os.getenv("SESSION_CACHE_TTL_SECONDS", "60"))
+SESSION_ALGORITHM = "HS256"
+SESSION_SECRET = os.getenv("SESSION_SECRET")
+if not SESSION_SECRET:
+    # Sessions then only survive as long as this process and aren't shared between workers
+    logger.warning("SESSION_SECRET is not set; using a random per-process secret")
+    SESSION_SECRET = secrets.token_urlsafe(32)
+
+pwd_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=BCRYPT_ROUNDS)
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_dummy_hash = None
+
+# Verified token -> username, so repeat requests skip the signature check and the session lookup
+session_cache = TTLCache(max_entries=SESSION_CACHE_MAX_ENTRIES, ttl=SESSION_CACHE_TTL_SECONDS)
+
+# The cookie is a signed JWT naming a server-side session; a session exists until logout,
+# a rename or its expiry, and a token whose session is gone is rejected:
+#   {"_id": sid, "username": str, "expires_at": datetime}
+
+
+async def ensure_session_indexes():
+    # The TTL monitor deletes expired sessions; the username index serves revoke_user_sessions
+    await sessions_collection.create_index("expires_at", expireAfterSeconds=0, name="session_expiry")
+    await sessions_collection.create_index([("username", ASCENDING)], name="sessions_by_user")
+
+
+async def _run(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, fn, *args)
+
+
+async def hash_password(password: str) -> str:
+    return await _run(pwd_context.hash, password)
+
+
+async def _dummy_verify(password: str):
+    """Take as long as checking a real hash, so a missing user can't be told apart by response time."""
+    global _dummy_hash
+    if _dummy_hash is None:
+        # Made with the current settings, so its cost matches the users' hashes
+        _dummy_hash = await hash_password(secrets.token_urlsafe(16))
+    await _run(pwd_context.verify, password, _dummy_hash)
+
+
+async def verify_password(password: str, stored: str) -> Tuple[bool, Optional[str]]:
+    """Check ``password`` against a stored hash (or a legacy plaintext password).
+
+    Returns ``(valid, new_hash)``; ``new_hash`` is set when the stored value
+    should be replaced, either because it was plaintext or because its hash
+    settings are out of date.
+    """
+    if not stored:
+        await _dummy_verify(password)
+        return False, None
+    if pwd_context.identify(stored, required=False) is None:
+        # Rows from before passwords were hashed
+        if not hmac.compare_digest(stored.encode(), password.encode()):
+            return False, None
+        return True, await hash_password(password)
+    return await _run(pwd_context.verify_and_update, password, stored)
+
+
+async def create_session(username: str) -> str:
+    now = int(time.time())
+    sid = secrets.token_urlsafe(16)
+    await sessions_collection.insert_one({
+        "_id": sid, "username": username, "expires_at": datetime.utcnow() + timedelta(seconds=SESSION_TTL_SECONDS)
+    })
+    return jwt.encode(
+        {"sub": username, "iat": now, "exp": now + SESSION_TTL_SECONDS, "sid": sid},
+        SESSION_SECRET, algorithm=SESSION_ALGORITHM
+    )
+
+
+def _claims(token: str) -> Optional[dict]:
+    try:
+        return jwt.decode(token, SESSION_SECRET, algorithms=[SESSION_ALGORITHM])
+    except JWTError:
+        return None
+
+
+async def current_user(connection: HTTPConnection) -> Optional[str]:
+    """The signed-in username for a request or websocket, or None."""
+    token = connection.cookies.get(SESSION_COOKIE)
+    if not token:
+        return None
+    username = session_cache.get((SESSION_COOKIE, token))
+    if username is not None:
+        return username
+    claims = _claims(token)
+    if not claims or not claims.get("sid"):
+        return None
+
+    async def load_username():
+        # A session past expires_at can linger until the TTL monitor's next pass; it is still expired
+        session = await sessions_collection.find_one(
+            {"_id": claims["sid"], "expires_at": {"$gt": datetime.utcnow()}}, {"username": 1}
+        )
+        return session["username"] if session else None
+
+    # Never cache a token past its own expiry; tagged so a revocation also stops a lookup in flight
+    ttl = min(SESSION_CACHE_TTL_SECONDS, claims["exp"] - time.time())
+    return await session_cache.get_or_load((SESSION_COOKIE, token), load_username,
+                                           tags=[f"session:{claims['sid']}"], ttl=ttl)
+
+
+async def set_session_cookie(response, username: str):
+    response.set_cookie(key=SESSION_COOKIE, value=await create_session(username), max_age=SESSION_TTL_SECONDS,
+                        httponly=True, samesite="lax")
+
+
+async def clear_session(connection: HTTPConnection, response):
+    """Log out: delete the server-side session, so a copy of the cookie stops working too."""
+    token = connection.cookies.get(SESSION_COOKIE)
+    claims = _claims(token) if token else None
+    if claims and claims.get("sid"):
+        await sessions_collection.delete_one({"_id": claims["sid"]})
+        session_cache.invalidate(f"session:{claims['sid']}")
+    response.delete_cookie(SESSION_COOKIE)
+
+
+async def revoke_user_sessions(username: str):
+    """End every session of ``username``, e.g. once the name is freed by a rename."""
+    sids = [session["_id"] async for session in sessions_collection.find({"username": username}, {"_id": 1})]
+    await sessions_collection.delete_many({"username": username})
+    session_cache.invalidate(*[f"session:{sid}" for sid in sids])
+
+
+def shutdown_executor():
+    _hash_executor.shutdown(wait=False)
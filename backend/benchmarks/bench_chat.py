@@ -0,0 +1,138 @@
+"""Sustained chat throughput per worker: inline inserts vs the write-behind buffer.
+
+Each simulated socket sends messages back to back through the same steps as
+``websocket_endpoint``: relay to the recipient through a ConnectionManager,
+then persist. "inline" awaits ``insert_one`` before relaying, as the
+endpoint used to; "write-behind" relays first and queues the document on a
+MessageWriter.
+
+By default the collection is an in-process stand-in that charges a fixed
+round trip per database call (``--rtt-ms``), so the result reflects the
+number of round trips rather than local hardware. Pass ``--mongo-uri`` to
+write to a real server instead. Run from the backend directory:
+
+    python -m benchmarks.bench_chat --senders 50 --messages 200 --rtt-ms 2
+"""
+import json
+import time
+import asyncio
+import argparse
+from datetime import datetime
+from chat import ConnectionManager, InMemoryBroker
+from chat_store import MessageWriter
+
+
+class RoundTripCollection:
+    """Stores documents in a list, sleeping one round trip per call."""
+
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+        self.documents = []
+
+    async def insert_one(self, document):
+        await asyncio.sleep(self.rtt)
+        self.documents.append(document)
+
+    async def insert_many(self, documents, ordered=True):
+        await asyncio.sleep(self.rtt)
+        self.documents.extend(documents)
+
+    async def count_documents(self, _filter):
+        return len(self.documents)
+
+
+class NullSocket:
+    async def accept(self):
+        pass
+
+    async def send_text(self, message):
+        pass
+
+    async def close(self, code=1000):
+        pass
+
+
+async def run(mode: str, collection, senders: int, messages: int) -> dict:
+    manager = ConnectionManager(InMemoryBroker())
+    await manager.start()
+    writer = MessageWriter(collection)
+    if mode == "write-behind":
+        await writer.start()
+    for i in range(senders):
+        await manager.connect(NullSocket(), f"user{i}")
+
+    async def sender(i: int):
+        receiver = f"user{(i + 1) % senders}"
+        for n in range(messages):
+            # Stands in for awaiting websocket.receive_text() between messages
+            await asyncio.sleep(0)
+            message = {"sender": f"user{i}", "receiver": receiver, "message": f"message {n}",
+                       "timestamp": datetime.utcnow().isoformat()}
+            if mode == "inline":
+                await collection.insert_one(dict(message))
+                await manager.send_personal_message(json.dumps(message), receiver)
+            else:
+                await manager.send_personal_message(json.dumps(message), receiver)
+                await writer.write(dict(message))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(sender(i) for i in range(senders)))
+    delivered = time.perf_counter() - start
+    await writer.close()
+    persisted = time.perf_counter() - start
+    await manager.close()
+
+    total = senders * messages
+    return {
+        "mode": mode,
+        "messages": total,
+        "delivered_per_sec": round(total / delivered),
+        "persisted_per_sec": round(total / persisted),
+        "flushes": writer.flushes if mode == "write-behind" else total,
+        "avg_flush_ms": writer.stats()["avg_flush_ms"] if mode == "write-behind" else None,
+    }
+
+
+async def main_async(args) -> list:
+    results = []
+    for mode in ("inline", "write-behind"):
+        if args.mongo_uri:
+            from database import create_client
+            client = create_client(args.mongo_uri)
+            collection = client[args.db]["bench_chat_messages"]
+            await collection.drop()
+        else:
+            collection = RoundTripCollection(args.rtt_ms / 1000)
+        result = await run(mode, collection, args.senders, args.messages)
+        result["stored"] = await collection.count_documents({})
+        results.append(result)
+        if args.mongo_uri:
+            await collection.drop()
+            client.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--senders", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=200, help="messages per sender")
+    parser.add_argument("--rtt-ms", type=float, default=2.0, help="simulated database round trip")
+    parser.add_argument("--mongo-uri", help="benchmark against a real MongoDB instead")
+    parser.add_argument("--db", default="bench")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'mode':>13} {'messages':>9} {'delivered/s':>12} {'persisted/s':>12} {'flushes':>8} "
+          f"{'avg flush ms':>13} {'stored':>8}")
+    for r in results:
+        print(f"{r['mode']:>13} {r['messages']:>9} {r['delivered_per_sec']:>12} {r['persisted_per_sec']:>12} "
+              f"{r['flushes']:>8} {str(r['avg_flush_ms']):>13} {r['stored']:>8}")
+
+
+if __name__ == "__main__":
+    main()
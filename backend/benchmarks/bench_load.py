@@ -0,0 +1,493 @@
+"""Mixed-workload load test of the marketplace routes and the chat socket.
+
+Seeds synthetic users, products, reviews, carts and chat history, then
+drives the app with concurrent virtual users for a fixed time:
+
+    browse   GET /  (newest, or sorted by price)
+    search   GET /?search=<word>
+    product  GET /product/{id}
+    cart     POST /add-to-cart, then POST /remove-from-cart
+    login    POST /login  (a full bcrypt verify per request)
+    chat     /ws/{user_id}: time from send until the message is echoed back
+
+Every request is reported per route with throughput and p50/p95/p99 latency.
+Results can be saved as a baseline and later runs compared against it; the
+command exits non-zero if any route regressed beyond ``--tolerance``.
+
+By default everything runs in this process: the app is served by uvicorn on
+a free local port, backed by an in-memory MongoDB stand-in (mongomock-motor).
+This keeps the numbers comparable between runs on the same machine, but it
+is not a production-like database. To load a real deployment instead, seed
+its database first and then start the server against it:
+
+    python -m benchmarks.bench_load --mongo-uri mongodb://localhost --db bench --seed-only
+    MONGO_DB_NAME=bench uvicorn main:app --port 8000 &
+    python -m benchmarks.bench_load --url http://localhost:8000 --mongo-uri mongodb://localhost --db bench --no-seed
+
+Needs mongomock-motor and httpx besides the app's own requirements. Run
+from the backend directory:
+
+    python -m benchmarks.bench_load --duration 20 --concurrency 32 --json --output run.json
+    python -m benchmarks.bench_load --duration 20 --concurrency 32 --baseline run.json
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+from datetime import datetime, timedelta
+from bson import ObjectId
+
+
+WORDS = ["red", "blue", "green", "vintage", "wooden", "leather", "steel", "lamp", "chair", "table", "jacket",
+         "bike", "guitar", "camera", "watch", "phone", "desk", "shelf", "mug", "book", "shoes", "bag"]
+
+PASSWORD = "bench-password"
+DEFAULT_MIX = "browse=40,search=20,product=25,cart=10,login=5"
+# Generous: on a small machine every virtual user logging in at once queues behind bcrypt
+HTTP_TIMEOUT_SECONDS = 60
+# Settings that must match for a comparison with a baseline to mean anything
+COMPARABLE_SETTINGS = ("users", "products", "reviews", "messages", "concurrency", "ws_senders", "mix", "seed")
+
+
+def username(i: int) -> str:
+    return f"benchuser{i}"
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in WORKLOADS:
+            raise SystemExit(f"Unknown workload {name!r}; choose from {', '.join(WORKLOADS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+# Seeding
+
+async def seed(db, args, rng: random.Random) -> list:
+    """Replace the benchmark collections with synthetic data; returns the product ids."""
+    from auth import hash_password
+    from chat_store import new_message
+
+    for name in ("users", "products", "reviews", "carts", "chat_messages", "sellers"):
+        await db[name].drop()
+
+    # Hash once: seeding shouldn't take users * 0.3 s, and every login still verifies in full
+    password_hash = await hash_password(PASSWORD)
+    await _insert(db["users"], [
+        {"username": username(i), "email": f"{username(i)}@gmail.com", "password": password_hash,
+         "rating_count": 0, "rating_sum": 0, "average_rating": None}
+        for i in range(args.users)
+    ])
+
+    sellers = max(1, args.users // 4)
+    product_ids = []
+    products = []
+    for i in range(args.products):
+        product_id = ObjectId()
+        product_ids.append(product_id)
+        image_hash = f"{i:064x}"
+        products.append({
+            "_id": product_id,
+            "name": " ".join(rng.sample(WORDS, 3)),
+            "price": round(rng.uniform(1, 500), 2),
+            "image": f"/static/uploads/{image_hash}/full.webp",
+            "images": {variant: f"/static/uploads/{image_hash}/{variant}.webp" for variant in ("thumb", "card", "full")},
+            "added_by": username(rng.randrange(sellers)),
+            "rating_count": 0,
+            "rating_sum": 0,
+            "average_rating": None,
+        })
+
+    reviews = []
+    seen = set()
+    for _ in range(args.reviews):
+        product = rng.choice(products)
+        reviewer = username(rng.randrange(args.users))
+        if (product["_id"], reviewer) in seen:
+            continue
+        seen.add((product["_id"], reviewer))
+        rating = rng.randint(1, 5)
+        product["rating_count"] += 1
+        product["rating_sum"] += rating
+        product["average_rating"] = product["rating_sum"] / product["rating_count"]
+        reviews.append({"target_type": "product", "target_id": str(product["_id"]), "reviewer": reviewer,
+                        "review": f"review from {reviewer}", "rating": rating, "created_at": datetime.utcnow()})
+    await _insert(db["products"], products)
+    await _insert(db["reviews"], reviews)
+
+    await _insert(db["carts"], [
+        {"username": username(i), "items": [{"product_id": product_id, "qty": 1}
+                                            for product_id in rng.sample(product_ids, min(3, len(product_ids)))],
+         "item_count": min(3, len(product_ids))}
+        for i in range(0, args.users, 2)
+    ])
+
+    messages = []
+    start = datetime.utcnow() - timedelta(days=30)
+    for n in range(args.messages):
+        sender, receiver = rng.sample(range(args.users), 2)
+        message = new_message(username(sender), username(receiver), f"history {n}")
+        message["timestamp"] = (start + timedelta(seconds=n)).isoformat()
+        messages.append(message)
+    await _insert(db["chat_messages"], messages)
+    return product_ids
+
+
+async def _insert(collection, documents: list, batch: int = 1000):
+    for start in range(0, len(documents), batch):
+        await collection.insert_many(documents[start:start + batch])
+
+
+# Workloads: each takes a logged-in virtual user and records one or more samples
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.recording = False
+
+    def add(self, route: str, seconds: float, ok: bool):
+        if not self.recording:
+            return
+        self.samples.setdefault(route, []).append(seconds)
+        if not ok:
+            self.errors[route] = self.errors.get(route, 0) + 1
+
+
+async def _timed(recorder: Recorder, route: str, request, expected=(200,)):
+    start = time.perf_counter()
+    try:
+        response = await request
+        ok = response.status_code in expected
+    except Exception:
+        ok = False
+    recorder.add(route, time.perf_counter() - start, ok)
+
+
+async def browse(client, ctx):
+    sort = ctx.rng.choice(["newest", "newest", "price", "price_desc"])
+    await _timed(ctx.recorder, "GET /", client.get("/", params={"sort": sort}))
+
+
+async def search(client, ctx):
+    await _timed(ctx.recorder, "GET /?search", client.get("/", params={"search": ctx.rng.choice(WORDS)}))
+
+
+async def product(client, ctx):
+    product_id = ctx.rng.choice(ctx.product_ids)
+    await _timed(ctx.recorder, "GET /product/{id}", client.get(f"/product/{product_id}"))
+
+
+async def cart(client, ctx):
+    product_id = str(ctx.rng.choice(ctx.product_ids))
+    await _timed(ctx.recorder, "POST /add-to-cart", client.post("/add-to-cart", data={"product_id": product_id}),
+                 expected=(303,))
+    await _timed(ctx.recorder, "POST /remove-from-cart",
+                 client.post("/remove-from-cart", data={"product_id": product_id}), expected=(303,))
+
+
+async def login(client, ctx):
+    # A fresh client, so the virtual user keeps its own session
+    import httpx
+    async with httpx.AsyncClient(base_url=ctx.url, follow_redirects=False, timeout=HTTP_TIMEOUT_SECONDS) as anonymous:
+        data = {"username": username(ctx.rng.randrange(ctx.users)), "password": PASSWORD}
+        await _timed(ctx.recorder, "POST /login", anonymous.post("/login", data=data), expected=(303,))
+
+
+WORKLOADS = {"browse": browse, "search": search, "product": product, "cart": cart, "login": login}
+
+
+class Context:
+    def __init__(self, url: str, recorder: Recorder, product_ids: list, users: int, seed: int):
+        self.url = url
+        self.recorder = recorder
+        self.product_ids = product_ids
+        self.users = users
+        self.rng = random.Random(seed)
+
+
+async def log_in(client, user: str) -> str:
+    response = await client.post("/login", data={"username": user, "password": PASSWORD})
+    if response.status_code != 303 or "session" not in client.cookies:
+        raise SystemExit(f"Could not log in as {user} (HTTP {response.status_code}); was the database seeded?")
+    return client.cookies["session"]
+
+
+class Phases:
+    """Every virtual user logs in first; load (and the warmup clock) starts once all have."""
+
+    def __init__(self):
+        self.ready = 0
+        self.go = asyncio.Event()
+        self.stop = asyncio.Event()
+
+    async def arrive(self):
+        self.ready += 1
+        await self.go.wait()
+
+
+async def virtual_user(i: int, args, recorder: Recorder, product_ids: list, phases: Phases):
+    import httpx
+    ctx = Context(args.url, recorder, product_ids, args.users, args.seed * 1000 + i)
+    names = list(args.mix)
+    weights = [args.mix[name] for name in names]
+    async with httpx.AsyncClient(base_url=args.url, follow_redirects=False, timeout=HTTP_TIMEOUT_SECONDS) as client:
+        await log_in(client, username(i % args.users))
+        await phases.arrive()
+        while not phases.stop.is_set():
+            await WORKLOADS[ctx.rng.choices(names, weights)[0]](client, ctx)
+
+
+async def chat_sender(i: int, args, recorder: Recorder, phases: Phases):
+    import httpx
+    import websockets
+    me, peer = username(i % args.users), username((i + 1) % args.users)
+    async with httpx.AsyncClient(base_url=args.url, follow_redirects=False, timeout=HTTP_TIMEOUT_SECONDS) as client:
+        session = await log_in(client, me)
+    ws_url = args.url.replace("http", "ws", 1) + f"/ws/{me}"
+    async with websockets.connect(ws_url, extra_headers={"Cookie": f"session={session}"}) as socket:
+        await phases.arrive()
+        n = 0
+        while not phases.stop.is_set():
+            token = f"{me}-{n}"
+            n += 1
+            start = time.perf_counter()
+            ok = False
+            try:
+                await socket.send(json.dumps({"receiver": peer, "message": token}))
+                # Skip messages other senders addressed to us until our own echo arrives
+                while True:
+                    received = json.loads(await asyncio.wait_for(socket.recv(), 10))
+                    if received.get("message") == token:
+                        ok = True
+                        break
+            except Exception:
+                pass
+            recorder.add("WS /ws/{user_id}", time.perf_counter() - start, ok)
+            if not ok:
+                return
+
+
+# Reporting
+
+def percentile(ordered: list, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(recorder: Recorder, elapsed: float) -> dict:
+    routes = {}
+    for route, samples in sorted(recorder.samples.items()):
+        ordered = sorted(samples)
+        routes[route] = {
+            "requests": len(ordered),
+            "errors": recorder.errors.get(route, 0),
+            "throughput_rps": round(len(ordered) / elapsed, 1),
+            "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+            "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+        }
+    return routes
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """Routes whose p95 latency or throughput moved the wrong way by more than ``tolerance``."""
+    regressions = []
+    for route, now in current["routes"].items():
+        before = baseline.get("routes", {}).get(route)
+        if before is None:
+            continue
+        if now["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{route}: p95 {before['p95_ms']} ms -> {now['p95_ms']} ms")
+        if now["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{route}: throughput {before['throughput_rps']} -> {now['throughput_rps']} req/s")
+        if now["errors"] > before["errors"]:
+            regressions.append(f"{route}: errors {before['errors']} -> {now['errors']}")
+    return regressions
+
+
+def print_table(result: dict, baseline: dict = None):
+    print(f"{'route':<26} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+          + (f" {'base p95':>9}" if baseline else ""))
+    for route, r in result["routes"].items():
+        line = (f"{route:<26} {r['requests']:>9} {r['errors']:>7} {r['throughput_rps']:>8} {r['p50_ms']:>8} "
+                f"{r['p95_ms']:>8} {r['p99_ms']:>8}")
+        if baseline:
+            before = baseline.get("routes", {}).get(route)
+            line += f" {before['p95_ms'] if before else '-':>9}"
+        print(line)
+
+
+# Running
+
+async def start_local_server():
+    """Serve main.app with uvicorn on a free port; returns (server, task, url)."""
+    import uvicorn
+    import main
+
+    config = uvicorn.Config(main.app, host="127.0.0.1", port=0, log_level="warning", lifespan="on")
+    server = uvicorn.Server(config)
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, task, f"http://127.0.0.1:{port}"
+
+
+async def wait_until_ready(url: str, timeout: float = 60):
+    import httpx
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/readyz")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise SystemExit(f"{url} did not become ready within {timeout:.0f}s")
+
+
+async def run_load(args, product_ids: list) -> dict:
+    recorder = Recorder()
+    phases = Phases()
+    tasks = [asyncio.create_task(virtual_user(i, args, recorder, product_ids, phases))
+             for i in range(args.concurrency)]
+    tasks += [asyncio.create_task(chat_sender(i, args, recorder, phases)) for i in range(args.ws_senders)]
+    while phases.ready < len(tasks):
+        for task in tasks:
+            if task.done():
+                task.result()
+        await asyncio.sleep(0.05)
+    phases.go.set()
+
+    await asyncio.sleep(args.warmup)
+    recorder.recording = True
+    start = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    recorder.recording = False
+    elapsed = time.perf_counter() - start
+    phases.stop.set()
+    for task in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(task, BaseException):
+            raise task
+
+    routes = summarize(recorder, elapsed)
+    total = sum(r["requests"] for r in routes.values())
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("baseline", "output", "json")},
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "elapsed_seconds": round(elapsed, 2),
+        "total_requests": total,
+        "total_throughput_rps": round(total / elapsed, 1),
+        "routes": routes,
+    }
+
+
+async def main_async(args) -> dict:
+    import database
+    rng = random.Random(args.seed)
+    client = None
+    if args.mongo_uri:
+        client = database.create_client(args.mongo_uri)
+        db = client[args.db]
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        db = AsyncMongoMockClient()[args.db]
+    # Point the app's collections (used here for seeding, and by an in-process server) at the bench database
+    database.client, database.db = db.client, db
+
+    if args.no_seed:
+        product_ids = [doc["_id"] for doc in await db["products"].find({}, {"_id": 1}).to_list(None)]
+    else:
+        from indexes import ensure_indexes
+        from sellers import rebuild_sellers
+        product_ids = await seed(db, args, rng)
+        await ensure_indexes()
+        await rebuild_sellers()
+    if args.seed_only:
+        return None
+    if not product_ids:
+        raise SystemExit("No products to load; seed the database first")
+
+    server = task = None
+    if not args.url:
+        server, task, args.url = await start_local_server()
+    try:
+        await wait_until_ready(args.url)
+        return await run_load(args, product_ids)
+    finally:
+        if server is not None:
+            server.should_exit = True
+            await task
+        if client is not None:
+            client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--reviews", type=int, default=5000)
+    parser.add_argument("--messages", type=int, default=5000, help="chat history to seed")
+    parser.add_argument("--concurrency", type=int, default=16, help="HTTP virtual users")
+    parser.add_argument("--ws-senders", type=int, default=4, help="concurrent chat senders")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"workload weights (default {DEFAULT_MIX})")
+    parser.add_argument("--duration", type=float, default=15.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds of load before measuring")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for data and request choices")
+    parser.add_argument("--url", help="load an already running server instead of an in-process one")
+    parser.add_argument("--mongo-uri", help="seed a real MongoDB instead of the in-memory stand-in")
+    parser.add_argument("--db", default="bench")
+    parser.add_argument("--seed-only", action="store_true", help="seed and exit")
+    parser.add_argument("--no-seed", action="store_true", help="reuse data from an earlier --seed-only")
+    parser.add_argument("--baseline", help="compare against results saved with --output")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed fractional regression")
+    parser.add_argument("--output", help="also write the results to this file")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+    if args.url and not args.mongo_uri:
+        parser.error("--url needs --mongo-uri, pointing at the database the server uses")
+    if args.users < 2:
+        parser.error("--users must be at least 2")
+
+    result = asyncio.run(main_async(args))
+    if result is None:
+        return
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        result["regressions"] = compare(result, baseline, args.tolerance)
+        differing = [key for key in COMPARABLE_SETTINGS
+                     if baseline.get("config", {}).get(key) != result["config"].get(key)]
+        if differing:
+            print(f"WARNING: baseline was recorded with different {', '.join(differing)}", file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_table(result, baseline)
+        print(f"\n{result['total_requests']} requests in {result['elapsed_seconds']}s "
+              f"({result['total_throughput_rps']} req/s)")
+        for regression in result.get("regressions", []):
+            print(f"REGRESSION {regression}")
+    if result.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
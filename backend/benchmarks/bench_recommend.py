@@ -0,0 +1,113 @@
+"""Related-products build time and lookup latency at growing catalog sizes.
+
+Synthetic users each hold a basket of products drawn with a Zipf-like skew,
+so a few products are in many baskets, as popular items are. Compares the
+NumPy build in recommendations.py with counting pairs in a dict of Counters
+(skipped above ``--python-max`` products, where it gets slow). Run from the
+backend directory:
+
+    python -m benchmarks.bench_recommend --sizes 10000 100000 1000000
+"""
+import json
+import time
+import random
+import argparse
+import statistics
+from collections import Counter, defaultdict
+from itertools import accumulate, combinations
+from recommendations import RelatedProductsIndex, RECOMMEND_TOP_K
+
+
+def make_baskets(rng: random.Random, products: int, users: int, mean_basket: float) -> list:
+    # Product i is picked with weight 1 / (i + 10): a long tail behind a popular head
+    cum_weights = list(accumulate(1 / (i + 10) for i in range(products)))
+    ids = [str(i) for i in range(products)]
+    baskets = []
+    for _ in range(users):
+        size = max(1, min(int(rng.expovariate(1 / mean_basket)) + 1, 60))
+        baskets.append(rng.choices(ids, cum_weights=cum_weights, k=size))
+    return baskets
+
+
+def python_build(baskets: list, top_k: int) -> dict:
+    """The straightforward version: every pair into a dict, then sort each product's row."""
+    pairs = defaultdict(Counter)
+    users = Counter()
+    for basket in baskets:
+        items = sorted(set(basket))
+        users.update(items)
+        for a, b in combinations(items, 2):
+            pairs[a][b] += 1
+            pairs[b][a] += 1
+    related = {}
+    for item, row in pairs.items():
+        scored = [(other, count / (users[item] * users[other]) ** 0.5 * count / (count + 1))
+                  for other, count in row.items()]
+        related[item] = sorted(scored, key=lambda pair: -pair[1])[:top_k]
+    return related
+
+
+def run(size: int, users_per_product: float, mean_basket: float, lookups: int, python_max: int,
+        seed: int) -> dict:
+    rng = random.Random(seed)
+    baskets = make_baskets(rng, size, int(size * users_per_product), mean_basket)
+
+    start = time.perf_counter()
+    index = RelatedProductsIndex.from_baskets(baskets)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    probes = [str(rng.randrange(size)) for _ in range(lookups)]
+    samples = []
+    for product_id in probes:
+        start = time.perf_counter()
+        index.related(product_id)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+
+    python_ms = None
+    if size <= python_max:
+        start = time.perf_counter()
+        python_build(baskets, RECOMMEND_TOP_K)
+        python_ms = round((time.perf_counter() - start) * 1000, 1)
+
+    stats = index.stats()
+    return {
+        "catalog_size": size,
+        "users": len(baskets),
+        "pairs": stats["pairs"],
+        "numpy_build_ms": round(build_ms, 1),
+        "python_build_ms": python_ms,
+        "index_kb": round((index._indptr.nbytes + index._neighbors.nbytes + index._scores.nbytes) / 1024, 1),
+        "lookup_median_us": round(statistics.median(samples) * 1e6, 2),
+        "lookup_p99_us": round(samples[int(len(samples) * 0.99) - 1] * 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--users-per-product", type=float, default=2.0)
+    parser.add_argument("--mean-basket", type=float, default=6.0)
+    parser.add_argument("--lookups", type=int, default=10000)
+    parser.add_argument("--python-max", type=int, default=100000,
+                        help="largest catalog to also build with the pure-Python baseline")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    results = [run(size, args.users_per_product, args.mean_basket, args.lookups, args.python_max, args.seed)
+               for size in args.sizes]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'products':>10} {'users':>10} {'pairs':>10} {'numpy ms':>10} {'python ms':>10} {'index KB':>10} "
+          f"{'lookup us':>10} {'p99 us':>8}")
+    for r in results:
+        python_ms = "-" if r["python_build_ms"] is None else r["python_build_ms"]
+        print(f"{r['catalog_size']:>10} {r['users']:>10} {r['pairs']:>10} {r['numpy_build_ms']:>10} "
+              f"{python_ms:>10} {r['index_kb']:>10} {r['lookup_median_us']:>10} {r['lookup_p99_us']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Listing page render time with and without the fragment cache, and time to first byte when streamed.
+
+Renders index.html and sellers.html from the real templates with generated
+data, without touching the database. "full" re-renders everything, as every
+request did before; "cached" is a repeat request whose product grid / seller
+list comes from the fragment cache; "first chunk" is how long a streamed
+response takes to produce its first chunk. Run from the backend directory:
+
+    python -m benchmarks.bench_render --sizes 24 100 500
+"""
+import json
+import time
+import argparse
+import statistics
+from datetime import datetime, timedelta
+from pathlib import Path
+from bson import ObjectId
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+from cache import TTLCache
+from templating import create_templates, STREAM_FIRST_CHUNK_SIZE
+
+
+TEMPLATE_DIR = Path(__file__).parent.parent.parent / "frontend" / "templates"
+
+
+def make_request() -> Request:
+    app = Starlette(routes=[Route("/", lambda request: Response(), name="home")])
+    return Request({"type": "http", "app": app, "router": app.router, "method": "GET", "path": "/",
+                    "query_string": b"", "headers": [], "scheme": "http", "server": ("bench", 80)})
+
+
+def make_context(page: str, size: int) -> dict:
+    context = {"request": make_request(), "username": "bench"}
+    if page == "index.html":
+        context.update({
+            "products": [
+                {"_id": ObjectId(), "name": f"product {i}", "price": i + 0.99, "added_by": f"seller{i % 50}",
+                 "image": f"/static/uploads/{i}.png",
+                 "images": {v: f"/static/uploads/{i:064x}/{v}.webp" for v in ("thumb", "card", "full")}}
+                for i in range(size)
+            ],
+            "next_cursor": "next", "prev_cursor": None, "sort": "newest", "search": "",
+            "after": None, "before": None, "limit": size, "cart_count": 3,
+        })
+    else:
+        # The seller directory page, as sellers.fetch_sellers_page returns it
+        context.update({
+            "sellers": [
+                {"_id": f"seller{i}", "email": f"seller{i}@example.com", "product_count": i % 40,
+                 "rating_count": i % 7, "average_rating": 3 + (i % 20) / 10,
+                 "last_listed_at": datetime(2024, 1, 1) + timedelta(hours=i)}
+                for i in range(size)
+            ],
+            "sort": "name", "page": 1, "has_next": True, "version": 1,
+        })
+    return context
+
+
+def median_ms(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def run(page: str, size: int, repeat: int) -> dict:
+    templates = create_templates(TEMPLATE_DIR)
+    cache = TTLCache()
+    templates.env.fragment_cache = cache
+    template = templates.get_template(page)
+    context = make_context(page, size)
+
+    def full():
+        cache.clear()
+        return template.render(context)
+
+    def cached():
+        return template.render(context)
+
+    def first_chunk():
+        cache.clear()
+        size = 0
+        for piece in template.generate(context):
+            size += len(piece)
+            if size >= STREAM_FIRST_CHUNK_SIZE:
+                return
+
+    full()
+    html = cached()
+    return {
+        "page": page,
+        "items": size,
+        "html_kb": round(len(html) / 1024, 1),
+        "full_ms": round(median_ms(full, repeat), 3),
+        "cached_ms": round(median_ms(cached, repeat), 3),
+        "first_chunk_ms": round(median_ms(first_chunk, repeat), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[24, 100, 500])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    results = [run(page, size, args.repeat) for page in ("index.html", "sellers.html") for size in args.sizes]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'page':>13} {'items':>6} {'html KB':>8} {'full ms':>8} {'cached ms':>10} {'first chunk ms':>15}")
+    for r in results:
+        print(f"{r['page']:>13} {r['items']:>6} {r['html_kb']:>8} {r['full_ms']:>8} {r['cached_ms']:>10} "
+              f"{r['first_chunk_ms']:>15}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Product search latency at growing catalog sizes.
+
+Compares the inverted index in search.py against the unanchored,
+case-insensitive regex scan that ``home()`` used to send to MongoDB
+(reproduced here in Python, which is the same linear scan minus the
+network). Run from the backend directory:
+
+    python -m benchmarks.bench_search --sizes 1000 10000 100000
+"""
+import re
+import json
+import time
+import random
+import argparse
+import statistics
+from search import ProductSearchIndex
+
+
+ADJECTIVES = ["red", "blue", "vintage", "wireless", "leather", "organic", "compact", "deluxe", "portable",
+              "ergonomic", "handmade", "classic", "smart", "waterproof", "wooden", "steel", "cotton", "mini"]
+NOUNS = ["shoe", "jacket", "headphones", "lamp", "backpack", "keyboard", "mug", "watch", "chair", "bottle",
+         "notebook", "speaker", "camera", "blanket", "wallet", "charger", "desk", "scarf", "kettle", "tent"]
+QUERIES = ["wireless headphones", "leather wal", "vintge lamp", "backpack", "smart watch 42",
+           "waterprof tent", "mug", "deluxe keyboard"]
+
+
+def make_name(rng: random.Random, i: int) -> str:
+    words = rng.sample(ADJECTIVES, 2) + [rng.choice(NOUNS)]
+    # A model number keeps the vocabulary growing with the catalog, as real SKUs do
+    return f"{' '.join(words)} {rng.choice(NOUNS)} model {i}"
+
+
+def time_queries(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        for query in QUERIES:
+            start = time.perf_counter()
+            fn(query)
+            samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def run(size: int, repeat: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    names = {str(i): make_name(rng, i) for i in range(size)}
+
+    start = time.perf_counter()
+    index = ProductSearchIndex.from_items(names.items())
+    build_ms = (time.perf_counter() - start) * 1000
+
+    # Incremental maintenance, as add_product/delete_product do it
+    start = time.perf_counter()
+    for i in range(100):
+        index.add(f"new-{i}", make_name(rng, size + i))
+    for i in range(100):
+        index.remove(f"new-{i}")
+    update_us = (time.perf_counter() - start) / 200 * 1e6
+
+    def regex_scan(query):
+        pattern = re.compile(query, re.IGNORECASE)
+        return [doc_id for doc_id, name in names.items() if pattern.search(name)]
+
+    def index_lookup(query):
+        return index.search(query, limit=24)
+
+    # Selective lookups: the model number narrows results to a handful of products
+    def selective_lookup(_query):
+        return index.search(f"model {rng.randrange(size)}", limit=24)
+
+    return {
+        "catalog_size": size,
+        "index_build_ms": round(build_ms, 1),
+        "index_update_us": round(update_us, 1),
+        "regex_scan_median_ms": round(time_queries(regex_scan, repeat), 3),
+        "index_median_ms": round(time_queries(index_lookup, repeat), 3),
+        "index_selective_median_ms": round(time_queries(selective_lookup, repeat), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    results = [run(size, args.repeat, args.seed) for size in args.sizes]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'products':>10} {'build ms':>10} {'update us':>10} {'regex ms':>10} {'index ms':>10} "
+          f"{'selective ms':>13}")
+    for r in results:
+        print(f"{r['catalog_size']:>10} {r['index_build_ms']:>10} {r['index_update_us']:>10} "
+              f"{r['regex_scan_median_ms']:>10} {r['index_median_ms']:>10} {r['index_selective_median_ms']:>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+import os
+import io
+import csv
+import json
+import codecs
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Optional
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo.errors import BulkWriteError
+from database import products_collection
+
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "100000"))
+# Longest line (or multi-line CSV record) held in memory, in characters; longer rows are skipped
+IMPORT_MAX_LINE_LENGTH = int(os.getenv("IMPORT_MAX_LINE_LENGTH", str(64 * 1024)))
+# Per-row errors kept in the report; the counts stay exact past this
+IMPORT_MAX_REPORTED_ERRORS = int(os.getenv("IMPORT_MAX_REPORTED_ERRORS", "1000"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_FIELDS = ("_id", "name", "price", "image", "rating_count", "average_rating")
+MAX_NAME_LENGTH = 200
+
+
+class RowError(ValueError):
+    pass
+
+
+class LineTooLong(RowError):
+    """Stands in for a line that was dropped for being too long; ``quotes`` is how many ``"`` it had."""
+
+    def __init__(self, quotes: int = 0):
+        super().__init__(f"Row is longer than {IMPORT_MAX_LINE_LENGTH} characters")
+        self.quotes = quotes
+
+
+def resolve_format(requested: Optional[str], content_type: str = "") -> str:
+    """The bulk format from ``?format=``, else from the Content-Type, else NDJSON."""
+    if requested:
+        if requested not in FORMATS:
+            raise HTTPException(status_code=400, detail="Unknown format; use ndjson or csv")
+        return requested
+    if "csv" in (content_type or ""):
+        return "csv"
+    return "ndjson"
+
+
+async def _lines(chunks: AsyncIterator[bytes], max_length: int = IMPORT_MAX_LINE_LENGTH) -> AsyncIterator:
+    """Decode a byte stream into lines (newlines kept), holding at most one partial line.
+
+    A line longer than ``max_length`` is discarded as it arrives, up to its
+    newline, and a ``LineTooLong`` is yielded in its place.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    # Quotes seen in the overlong line being skipped, or None when not skipping
+    dropped = None
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *complete, pending = pending.split("\n")
+        for line in complete:
+            if dropped is not None:
+                yield LineTooLong(dropped + line.count('"'))
+                dropped = None
+            elif len(line) >= max_length:
+                yield LineTooLong(line.count('"'))
+            else:
+                yield line + "\n"
+        if dropped is not None or len(pending) > max_length:
+            dropped = (dropped or 0) + pending.count('"')
+            pending = ""
+    pending += decoder.decode(b"", final=True)
+    if dropped is not None or len(pending) > max_length:
+        yield LineTooLong((dropped or 0) + pending.count('"'))
+    elif pending:
+        yield pending
+
+
+async def _ndjson_rows(lines: AsyncIterator[str]) -> AsyncIterator[tuple]:
+    """(row number, dict or RowError) for each non-blank line."""
+    number = 0
+    async for line in lines:
+        number += 1
+        if isinstance(line, LineTooLong):
+            yield number, line
+            continue
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield number, RowError(f"Invalid JSON: {e}")
+            continue
+        yield number, row if isinstance(row, dict) else RowError("Each line must be a JSON object")
+
+
+async def _csv_rows(lines: AsyncIterator[str]) -> AsyncIterator[tuple]:
+    """(row number, dict or RowError) per CSV record after the header; quoted fields may span lines."""
+    header = None
+    number = 1
+    pending = ""
+    quotes = 0
+    # A record over IMPORT_MAX_LINE_LENGTH is dropped, but its quotes are still counted to find its end
+    too_long = False
+    async for line in lines:
+        if isinstance(line, LineTooLong):
+            too_long, pending = True, ""
+            quotes += line.quotes
+        else:
+            quotes += line.count('"')
+            if not too_long:
+                pending += line
+                if len(pending) > IMPORT_MAX_LINE_LENGTH:
+                    too_long, pending = True, ""
+        # Quotes come in pairs ("" escapes one), so an odd count means a quoted field continues
+        if quotes % 2:
+            continue
+        quotes = 0
+        if too_long:
+            too_long = False
+            if header is None:
+                raise HTTPException(status_code=400, detail="CSV header is too long")
+            number += 1
+            yield number, LineTooLong()
+            continue
+        record = next(csv.reader(io.StringIO(pending)), [])
+        pending = ""
+        if header is None:
+            header = [field.strip().lower() for field in record]
+            if "name" not in header or "price" not in header:
+                raise HTTPException(status_code=400, detail="CSV header must include name and price")
+            continue
+        number += 1
+        if not any(field.strip() for field in record):
+            continue
+        if len(record) != len(header):
+            yield number, RowError(f"Expected {len(header)} fields, got {len(record)}")
+            continue
+        yield number, dict(zip(header, record))
+    if header is None:
+        raise HTTPException(status_code=400, detail="CSV header must include name and price")
+    if pending or too_long:
+        yield number + 1, RowError("Unterminated quoted field")
+
+
+def validate_row(row: dict, username: str) -> dict:
+    """Turn one imported row into a product document, or raise RowError."""
+    name = str(row.get("name") or "").strip()
+    if not name:
+        raise RowError("name is required")
+    if len(name) > MAX_NAME_LENGTH:
+        raise RowError(f"name is longer than {MAX_NAME_LENGTH} characters")
+    try:
+        price = float(row.get("price"))
+    except (TypeError, ValueError):
+        raise RowError("price must be a number")
+    if not 0 <= price < 1e9:
+        raise RowError("price must be between 0 and 1,000,000,000")
+    image = str(row.get("image") or "").strip()
+    if image and not image.startswith(("https://", "http://", "/static/")):
+        raise RowError("image must be an http(s) URL or a /static/ path")
+    return {
+        "_id": ObjectId(),
+        "name": name,
+        "price": round(price, 2),
+        "image": image,
+        "added_by": username,
+        "rating_count": 0,
+        "rating_sum": 0,
+        "average_rating": None,
+        "version": 1,
+    }
+
+
+async def import_products(chunks: AsyncIterator[bytes], fmt: str, username: str,
+                          on_inserted: Callable[[list], Awaitable[None]]) -> dict:
+    """Parse, validate and insert products from a request body stream.
+
+    Rows are inserted in unordered batches as they arrive, so memory is bound
+    by the batch size rather than the upload; ``on_inserted`` is awaited with
+    the documents of each batch that made it in. Invalid rows (and rows the
+    database rejects) are reported by number and skipped; the rest are kept.
+    """
+    rows = _csv_rows(_lines(chunks)) if fmt == "csv" else _ndjson_rows(_lines(chunks))
+    report = {"received": 0, "inserted": 0, "failed": 0, "errors": []}
+    batch = []
+
+    def fail(number: int, error: str):
+        report["failed"] += 1
+        if len(report["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+            report["errors"].append({"row": number, "error": error})
+
+    async def flush():
+        if not batch:
+            return
+        failed = {}
+        try:
+            await products_collection.insert_many([doc for _, doc in batch], ordered=False)
+        except BulkWriteError as e:
+            failed = {error["index"]: error.get("errmsg", "write failed") for error in e.details["writeErrors"]}
+        inserted = []
+        for index, (number, doc) in enumerate(batch):
+            if index in failed:
+                fail(number, failed[index])
+            else:
+                inserted.append(doc)
+        batch.clear()
+        report["inserted"] += len(inserted)
+        if inserted:
+            await on_inserted(inserted)
+
+    async for number, row in rows:
+        if report["received"] >= IMPORT_MAX_ROWS:
+            # Earlier batches are already in, so report the cut-off rather than fail the request
+            fail(number, f"Row limit of {IMPORT_MAX_ROWS} reached; this and later rows were not imported")
+            break
+        report["received"] += 1
+        try:
+            if isinstance(row, RowError):
+                raise row
+            batch.append((number, validate_row(row, username)))
+        except RowError as e:
+            fail(number, str(e))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await flush()
+    await flush()
+    logger.info(f"Imported {report['inserted']} products for {username} ({report['failed']} rows failed)")
+    return report
+
+
+def _export_value(product: dict, field: str):
+    value = product.get(field)
+    return str(value) if isinstance(value, ObjectId) else value
+
+
+async def export_products(username: str, fmt: str) -> AsyncIterator[str]:
+    """Stream a seller's products oldest-first, one cursor batch at a time."""
+    cursor = products_collection.find(
+        {"added_by": username}, {field: 1 for field in EXPORT_FIELDS}
+    ).sort("_id", 1).batch_size(EXPORT_BATCH_SIZE)
+
+    if fmt == "csv":
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(EXPORT_FIELDS)
+        async for product in cursor:
+            writer.writerow([_export_value(product, field) for field in EXPORT_FIELDS])
+            if out.tell() >= 65536:
+                yield out.getvalue()
+                out.seek(0)
+                out.truncate()
+        yield out.getvalue()
+        return
+
+    lines = []
+    async for product in cursor:
+        lines.append(json.dumps({field: _export_value(product, field) for field in EXPORT_FIELDS}) + "\n")
+        if len(lines) >= EXPORT_BATCH_SIZE:
+            yield "".join(lines)
+            lines.clear()
+    if lines:
+        yield "".join(lines)
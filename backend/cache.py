@@ -0,0 +1,159 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict, defaultdict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Set
+
+
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "2000"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "60"))
+
+
+class TTLCache:
+    """Size-bounded LRU cache with per-entry expiry and tag-based invalidation.
+
+    Keys are tuples whose first element names the kind of entry (``"product"``,
+    ``"listing"``...); hit/miss counters are kept per kind. Entries can carry
+    tags such as ``"product:<id>"`` so a write handler can drop exactly the
+    entries it made stale. Concurrent misses on the same key share a single
+    load instead of stampeding the database.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._tags: Dict[str, Set[Hashable]] = defaultdict(set)
+        self._loading: Dict[Hashable, tuple] = {}
+        self._versions: Dict[str, int] = defaultdict(int)
+        self._generation = 0
+        self.hits: Dict[str, int] = defaultdict(int)
+        self.misses: Dict[str, int] = defaultdict(int)
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: tuple, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        value, expires_at, _ = entry
+        if expires_at < time.monotonic():
+            self._drop(key)
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: tuple, value: Any, tags: Iterable[str] = (), ttl: float = None):
+        if key in self._entries:
+            self._drop(key)
+        tags = frozenset(tags)
+        self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl), tags)
+        for tag in tags:
+            self._tags[tag].add(key)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    async def get_or_load(self, key: tuple, loader: Callable[[], Awaitable[Any]], tags: Iterable[str] = (),
+                          ttl: float = None):
+        """Read-through lookup: return the cached value or await ``loader()`` and cache it.
+
+        ``None`` results are not cached so a missing document is looked up again.
+        """
+        kind = key[0]
+        marker = object()
+        value = self.get(key, marker)
+        if value is not marker:
+            self.hits[kind] += 1
+            return value
+        self.misses[kind] += 1
+
+        pending = self._loading.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending[0])
+
+        tags = frozenset(tags)
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = (future, tags)
+        try:
+            value = await loader()
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; retrieve the exception so it isn't logged as unhandled
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            # Only cache if nothing invalidated this key while the load was in flight
+            if self._loading.get(key, (None,))[0] is future and value is not None:
+                self.set(key, value, tags, ttl)
+            return value
+        finally:
+            if self._loading.get(key, (None,))[0] is future:
+                del self._loading[key]
+
+    def delete(self, key: tuple):
+        self._drop(key)
+
+    def version(self, *tags: str) -> tuple:
+        """Changes whenever any of ``tags`` is invalidated (or the cache is cleared).
+
+        Folding this into a key means a value computed from data read before an
+        invalidation can never be served after it, even if it is stored late.
+        """
+        return (self._generation,) + tuple(self._versions[tag] for tag in tags)
+
+    def invalidate(self, *tags: str):
+        """Drop every entry carrying any of ``tags``."""
+        for tag in tags:
+            self._versions[tag] += 1
+            for key in list(self._tags.get(tag, ())):
+                self._drop(key)
+                self.invalidations += 1
+            self._tags.pop(tag, None)
+            # Loads already in flight for these tags must not repopulate stale data
+            for key in [k for k, (_, load_tags) in self._loading.items() if tag in load_tags]:
+                del self._loading[key]
+
+    def clear(self):
+        self._generation += 1
+        self._versions.clear()
+        self._entries.clear()
+        self._tags.clear()
+        self._loading.clear()
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def stats(self) -> dict:
+        kinds = sorted(set(self.hits) | set(self.misses))
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "kinds": {
+                kind: {
+                    "hits": self.hits[kind],
+                    "misses": self.misses[kind],
+                    "hit_ratio": round(self.hits[kind] / ((self.hits[kind] + self.misses[kind]) or 1), 4),
+                }
+                for kind in kinds
+            },
+        }
+
+
+catalog_cache = TTLCache()
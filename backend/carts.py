@@ -0,0 +1,154 @@
+import logging
+from bson import ObjectId
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from catalog import PRODUCT_CARD_PROJECTION
+from database import carts_collection, products_collection
+
+
+logger = logging.getLogger(__name__)
+
+# Carts hold references, not product copies:
+#   {"username": ..., "items": [{"product_id": ObjectId, "qty": int}], "item_count": int}
+# item_count is the total quantity and is what the navigation badge shows.
+
+
+async def ensure_cart_indexes():
+    """One cart per user. add_item's DuplicateKeyError fallback depends on this index."""
+    try:
+        await carts_collection.create_index([("username", ASCENDING)], unique=True, name="one_cart_per_user")
+    except OperationFailure as e:
+        # Duplicate carts from before the index existed; `manage.py migrate-carts` merges them
+        logger.error(f"Could not create index one_cart_per_user on carts: {str(e)}")
+
+
+async def add_item(username: str, product_id: ObjectId, qty: int = 1):
+    # Bump the quantity if the product is already in the cart...
+    result = await carts_collection.update_one(
+        {"username": username, "items.product_id": product_id},
+        {"$inc": {"items.$.qty": qty, "item_count": qty}}
+    )
+    if result.matched_count:
+        return
+
+    # ...otherwise append a new line, creating the cart if needed
+    try:
+        await carts_collection.update_one(
+            {"username": username, "items.product_id": {"$ne": product_id}},
+            {"$push": {"items": {"product_id": product_id, "qty": qty}}, "$inc": {"item_count": qty}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # Lost a race with a concurrent add of the same product; its line exists now
+        await carts_collection.update_one(
+            {"username": username, "items.product_id": product_id},
+            {"$inc": {"items.$.qty": qty, "item_count": qty}}
+        )
+
+
+def _drop_lines(product_ids: list) -> list:
+    """Update pipeline removing the lines for ``product_ids`` and recounting item_count, atomically."""
+    return [
+        {"$set": {"items": {"$filter": {
+            "input": {"$ifNull": ["$items", []]},
+            "cond": {"$not": {"$in": ["$$this.product_id", product_ids]}}
+        }}}},
+        {"$set": {"item_count": {"$sum": "$items.qty"}}}
+    ]
+
+
+async def remove_item(username: str, product_id: ObjectId):
+    await carts_collection.update_one({"username": username}, _drop_lines([product_id]))
+
+
+async def remove_product(product_id: ObjectId) -> int:
+    """Take a deleted product out of every cart holding it; returns the carts changed."""
+    result = await carts_collection.update_many({"items.product_id": product_id}, _drop_lines([product_id]))
+    return result.modified_count
+
+
+async def cart_count(username: str) -> int:
+    if not username:
+        return 0
+    cart = await carts_collection.find_one({"username": username}, {"item_count": 1, "_id": 0})
+    return cart.get("item_count", 0) if cart else 0
+
+
+def _cart_lines(cart: dict) -> list:
+    """(product_id, qty) pairs, tolerating carts written before the migration."""
+    lines = []
+    for item in cart.get("items", []):
+        if "product_id" in item:
+            lines.append((item["product_id"], item.get("qty", 1)))
+        elif "_id" in item:
+            lines.append((item["_id"], 1))
+    return lines
+
+
+async def hydrate_cart(username: str) -> list:
+    """The cart's products, current prices included, fetched with a single $in query."""
+    cart = await carts_collection.find_one({"username": username}, {"items": 1})
+    if not cart:
+        return []
+    lines = _cart_lines(cart)
+    products = await products_collection.find(
+        {"_id": {"$in": [product_id for product_id, _ in lines]}}, PRODUCT_CARD_PROJECTION
+    ).to_list(None)
+    by_id = {product["_id"]: product for product in products}
+
+    items = []
+    missing = []
+    for product_id, qty in lines:
+        product = by_id.get(product_id)
+        if product is None:
+            missing.append(product_id)
+        else:
+            items.append({**product, "qty": qty, "line_total": round(product["price"] * qty, 2)})
+    if missing:
+        # A line added while delete_product ran outlives the product; drop it so item_count (the
+        # badge) matches this page. Unmigrated carts have no qty to recount and wait for migrate-carts
+        await carts_collection.update_one({"_id": cart["_id"], "items._id": {"$exists": False}}, _drop_lines(missing))
+    return items
+
+
+async def merge_duplicate_carts() -> int:
+    """Fold duplicate carts for one user (left by concurrent first adds) into the oldest; returns carts removed."""
+    removed = 0
+    duplicates = carts_collection.aggregate([
+        {"$group": {"_id": "$username", "carts": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ])
+    async for group in duplicates:
+        carts = await carts_collection.find({"_id": {"$in": group["carts"]}}).sort("_id", ASCENDING).to_list(None)
+        quantities = {}
+        for cart in carts:
+            for product_id, qty in _cart_lines(cart):
+                quantities[product_id] = quantities.get(product_id, 0) + qty
+        keep, extra = carts[0], [cart["_id"] for cart in carts[1:]]
+        await carts_collection.update_one({"_id": keep["_id"]}, {"$set": {
+            "items": [{"product_id": product_id, "qty": qty} for product_id, qty in quantities.items()],
+            "item_count": sum(quantities.values())
+        }})
+        removed += (await carts_collection.delete_many({"_id": {"$in": extra}})).deleted_count
+    if removed:
+        logger.info(f"Merged away {removed} duplicate carts")
+    return removed
+
+
+async def migrate_legacy_carts() -> int:
+    """Rewrite carts that embed whole product documents as {product_id, qty} references."""
+    result = await carts_collection.update_many(
+        {"$or": [{"items._id": {"$exists": True}}, {"item_count": {"$exists": False}}]},
+        [
+            {"$set": {"items": {"$map": {
+                "input": {"$ifNull": ["$items", []]},
+                "in": {
+                    "product_id": {"$ifNull": ["$$this.product_id", "$$this._id"]},
+                    "qty": {"$ifNull": ["$$this.qty", 1]}
+                }
+            }}}},
+            {"$set": {"item_count": {"$sum": "$items.qty"}}}
+        ]
+    )
+    logger.info(f"Migrated {result.modified_count} carts to product references")
+    return result.modified_count
@@ -0,0 +1,152 @@
+import os
+import json
+import base64
+import binascii
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+
+
+# Only the fields the product grid and carousel in index.html render
+PRODUCT_CARD_PROJECTION = {"name": 1, "price": 1, "image": 1, "images": 1, "added_by": 1}
+
+PRODUCTS_PAGE_SIZE = int(os.getenv("PRODUCTS_PAGE_SIZE", "24"))
+PRODUCTS_MAX_PAGE_SIZE = int(os.getenv("PRODUCTS_MAX_PAGE_SIZE", "100"))
+
+# Keyset orderings: the last key is always _id so every position is unique
+SORT_KEYS = {
+    "newest": [("_id", -1)],
+    "price": [("price", 1), ("_id", 1)],
+    "price_desc": [("price", -1), ("_id", -1)],
+}
+
+
+def encode_cursor(product: dict, sort: str) -> str:
+    values = []
+    for field, _ in SORT_KEYS[sort]:
+        value = product.get(field)
+        values.append(str(value) if field == "_id" else value)
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        keys = SORT_KEYS[sort]
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError("cursor does not match sort order")
+        return [ObjectId(v) if field == "_id" else v for (field, _), v in zip(keys, values)]
+    except (ValueError, TypeError, InvalidId, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid page cursor")
+
+
+def _seek_filter(keys: list, values: list, forward: bool) -> dict:
+    """Build the "strictly after this position" filter for a compound sort key.
+
+    For keys (a, b) this expands to {a > va} OR {a == va AND b > vb}, with the
+    comparison flipped for descending keys and again when paging backwards.
+    """
+    clauses = []
+    for i, (field, direction) in enumerate(keys):
+        ascending = (direction == 1) == forward
+        clause = {prev_field: values[j] for j, (prev_field, _) in enumerate(keys[:i])}
+        clause[field] = {"$gt" if ascending else "$lt": values[i]}
+        clauses.append(clause)
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+def _encode_offset(offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([offset]).encode()).decode().rstrip("=")
+
+
+def _decode_offset(cursor: str) -> int:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        (offset,) = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(offset, int) or offset < 0:
+            raise ValueError("bad offset")
+        return offset
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid page cursor")
+
+
+def clamp_page_size(limit: int = None) -> int:
+    if not limit:
+        return PRODUCTS_PAGE_SIZE
+    return max(1, min(limit, PRODUCTS_MAX_PAGE_SIZE))
+
+
+async def fetch_product_page(collection, query: dict = None, sort: str = "newest", after: str = None,
+                             before: str = None, limit: int = None) -> dict:
+    """Return one keyset-paginated page of product cards.
+
+    Exactly one of ``after``/``before`` may be given; without either the first
+    page is returned. The result carries ``next_cursor``/``prev_cursor`` (None
+    at either end) so the template can link to the neighbouring pages.
+    """
+    if sort not in SORT_KEYS:
+        raise HTTPException(status_code=400, detail="Unknown sort order")
+    keys = SORT_KEYS[sort]
+    page_size = clamp_page_size(limit)
+    forward = before is None
+    cursor = after if forward else before
+
+    filters = [query] if query else []
+    if cursor:
+        filters.append(_seek_filter(keys, decode_cursor(cursor, sort), forward))
+    mongo_filter = {"$and": filters} if len(filters) > 1 else (filters[0] if filters else {})
+
+    sort_spec = keys if forward else [(field, -direction) for field, direction in keys]
+    products = await collection.find(mongo_filter, PRODUCT_CARD_PROJECTION) \
+        .sort(sort_spec).limit(page_size + 1).to_list(None)
+
+    has_more = len(products) > page_size
+    products = products[:page_size]
+    if not forward:
+        products.reverse()
+
+    next_cursor = prev_cursor = None
+    if products:
+        if (forward and has_more) or (not forward and cursor):
+            next_cursor = encode_cursor(products[-1], sort)
+        if (forward and cursor) or (not forward and has_more):
+            prev_cursor = encode_cursor(products[0], sort)
+
+    return {
+        "products": products,
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+        "page_size": page_size,
+        "sort": sort,
+    }
+
+
+async def fetch_ranked_page(collection, ranked_ids: list, after: str = None, before: str = None,
+                            limit: int = None) -> dict:
+    """Page through an already-ranked list of product ids (e.g. search results).
+
+    The ranking lives in memory, so cursors are positions in that list and a
+    page costs one ``$in`` lookup regardless of how deep it is.
+    """
+    page_size = clamp_page_size(limit)
+    if before:
+        end = min(_decode_offset(before), len(ranked_ids))
+        start = max(0, end - page_size)
+    else:
+        start = _decode_offset(after) if after else 0
+        end = start + page_size
+    page_ids = ranked_ids[start:end]
+
+    found = await collection.find({"_id": {"$in": page_ids}}, PRODUCT_CARD_PROJECTION).to_list(None)
+    by_id = {product["_id"]: product for product in found}
+    products = [by_id[_id] for _id in page_ids if _id in by_id]
+
+    return {
+        "products": products,
+        "next_cursor": _encode_offset(end) if end < len(ranked_ids) else None,
+        "prev_cursor": _encode_offset(start) if start > 0 else None,
+        "page_size": page_size,
+        "sort": "relevance",
+    }
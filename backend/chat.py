@@ -0,0 +1,258 @@
+import os
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, Set
+from fastapi import WebSocket
+
+
+logger = logging.getLogger(__name__)
+
+# Empty for the single-process in-memory broker, or e.g. redis://localhost:6379/0 to fan out across workers
+CHAT_BROKER_URL = os.getenv("CHAT_BROKER_URL", "")
+CHAT_SEND_QUEUE_SIZE = int(os.getenv("CHAT_SEND_QUEUE_SIZE", "100"))
+CHAT_CHANNEL_PREFIX = os.getenv("CHAT_CHANNEL_PREFIX", "chat:user:")
+
+# Close code sent to a client whose send queue overflowed (RFC 6455 "try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+DeliverCallback = Callable[[str, str], Awaitable[None]]
+
+
+class ChatBroker(ABC):
+    """Routes a message for a user to whichever worker holds that user's sockets.
+
+    A worker subscribes to a user while it has at least one socket for them
+    and calls ``publish`` for every outgoing message; the broker invokes the
+    ``deliver`` callback given to ``start`` on each subscribed worker.
+    """
+
+    async def start(self, deliver: DeliverCallback):
+        self._deliver = deliver
+
+    @abstractmethod
+    async def publish(self, user_id: str, message: str):
+        ...
+
+    @abstractmethod
+    async def subscribe(self, user_id: str):
+        ...
+
+    @abstractmethod
+    async def unsubscribe(self, user_id: str):
+        ...
+
+    async def close(self):
+        pass
+
+
+class InMemoryBroker(ChatBroker):
+    """Single-process broker: publishing is a direct local delivery."""
+
+    async def publish(self, user_id: str, message: str):
+        await self._deliver(user_id, message)
+
+    async def subscribe(self, user_id: str):
+        # Every socket is on this process, so there is nothing to route
+        pass
+
+    async def unsubscribe(self, user_id: str):
+        pass
+
+
+class RedisBroker(ChatBroker):
+    """Fans messages out across workers and hosts over Redis pub/sub, one channel per user.
+
+    Any Redis-protocol server works, including a local ``redis-server`` for development.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self._redis = None
+        self._pubsub = None
+        self._listener = None
+
+    async def start(self, deliver: DeliverCallback):
+        import redis.asyncio as redis
+
+        await super().start(deliver)
+        self._redis = redis.from_url(self.url, decode_responses=True)
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            try:
+                if not self._pubsub.subscribed:
+                    await asyncio.sleep(0.1)
+                    continue
+                message = await self._pubsub.get_message(timeout=1.0)
+                if message and message["type"] == "message":
+                    user_id = message["channel"][len(CHAT_CHANNEL_PREFIX):]
+                    await self._deliver(user_id, message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Chat broker listener error: {str(e)}")
+                await asyncio.sleep(1.0)
+
+    async def publish(self, user_id: str, message: str):
+        await self._redis.publish(CHAT_CHANNEL_PREFIX + user_id, message)
+
+    async def subscribe(self, user_id: str):
+        await self._pubsub.subscribe(CHAT_CHANNEL_PREFIX + user_id)
+
+    async def unsubscribe(self, user_id: str):
+        await self._pubsub.unsubscribe(CHAT_CHANNEL_PREFIX + user_id)
+
+    async def close(self):
+        if self._listener:
+            self._listener.cancel()
+        if self._pubsub:
+            await self._pubsub.aclose()
+        if self._redis:
+            await self._redis.aclose()
+
+
+def create_broker(url: str = CHAT_BROKER_URL) -> ChatBroker:
+    if not url:
+        return InMemoryBroker()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBroker(url)
+    raise ValueError(f"Unsupported CHAT_BROKER_URL: {url}")
+
+
+class Connection:
+    """One client socket with its own bounded send queue and sender task.
+
+    Messages are queued without waiting, so a client that stops reading can
+    only fill its own queue; once that overflows the socket is closed rather
+    than letting it hold up delivery to anyone else.
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: str, queue_size: int = CHAT_SEND_QUEUE_SIZE):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.closed = False
+        self._sender = asyncio.create_task(self._send_loop())
+
+    async def _send_loop(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                await self.websocket.send_text(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info(f"Dropping chat connection for {self.user_id}: {str(e)}")
+            self.closed = True
+
+    def offer(self, message: str) -> bool:
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+        self._sender.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+
+class ConnectionManager:
+    """Local sockets per user, fed by the broker.
+
+    With a ``presence`` tracker, a user is marked online when their first
+    socket on this worker opens and offline when the last one closes;
+    presence failures are logged and never break the socket itself.
+    """
+
+    def __init__(self, broker: ChatBroker = None, presence=None):
+        self.broker = broker or create_broker()
+        self.presence = presence
+        self.active_connections: Dict[str, Set[Connection]] = {}
+
+    async def start(self):
+        await self.broker.start(self.deliver_local)
+        if self.presence:
+            await self.presence.start()
+
+    async def close(self):
+        for connections in list(self.active_connections.values()):
+            for connection in list(connections):
+                await connection.close(code=1001)
+        self.active_connections.clear()
+        await self.broker.close()
+        if self.presence:
+            await self.presence.close()
+
+    async def connect(self, websocket: WebSocket, user_id: str) -> Connection:
+        await websocket.accept()
+        connection = Connection(websocket, user_id)
+        connections = self.active_connections.setdefault(user_id, set())
+        connections.add(connection)
+        if len(connections) == 1:
+            await self.broker.subscribe(user_id)
+            await self._set_presence(user_id, True)
+        return connection
+
+    async def disconnect(self, connection: Connection, code: int = 1000):
+        if self._forget(connection):
+            await self._unsubscribe_if_idle(connection.user_id)
+        await connection.close(code=code)
+
+    async def _unsubscribe_if_idle(self, user_id: str):
+        # The user may have reconnected while we were getting here
+        if user_id not in self.active_connections:
+            await self.broker.unsubscribe(user_id)
+            if user_id not in self.active_connections:
+                await self._set_presence(user_id, False)
+
+    async def _set_presence(self, user_id: str, online: bool):
+        if not self.presence:
+            return
+        try:
+            if online:
+                await self.presence.online(user_id)
+            else:
+                await self.presence.offline(user_id)
+        except Exception as e:
+            logger.error(f"Failed to update presence for {user_id}: {str(e)}")
+
+    def _forget(self, connection: Connection) -> bool:
+        """Stop routing to ``connection``; True if it was the user's last socket here."""
+        connections = self.active_connections.get(connection.user_id)
+        if connections is None or connection not in connections:
+            return False
+        connections.discard(connection)
+        if connections:
+            return False
+        del self.active_connections[connection.user_id]
+        return True
+
+    async def send_personal_message(self, message: str, user_id: str):
+        await self.broker.publish(user_id, message)
+
+    async def deliver_local(self, user_id: str, message: str):
+        """Queue ``message`` on every socket this worker holds for ``user_id``.
+
+        Never waits on a client: a connection whose queue is full is dropped
+        from routing at once and closed in the background.
+        """
+        for connection in list(self.active_connections.get(user_id, ())):
+            if not connection.offer(message):
+                logger.warning(f"Closing slow or dead chat connection for {user_id}")
+                last = self._forget(connection)
+                asyncio.create_task(self._close_dropped(connection, last))
+
+    async def _close_dropped(self, connection: Connection, last: bool):
+        if last:
+            await self._unsubscribe_if_idle(connection.user_id)
+        await connection.close(code=SLOW_CONSUMER_CLOSE_CODE)
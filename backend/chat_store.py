@@ -0,0 +1,323 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+from database import chat_messages_collection, unread_collection
+
+
+logger = logging.getLogger(__name__)
+
+CHAT_WRITE_BATCH_SIZE = int(os.getenv("CHAT_WRITE_BATCH_SIZE", "200"))
+CHAT_WRITE_FLUSH_MS = int(os.getenv("CHAT_WRITE_FLUSH_MS", "250"))
+CHAT_WRITE_QUEUE_SIZE = int(os.getenv("CHAT_WRITE_QUEUE_SIZE", "10000"))
+CHAT_WRITE_MAX_RETRIES = int(os.getenv("CHAT_WRITE_MAX_RETRIES", "3"))
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "50"))
+CHAT_HISTORY_MAX_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_MAX_PAGE_SIZE", "200"))
+UNREAD_MAX_CONVERSATIONS = int(os.getenv("UNREAD_MAX_CONVERSATIONS", "500"))
+# How far before a "since" cursor to look again for messages that were stored late
+CHAT_SINCE_LOOKBACK_SECONDS = int(os.getenv("CHAT_SINCE_LOOKBACK_SECONDS", "60"))
+
+DUPLICATE_KEY_ERROR = 11000
+
+# Marks the end of the stream for the flusher on shutdown
+_STOP = object()
+
+# Messages are keyed by conversation and ordered by _id, which is assigned when the
+# server receives the message (not when the write-behind buffer flushes it):
+#   {"_id": ObjectId, "conversation_id": str, "sender": ..., "receiver": ..., "message": ..., "timestamp": iso}
+#
+# Unread counts are counters kept next to the messages, one per (receiver, sender) pair:
+#   {"receiver": str, "sender": str, "count": int}
+
+
+def conversation_id(user1: str, user2: str) -> str:
+    """The same id for both directions of a conversation; JSON keeps any username unambiguous."""
+    return json.dumps(sorted([user1, user2]), separators=(",", ":"))
+
+
+async def ensure_chat_indexes():
+    # Serves both "before X" and "since Y" pages of one conversation
+    await chat_messages_collection.create_index(
+        [("conversation_id", ASCENDING), ("_id", ASCENDING)], name="messages_by_conversation"
+    )
+    await unread_collection.create_index(
+        [("receiver", ASCENDING), ("sender", ASCENDING)], unique=True, name="unread_by_receiver"
+    )
+
+
+def new_message(sender: str, receiver: str, message: str) -> dict:
+    return {
+        "_id": ObjectId(),
+        "conversation_id": conversation_id(sender, receiver),
+        "sender": sender,
+        "receiver": receiver,
+        "message": message,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+def serialize_message(doc: dict) -> dict:
+    return {**doc, "_id": str(doc["_id"])}
+
+
+def _parse_message_id(value: str) -> ObjectId:
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid message cursor")
+
+
+def _lookback_start(since: ObjectId) -> ObjectId:
+    return ObjectId.from_datetime(since.generation_time - timedelta(seconds=CHAT_SINCE_LOOKBACK_SECONDS))
+
+
+async def latest_message_id(user1: str, user2: str):
+    """Id of the newest stored message between two users (None if there are none); an index-only lookup."""
+    latest = await chat_messages_collection.find_one(
+        {"conversation_id": conversation_id(user1, user2)}, {"_id": 1}, sort=[("_id", DESCENDING)]
+    )
+    return latest["_id"] if latest else None
+
+
+async def recent_message_count(user1: str, user2: str, since: str) -> int:
+    """How many messages a ``since`` page looks at, so a message stored late changes its ETag."""
+    return await chat_messages_collection.count_documents({
+        "conversation_id": conversation_id(user1, user2),
+        "_id": {"$gte": _lookback_start(_parse_message_id(since))}
+    })
+
+
+async def fetch_messages(user1: str, user2: str, before: str = None, since: str = None,
+                         limit: int = CHAT_HISTORY_PAGE_SIZE) -> dict:
+    """A page of a conversation, always returned oldest-first.
+
+    With ``since`` it is the messages after that id (the delta a client needs
+    after reconnecting); otherwise it is the newest ``limit`` messages, or the
+    ones just before ``before`` when paging back. ``has_more`` says whether
+    another page exists in the same direction.
+
+    Ids are assigned when a message is received, by whichever worker received
+    it, and the write-behind buffer stores them a little later. So a message
+    with an id just below ``since`` can show up after ``since`` was read. A
+    ``since`` page therefore also repeats the messages from the last
+    ``CHAT_SINCE_LOOKBACK_SECONDS`` before the cursor; clients skip the ids
+    they already have.
+    """
+    limit = max(1, min(limit, CHAT_HISTORY_MAX_PAGE_SIZE))
+    query = {"conversation_id": conversation_id(user1, user2)}
+    recent = []
+    if since:
+        since_id = _parse_message_id(since)
+        query["_id"] = {"$gt": since_id}
+        direction = ASCENDING
+        recent = await chat_messages_collection.find(
+            {"conversation_id": query["conversation_id"], "_id": {"$gte": _lookback_start(since_id), "$lte": since_id}},
+            {"conversation_id": 0}
+        ).sort("_id", ASCENDING).limit(CHAT_HISTORY_MAX_PAGE_SIZE).to_list(None)
+    else:
+        if before:
+            query["_id"] = {"$lt": _parse_message_id(before)}
+        direction = DESCENDING
+
+    messages = await chat_messages_collection.find(query, {"conversation_id": 0}) \
+        .sort("_id", direction).limit(limit + 1).to_list(None)
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if direction == DESCENDING:
+        messages.reverse()
+    return {"messages": [serialize_message(m) for m in recent + messages], "has_more": has_more}
+
+
+async def migrate_legacy_messages(batch_size: int = 1000) -> int:
+    """Stamp messages stored before conversation ids existed. Safe to re-run."""
+    migrated = 0
+    updates = []
+    async for doc in chat_messages_collection.find({"conversation_id": {"$exists": False}},
+                                                   {"sender": 1, "receiver": 1}):
+        updates.append(UpdateOne(
+            {"_id": doc["_id"]},
+            {"$set": {"conversation_id": conversation_id(doc["sender"], doc["receiver"])}}
+        ))
+        if len(updates) >= batch_size:
+            migrated += (await chat_messages_collection.bulk_write(updates, ordered=False)).modified_count
+            updates = []
+    if updates:
+        migrated += (await chat_messages_collection.bulk_write(updates, ordered=False)).modified_count
+    logger.info(f"Added conversation ids to {migrated} chat messages")
+    return migrated
+
+
+async def record_unread(messages: list):
+    """Add messages to their receivers' unread counters, one upsert per (receiver, sender) pair."""
+    increments = {}
+    for message in messages:
+        if message["sender"] != message["receiver"]:
+            pair = (message["receiver"], message["sender"])
+            increments[pair] = increments.get(pair, 0) + 1
+    if not increments:
+        return
+    await unread_collection.bulk_write([
+        UpdateOne({"receiver": receiver, "sender": sender}, {"$inc": {"count": count}}, upsert=True)
+        for (receiver, sender), count in increments.items()
+    ], ordered=False)
+
+
+async def mark_read(receiver: str, sender: str):
+    await unread_collection.update_one({"receiver": receiver, "sender": sender, "count": {"$gt": 0}},
+                                       {"$set": {"count": 0}})
+
+
+async def unread_counts(receiver: str, senders: Optional[Iterable[str]] = None) -> dict:
+    """``{sender: count}`` of unread messages for ``receiver``, optionally only from ``senders``."""
+    query = {"receiver": receiver, "count": {"$gt": 0}}
+    if senders is not None:
+        query["sender"] = {"$in": list(senders)}
+    rows = await unread_collection.find(query, {"sender": 1, "count": 1, "_id": 0}) \
+        .limit(UNREAD_MAX_CONVERSATIONS).to_list(None)
+    return {row["sender"]: row["count"] for row in rows}
+
+
+class MessageWriter:
+    """Write-behind buffer for chat messages.
+
+    ``write`` only queues the document; a background task collects queued
+    messages and stores them with one ``insert_many`` per batch, flushing when
+    ``batch_size`` messages are waiting or ``flush_interval`` seconds after the
+    first one arrived, whichever comes first. ``close`` drains the queue, so a
+    graceful shutdown loses nothing. When the queue is full ``write`` waits,
+    which slows the sending socket down instead of dropping its messages.
+    """
+
+    def __init__(self, collection, batch_size: int = CHAT_WRITE_BATCH_SIZE,
+                 flush_interval: float = CHAT_WRITE_FLUSH_MS / 1000,
+                 queue_size: int = CHAT_WRITE_QUEUE_SIZE, max_retries: int = CHAT_WRITE_MAX_RETRIES):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.queue: asyncio.Queue = None
+        self._queue_size = queue_size
+        self._flusher = None
+        self._closing = False
+        self.queued = 0
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    async def start(self):
+        # Created here rather than in __init__ so the queue binds to the running loop
+        self.queue = asyncio.Queue(maxsize=self._queue_size)
+        self._closing = False
+        self._flusher = asyncio.create_task(self._run())
+
+    async def write(self, message: dict):
+        if self._flusher is None or self._closing:
+            # Not running (e.g. during shutdown): fall back to a direct insert
+            await self.collection.insert_one(message)
+            return
+        await self.queue.put(message)
+        self.queued += 1
+
+    async def close(self):
+        if self._flusher is None:
+            return
+        self._closing = True
+        await self.queue.put(_STOP)
+        await self._flusher
+        self._flusher = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            first = await self.queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                if not self.queue.empty():
+                    message = self.queue.get_nowait()
+                else:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        message = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if message is _STOP:
+                    stopping = True
+                    break
+                batch.append(message)
+            await self._flush(batch)
+
+        # Anything queued behind the stop marker still gets written
+        remaining = []
+        while not self.queue.empty():
+            message = self.queue.get_nowait()
+            if message is not _STOP:
+                remaining.append(message)
+        for start in range(0, len(remaining), self.batch_size):
+            await self._flush(remaining[start:start + self.batch_size])
+
+    async def _flush(self, batch: list):
+        start = time.perf_counter()
+        pending = batch
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.collection.insert_many(pending, ordered=False)
+                pending = []
+                break
+            except BulkWriteError as e:
+                # insert_many stamps each document with its _id, so anything that did
+                # land on an earlier attempt comes back as a duplicate key: that's written
+                errors = e.details.get("writeErrors", [])
+                pending = [pending[error["index"]] for error in errors if error.get("code") != DUPLICATE_KEY_ERROR]
+                if not pending:
+                    break
+                logger.warning(f"Chat write batch partially failed, retrying {len(pending)} messages")
+            except Exception as e:
+                logger.warning(f"Chat write batch failed (attempt {attempt + 1}): {str(e)}")
+            if attempt < self.max_retries:
+                await asyncio.sleep(min(0.1 * 2 ** attempt, 2.0))
+
+        if pending:
+            logger.error(f"Dropping {len(pending)} chat messages after {self.max_retries} retries")
+            self.failed += len(pending)
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.flushes += 1
+        self.written += len(batch) - len(pending)
+        self.last_batch_size = len(batch)
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self._total_flush_ms += elapsed_ms
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "queued": self.queued,
+            "written": self.written,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "last_batch_size": self.last_batch_size,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "avg_flush_ms": round(self._total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+            "max_flush_ms": round(self.max_flush_ms, 2),
+        }
+
+
+message_writer = MessageWriter(chat_messages_collection)
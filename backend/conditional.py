@@ -0,0 +1,62 @@
+import json
+import hashlib
+from pathlib import Path
+from typing import Optional
+from starlette.requests import Request
+from starlette.responses import Response
+from assets import asset_manifest
+
+
+TEMPLATE_DIR = Path(__file__).parent.parent / "frontend" / "templates"
+
+# Pages vary by viewer, so only the browser may keep them, and it must revalidate every time
+CACHE_CONTROL = "private, no-cache"
+
+_render_fingerprint = None
+
+
+def render_fingerprint() -> str:
+    """Hash of the templates and asset URLs, so a deploy that changes the markup changes every ETag.
+
+    Computed on first use, after startup has built the asset manifest, and the
+    same in every worker.
+    """
+    global _render_fingerprint
+    if _render_fingerprint is None:
+        digest = hashlib.sha1()
+        for path in sorted(TEMPLATE_DIR.rglob("*.html")):
+            digest.update(path.name.encode())
+            digest.update(path.read_bytes())
+        digest.update(json.dumps(asset_manifest.entries, sort_keys=True).encode())
+        _render_fingerprint = digest.hexdigest()
+    return _render_fingerprint
+
+
+def make_etag(*parts) -> str:
+    """Weak ETag over the version fields (and viewer, query params...) a response depends on.
+
+    Weak because the same version may go out gzip- or brotli-encoded.
+    """
+    raw = json.dumps([render_fingerprint(), *[str(part) for part in parts]])
+    return f'W/"{hashlib.sha1(raw.encode()).hexdigest()[:24]}"'
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """A 304 if the request's If-None-Match already names ``etag``, else None."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    if header.strip() != "*" and _opaque(etag) not in {_opaque(tag) for tag in header.split(",")}:
+        return None
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+def tag(response: Response, etag: str) -> Response:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return response
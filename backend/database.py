@@ -0,0 +1,123 @@
+import os
+import asyncio
+import logging
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.server_api import ServerApi
+from metrics import METRICS_ENABLED, command_listener
+
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.warning(f"Ignoring non-integer value for {name}: {value!r}")
+        return default
+
+
+# Connection pool and timeout settings (all overridable from the environment)
+MONGO_URI = os.getenv("MONGO_URI")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "marketplace_db")
+MONGO_MAX_POOL_SIZE = _env_int("MONGO_MAX_POOL_SIZE", 100)
+MONGO_MIN_POOL_SIZE = _env_int("MONGO_MIN_POOL_SIZE", 0)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = _env_int("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)
+MONGO_CONNECT_TIMEOUT_MS = _env_int("MONGO_CONNECT_TIMEOUT_MS", 5000)
+MONGO_SOCKET_TIMEOUT_MS = _env_int("MONGO_SOCKET_TIMEOUT_MS", 10000)
+MONGO_WAIT_QUEUE_TIMEOUT_MS = _env_int("MONGO_WAIT_QUEUE_TIMEOUT_MS", 5000)
+
+
+def create_client(uri: str = None) -> AsyncIOMotorClient:
+    """Build an AsyncIOMotorClient configured from the environment.
+
+    Creating the client does no I/O; connections are opened lazily by the
+    driver's pool the first time a coroutine awaits an operation.
+    """
+    return AsyncIOMotorClient(
+        uri or MONGO_URI,
+        server_api=ServerApi('1'),
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        event_listeners=[command_listener] if METRICS_ENABLED else [],
+    )
+
+
+client: AsyncIOMotorClient = None
+db = None
+
+
+def get_db():
+    """The database handle, creating the client on first use.
+
+    The app calls ``connect()`` from its lifespan instead, so building the
+    client (which for mongodb+srv:// URIs includes a blocking DNS lookup)
+    happens off the event loop and never at import time.
+    """
+    global client, db
+    if db is None:
+        client = create_client()
+        db = client[MONGO_DB_NAME]
+    return db
+
+
+async def connect():
+    global client, db
+    if db is None:
+        client = await asyncio.to_thread(create_client)
+        db = client[MONGO_DB_NAME]
+
+
+def close():
+    global client, db
+    if client is not None:
+        client.close()
+    client, db = None, None
+
+
+class LazyCollection:
+    """A named collection that resolves against the client once there is one.
+
+    Lets other modules keep importing collections at module level while the
+    client itself is only created at startup.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_db()[self.name], attr)
+
+    def __repr__(self):
+        return f"LazyCollection({self.name!r})"
+
+
+# MongoDB Collection references
+products_collection = LazyCollection("products")
+users_collection = LazyCollection("users")
+carts_collection = LazyCollection("carts")
+chat_messages_collection = LazyCollection("chat_messages")
+reviews_collection = LazyCollection("reviews")
+otps_collection = LazyCollection("otps")
+sellers_collection = LazyCollection("sellers")
+versions_collection = LazyCollection("versions")
+presence_collection = LazyCollection("presence")
+unread_collection = LazyCollection("unread_counts")
+product_stats_collection = LazyCollection("product_stats")
+seller_stats_collection = LazyCollection("seller_stats")
+sessions_collection = LazyCollection("sessions")
+
+
+async def ping():
+    """Round-trip to the deployment; raises if it is unreachable."""
+    await get_db().client.admin.command('ping')
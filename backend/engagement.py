@@ -0,0 +1,218 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+from database import product_stats_collection, seller_stats_collection
+
+
+logger = logging.getLogger(__name__)
+
+ENGAGEMENT_FLUSH_SECONDS = float(os.getenv("ENGAGEMENT_FLUSH_SECONDS", "10"))
+# Distinct (product, day) counters held before flushing early, and the most kept
+# across failed flushes before new increments are dropped
+ENGAGEMENT_FLUSH_KEYS = int(os.getenv("ENGAGEMENT_FLUSH_KEYS", "5000"))
+ENGAGEMENT_MAX_PENDING_KEYS = int(os.getenv("ENGAGEMENT_MAX_PENDING_KEYS", "100000"))
+ENGAGEMENT_TREND_DAYS = int(os.getenv("ENGAGEMENT_TREND_DAYS", "30"))
+ENGAGEMENT_PRODUCT_DAYS = int(os.getenv("ENGAGEMENT_PRODUCT_DAYS", "7"))
+
+VIEWS = "views"
+CART_ADDS = "cart_adds"
+RATINGS = "ratings"
+FIELDS = (VIEWS, CART_ADDS, RATINGS, "rating_sum")
+
+# Daily rollups, written only by the counter flush:
+#   product_stats: {"product_id": str, "day": datetime (UTC midnight), "seller": str,
+#                   "views": int, "cart_adds": int, "ratings": int, "rating_sum": int}
+#   seller_stats:  {"seller": str, "day": datetime, "views", "cart_adds", "ratings", "rating_sum"}
+
+
+async def ensure_engagement_indexes():
+    await product_stats_collection.create_index(
+        [("product_id", ASCENDING), ("day", ASCENDING)], unique=True, name="product_stats_by_day"
+    )
+    # The dashboard's per-product totals for one seller
+    await product_stats_collection.create_index(
+        [("seller", ASCENDING), ("day", ASCENDING)], name="product_stats_by_seller"
+    )
+    await seller_stats_collection.create_index(
+        [("seller", ASCENDING), ("day", ASCENDING)], unique=True, name="seller_stats_by_day"
+    )
+
+
+def day_bucket(when: datetime = None) -> datetime:
+    when = when or datetime.utcnow()
+    return datetime(when.year, when.month, when.day)
+
+
+def _merge(into: dict, key, counts: dict):
+    totals = into.get(key)
+    if totals is None:
+        totals = into[key] = dict.fromkeys(FIELDS, 0)
+    for field, amount in counts.items():
+        totals[field] += amount
+
+
+async def _write_counters(collection, counters: dict, operations: list) -> dict:
+    """Run ``operations`` (one per counter, in the dict's order) as an unordered bulk write.
+
+    Returns the counters whose operation failed. The others were applied, so
+    retrying them would count them twice.
+    """
+    try:
+        await collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        keys = list(counters)
+        failed = [keys[error["index"]] for error in e.details.get("writeErrors", [])]
+        logger.error(f"Engagement counter write partially failed, keeping {len(failed)} of {len(keys)} "
+                     f"counters for the next flush: {str(e)}")
+        return {key: counters[key] for key in failed}
+    return {}
+
+
+class EngagementCounters:
+    """In-process counters for product views, cart adds and ratings.
+
+    ``record`` only adds to a dict. A background task flushes the totals
+    every ``flush_interval`` seconds (or early once ``flush_keys`` distinct
+    product-days are waiting) as one bulk ``$inc`` upsert per collection,
+    into the product's and the seller's document for the day. A failed
+    flush is merged back and retried with the next one; ``close`` lets a
+    flush in progress finish and then flushes what is left.
+    """
+
+    def __init__(self, flush_interval: float = ENGAGEMENT_FLUSH_SECONDS, flush_keys: int = ENGAGEMENT_FLUSH_KEYS,
+                 max_pending_keys: int = ENGAGEMENT_MAX_PENDING_KEYS):
+        self.flush_interval = flush_interval
+        self.flush_keys = flush_keys
+        self.max_pending_keys = max_pending_keys
+        # (product_id, seller, day) and (seller, day) -> {field: increment}
+        self._products = {}
+        self._sellers = {}
+        self._flusher = None
+        self._wake = None
+        self._stopping = False
+        self.recorded = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.last_flush_ms = 0.0
+
+    async def start(self):
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._flusher = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._flusher is None:
+            return
+        # Cancelling could interrupt a flush after it swapped the counters out, losing them
+        self._stopping = True
+        self._wake.set()
+        await self._flusher
+        self._flusher = None
+        await self.flush()
+
+    def record(self, product_id, seller: str, event: str, rating: int = None):
+        if len(self._products) >= self.max_pending_keys:
+            # The database has been unreachable for a while; don't grow without bound
+            self.dropped += 1
+            return
+        counts = {event: 1}
+        if rating is not None:
+            counts["rating_sum"] = rating
+        day = day_bucket()
+        _merge(self._products, (str(product_id), seller, day), counts)
+        _merge(self._sellers, (seller, day), counts)
+        self.recorded += 1
+        if self._wake is not None and len(self._products) >= self.flush_keys:
+            self._wake.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._stopping:
+                # close() does the last flush
+                break
+            await self.flush()
+
+    async def flush(self):
+        if not self._products and not self._sellers:
+            return
+        start = time.perf_counter()
+        products, self._products = self._products, {}
+        sellers, self._sellers = self._sellers, {}
+        try:
+            if products:
+                products = await _write_counters(product_stats_collection, products, [
+                    UpdateOne({"product_id": product_id, "day": day},
+                              {"$inc": counts, "$setOnInsert": {"seller": seller}}, upsert=True)
+                    for (product_id, seller, day), counts in products.items()
+                ])
+            if sellers:
+                sellers = await _write_counters(seller_stats_collection, sellers, [
+                    UpdateOne({"seller": seller, "day": day}, {"$inc": counts}, upsert=True)
+                    for (seller, day), counts in sellers.items()
+                ])
+        except Exception as e:
+            logger.error(f"Engagement counter flush failed, keeping {len(products) + len(sellers)} "
+                         f"counters for the next one: {str(e)}")
+        finally:
+            # Whatever wasn't written goes back, on top of anything recorded meanwhile
+            for key, counts in products.items():
+                _merge(self._products, key, counts)
+            for key, counts in sellers.items():
+                _merge(self._sellers, key, counts)
+
+        self.flushes += 1
+        if products or sellers:
+            self.failed_flushes += 1
+        self.last_flush_ms = (time.perf_counter() - start) * 1000
+
+    def stats(self) -> dict:
+        return {
+            "pending_keys": len(self._products) + len(self._sellers),
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+        }
+
+
+async def seller_trend(seller: str, days: int = ENGAGEMENT_TREND_DAYS) -> list:
+    """One row per day, oldest first, for the last ``days`` days (zeros where nothing happened)."""
+    today = day_bucket()
+    first = today - timedelta(days=days - 1)
+    rows = await seller_stats_collection.find(
+        {"seller": seller, "day": {"$gte": first}}, {"_id": 0, "seller": 0}
+    ).sort("day", ASCENDING).to_list(None)
+    by_day = {row["day"]: row for row in rows}
+    trend = []
+    for offset in range(days):
+        day = first + timedelta(days=offset)
+        row = by_day.get(day, {})
+        counts = {field: row.get(field, 0) for field in FIELDS}
+        counts["average_rating"] = round(counts["rating_sum"] / counts[RATINGS], 2) if counts[RATINGS] else None
+        trend.append({"day": day.date().isoformat(), **counts})
+    return trend
+
+
+async def product_totals(seller: str, days: int = ENGAGEMENT_PRODUCT_DAYS) -> dict:
+    """``{product_id: {views, cart_adds, ratings, rating_sum}}`` over the seller's last ``days`` days."""
+    first = day_bucket() - timedelta(days=days - 1)
+    totals = {}
+    async for row in product_stats_collection.find(
+        {"seller": seller, "day": {"$gte": first}}, {"_id": 0, "product_id": 1, **dict.fromkeys(FIELDS, 1)}
+    ):
+        _merge(totals, row["product_id"], {field: row.get(field, 0) for field in FIELDS})
+    return totals
+
+
+engagement = EngagementCounters()
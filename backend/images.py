@@ -0,0 +1,170 @@
+import os
+import uuid
+import shutil
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import aiofiles
+import aiofiles.os
+from fastapi import HTTPException, UploadFile
+
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = Path(__file__).parent.parent / "frontend" / "static" / "uploads"
+UPLOAD_URL_PREFIX = "/static/uploads"
+
+IMAGE_MAX_UPLOAD_BYTES = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+# Variant name -> longest side in pixels. Images are only ever scaled down.
+IMAGE_VARIANTS = {
+    "thumb": 320,
+    "card": 640,
+    "full": 1600,
+}
+
+# Formats Pillow may decode, and the extension the original is stored with. The client's filename
+# is never used: /static would serve an image that is also valid HTML or SVG as a page.
+IMAGE_FORMATS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp", "GIF": ".gif"}
+
+# Uploads are stored by content hash, so the same image uploaded twice is kept once:
+#   uploads/<sha256>/original<ext for its format>, uploads/<sha256>/thumb.webp, card.webp, full.webp
+
+_pool = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+
+def _render_variants(original: str, out_dir: str, quality: int = IMAGE_QUALITY) -> str:
+    """Write every variant of ``original`` into ``out_dir`` and return the extension for its format.
+
+    Runs in a worker process.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(original, formats=list(IMAGE_FORMATS)) as source:
+        ext = IMAGE_FORMATS[source.format]
+        # Apply camera rotation before it is lost with the EXIF data
+        image = ImageOps.exif_transpose(source)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        for name, size in IMAGE_VARIANTS.items():
+            variant = image.copy()
+            variant.thumbnail((size, size), Image.LANCZOS)
+            path = os.path.join(out_dir, f"{name}.webp")
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            variant.save(tmp_path, "WEBP", quality=quality, method=4)
+            os.replace(tmp_path, path)
+    return ext
+
+
+def variant_urls(digest: str) -> dict:
+    return {name: f"{UPLOAD_URL_PREFIX}/{digest}/{name}.webp" for name in IMAGE_VARIANTS}
+
+
+def _variants_exist(out_dir: Path) -> bool:
+    return all((out_dir / f"{name}.webp").exists() for name in IMAGE_VARIANTS)
+
+
+async def _store(tmp_path: Path, digest: str) -> dict:
+    """Render a hashed temp file's variants and move it into place, unless it's already stored."""
+    out_dir = UPLOAD_DIR / digest
+    if _variants_exist(out_dir):
+        await aiofiles.os.remove(tmp_path)
+        return variant_urls(digest)
+
+    await aiofiles.os.makedirs(out_dir, exist_ok=True)
+    loop = asyncio.get_running_loop()
+    try:
+        ext = await loop.run_in_executor(_get_pool(), _render_variants, str(tmp_path), str(out_dir))
+    except Exception as e:
+        logger.warning(f"Rejected upload {digest}: {str(e)}")
+        await aiofiles.os.remove(tmp_path)
+        await asyncio.to_thread(shutil.rmtree, out_dir, True)
+        raise HTTPException(status_code=400, detail="Uploaded file is not a supported image")
+    await aiofiles.os.replace(tmp_path, out_dir / f"original{ext}")
+    return variant_urls(digest)
+
+
+async def save_upload(upload: UploadFile) -> dict:
+    """Stream an upload to disk, hashing as it goes, and return its variant URLs.
+
+    Nothing here blocks the event loop: the body is read and written in
+    chunks and resizing happens in a worker process.
+    """
+    await aiofiles.os.makedirs(UPLOAD_DIR, exist_ok=True)
+    tmp_path = UPLOAD_DIR / f".upload-{uuid.uuid4().hex}"
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as out:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > IMAGE_MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail="Image is too large")
+                digest.update(chunk)
+                await out.write(chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Uploaded file is empty")
+    except BaseException:
+        if await aiofiles.os.path.exists(tmp_path):
+            await aiofiles.os.remove(tmp_path)
+        raise
+
+    return await _store(tmp_path, digest.hexdigest())
+
+
+async def import_local_image(path: Path) -> dict:
+    """Run an image already on disk (e.g. a pre-pipeline upload) through the same storage."""
+    digest = hashlib.sha256()
+    tmp_path = UPLOAD_DIR / f".upload-{uuid.uuid4().hex}"
+    async with aiofiles.open(path, "rb") as source, aiofiles.open(tmp_path, "wb") as out:
+        while chunk := await source.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+            await out.write(chunk)
+    return await _store(tmp_path, digest.hexdigest())
+
+
+def image_variant(product: dict, variant: str = "thumb") -> str:
+    """URL of a product image variant, falling back to the original for older products."""
+    images = product.get("images") or {}
+    return images.get(variant) or product.get("image", "")
+
+
+async def backfill_image_variants(collection) -> int:
+    """Generate variants for products stored before the upload pipeline. Safe to re-run."""
+    converted = 0
+    async for product in collection.find({"images": {"$exists": False}, "image": {"$exists": True}},
+                                         {"image": 1}):
+        url = product.get("image") or ""
+        if not url.startswith(UPLOAD_URL_PREFIX + "/"):
+            continue
+        path = UPLOAD_DIR / url[len(UPLOAD_URL_PREFIX) + 1:]
+        if not path.is_file():
+            logger.warning(f"Missing image for product {product['_id']}: {path}")
+            continue
+        try:
+            images = await import_local_image(path)
+        except HTTPException:
+            logger.warning(f"Skipping unreadable image for product {product['_id']}: {path}")
+            continue
+        await collection.update_one({"_id": product["_id"]}, {"$set": {"images": images, "image": images["full"]}, "$inc": {"version": 1}})
+        converted += 1
+    logger.info(f"Generated image variants for {converted} products")
+    return converted
@@ -0,0 +1,136 @@
+import logging
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from database import products_collection, users_collection, carts_collection, chat_messages_collection, \
+    reviews_collection, otps_collection, sellers_collection, presence_collection, unread_collection, \
+    product_stats_collection, seller_stats_collection
+from auth import ensure_session_indexes
+from carts import ensure_cart_indexes
+from chat_store import ensure_chat_indexes
+from otp import ensure_otp_indexes
+from presence import ensure_presence_indexes
+from engagement import ensure_engagement_indexes
+from reviews import ensure_review_indexes
+from sellers import SORT_KEYS as SELLER_SORT_KEYS, ensure_seller_indexes
+
+
+logger = logging.getLogger(__name__)
+
+# (collection, keys, options). create_index is a no-op when an identical index
+# exists, so this runs on every startup.
+INDEXES = [
+    (users_collection, [("username", ASCENDING)], {"unique": True, "name": "unique_username"}),
+    (users_collection, [("email", ASCENDING)], {"unique": True, "name": "unique_email"}),
+    (products_collection, [("added_by", ASCENDING), ("_id", DESCENDING)], {"name": "products_by_seller"}),
+    # Keyset pages sorted by price (catalog.SORT_KEYS)
+    (products_collection, [("price", ASCENDING), ("_id", ASCENDING)], {"name": "products_by_price"}),
+]
+
+
+async def ensure_indexes():
+    """Create every index the routes rely on. Idempotent; safe to run concurrently from each worker."""
+    for collection, keys, options in INDEXES:
+        try:
+            await collection.create_index(keys, **options)
+        except OperationFailure as e:
+            # Typically a unique index over data that already has duplicates: keep serving,
+            # but this needs cleaning up before the index (and its guarantee) can exist
+            logger.error(f"Could not create index {options['name']} on {collection.name}: {str(e)}")
+    await ensure_cart_indexes()
+    await ensure_session_indexes()
+    await ensure_review_indexes()
+    await ensure_chat_indexes()
+    await ensure_otp_indexes()
+    await ensure_seller_indexes()
+    await ensure_presence_indexes()
+    await ensure_engagement_indexes()
+
+
+def _stages(plan: dict):
+    """Every stage name in an explain plan tree (classic or slot-based engine)."""
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan", "outerStage", "innerStage"):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _stages(child)
+
+
+def _index_names(plan: dict):
+    if not isinstance(plan, dict):
+        return
+    if "indexName" in plan:
+        yield plan["indexName"]
+    for key in ("inputStage", "queryPlan", "outerStage", "innerStage"):
+        if key in plan:
+            yield from _index_names(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _index_names(child)
+
+
+# Every query shape the routes issue: (description, collection, filter, sort, full scan expected).
+# Values are placeholders; explain only needs the shape.
+_ID = ObjectId("000000000000000000000000")
+_NOW = datetime(2000, 1, 1)
+QUERY_SHAPES = [
+    ("home: newest page", products_collection, {}, [("_id", DESCENDING)], False),
+    ("home: next newest page", products_collection, {"_id": {"$lt": _ID}}, [("_id", DESCENDING)], False),
+    ("home: price page", products_collection, {"$or": [{"price": {"$gt": 1}}, {"price": 1, "_id": {"$gt": _ID}}]},
+     [("price", ASCENDING), ("_id", ASCENDING)], False),
+    ("home: search results", products_collection, {"_id": {"$in": [_ID]}}, [("_id", DESCENDING)], False),
+    ("product page", products_collection, {"_id": _ID}, None, False),
+    ("seller dashboard", products_collection, {"added_by": "seller"}, None, False),
+    ("search index rebuild", products_collection, {}, None, True),
+    ("login / profile", users_collection, {"username": "user"}, None, False),
+    ("register: email taken", users_collection, {"email": "user@gmail.com"}, None, False),
+    ("sellers by name", sellers_collection, {}, SELLER_SORT_KEYS["name"], False),
+    ("sellers by products", sellers_collection, {}, SELLER_SORT_KEYS["products"], False),
+    ("sellers by rating", sellers_collection, {}, SELLER_SORT_KEYS["rating"], False),
+    ("sellers by recent", sellers_collection, {}, SELLER_SORT_KEYS["recent"], False),
+    ("sellers rebuild", products_collection, {}, None, True),
+    ("related products: carts", carts_collection, {}, None, True),
+    ("related products: reviews", reviews_collection, {"target_type": "product"}, None, False),
+    ("cart", carts_collection, {"username": "user"}, None, False),
+    ("reviews page", reviews_collection, {"target_type": "product", "target_id": str(_ID), "_id": {"$lt": _ID}},
+     [("_id", DESCENDING)], False),
+    ("chat history", chat_messages_collection, {"conversation_id": '["a","b"]', "_id": {"$lt": _ID}},
+     [("_id", DESCENDING)], False),
+    ("chat delta", chat_messages_collection, {"conversation_id": '["a","b"]', "_id": {"$gt": _ID}},
+     [("_id", ASCENDING)], False),
+    ("chat directory", users_collection, {"username": {"$gt": "a", "$lt": "a\uffff"}}, [("username", ASCENDING)],
+     False),
+    ("chat unread counts", unread_collection, {"receiver": "user", "count": {"$gt": 0}}, None, False),
+    ("chat online list", presence_collection, {"user": {"$gt": "a"}, "expires_at": {"$gt": _NOW}},
+     [("user", ASCENDING)], False),
+    ("dashboard: seller trend", seller_stats_collection, {"seller": "seller", "day": {"$gte": _NOW}},
+     [("day", ASCENDING)], False),
+    ("dashboard: product totals", product_stats_collection, {"seller": "seller", "day": {"$gte": _NOW}}, None,
+     False),
+    ("otp check", otps_collection, {"_id": "user@gmail.com"}, None, False),
+]
+
+
+async def explain_query_shapes() -> list:
+    """Explain each query shape and report its plan, flagging unexpected collection scans."""
+    results = []
+    for description, collection, query, sort, scan_expected in QUERY_SHAPES:
+        cursor = collection.find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = (await cursor.explain())["queryPlanner"]["winningPlan"]
+        stages = list(dict.fromkeys(_stages(plan)))
+        collscan = "COLLSCAN" in stages
+        results.append({
+            "query": description,
+            "collection": collection.name,
+            "stages": stages,
+            "indexes": list(dict.fromkeys(_index_names(plan))),
+            "collscan": collscan,
+            "flagged": collscan and not scan_expected,
+        })
+    return results
@@ -0,0 +1,171 @@
+import os
+import asyncio
+import logging
+import smtplib
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from dotenv import load_dotenv
+
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() not in ("0", "false", "no")
+SMTP_EMAIL = os.getenv("SMTP_EMAIL")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_TIMEOUT_SECONDS = float(os.getenv("SMTP_TIMEOUT_SECONDS", "10"))
+
+MAIL_QUEUE_SIZE = int(os.getenv("MAIL_QUEUE_SIZE", "1000"))
+MAIL_WORKERS = int(os.getenv("MAIL_WORKERS", "1"))
+MAIL_MAX_RETRIES = int(os.getenv("MAIL_MAX_RETRIES", "3"))
+# Servers drop idle sessions; close ours first rather than find out on the next send
+MAIL_IDLE_SECONDS = float(os.getenv("MAIL_IDLE_SECONDS", "60"))
+MAIL_DRAIN_SECONDS = float(os.getenv("MAIL_DRAIN_SECONDS", "10"))
+
+
+class MailQueueFull(Exception):
+    pass
+
+
+def build_message(to: str, subject: str, body: str) -> MIMEMultipart:
+    msg = MIMEMultipart()
+    msg['From'] = SMTP_EMAIL or "no-reply@localhost"
+    msg['To'] = to
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain'))
+    return msg
+
+
+class _Session:
+    """One authenticated SMTP connection, reused across messages by a single worker.
+
+    smtplib is blocking, so every call is made from a worker thread.
+    """
+
+    def __init__(self):
+        self.smtp = None
+        self.last_used = 0.0
+        self.opened = 0
+
+    def _open(self):
+        smtp = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT_SECONDS)
+        try:
+            if SMTP_STARTTLS:
+                smtp.starttls()
+            if SMTP_EMAIL and SMTP_PASSWORD:
+                smtp.login(SMTP_EMAIL, SMTP_PASSWORD)
+        except BaseException:
+            smtp.close()
+            raise
+        self.smtp = smtp
+        self.opened += 1
+
+    def close(self):
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except Exception:
+            self.smtp.close()
+        self.smtp = None
+
+    def send(self, msg: MIMEMultipart, now: float):
+        if self.smtp is not None and now - self.last_used > MAIL_IDLE_SECONDS:
+            self.close()
+        if self.smtp is None:
+            self._open()
+        # If the connection went away between messages this raises; the caller
+        # closes the session and the retry reconnects
+        self.smtp.send_message(msg)
+        self.last_used = now
+
+
+class Mailer:
+    """Outbound mail queue drained by background workers.
+
+    ``send`` only enqueues, so request handlers never wait on SMTP. Each
+    worker keeps one logged-in connection open between messages and retries
+    failed deliveries with backoff before giving up on a message.
+    """
+
+    def __init__(self, workers: int = MAIL_WORKERS, queue_size: int = MAIL_QUEUE_SIZE,
+                 max_retries: int = MAIL_MAX_RETRIES):
+        self.workers = workers
+        self.max_retries = max_retries
+        self._queue_size = queue_size
+        self.queue: asyncio.Queue = None
+        self._tasks = []
+        self._sessions = []
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.rejected = 0
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self._queue_size)
+        self._sessions = [_Session() for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._work(session)) for session in self._sessions]
+
+    def send(self, to: str, subject: str, body: str):
+        """Queue a message; raises MailQueueFull instead of waiting when the queue is full."""
+        if self.queue is None:
+            raise RuntimeError("Mailer is not running")
+        try:
+            self.queue.put_nowait(build_message(to, subject, body))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise MailQueueFull()
+
+    async def close(self):
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), MAIL_DRAIN_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning(f"Shutting down with {self.queue.qsize()} unsent emails")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for session in self._sessions:
+            await asyncio.to_thread(session.close)
+        self._tasks = []
+
+    async def _work(self, session: _Session):
+        loop = asyncio.get_running_loop()
+        while True:
+            msg = await self.queue.get()
+            try:
+                await self._deliver(session, msg, loop)
+            finally:
+                self.queue.task_done()
+
+    async def _deliver(self, session: _Session, msg: MIMEMultipart, loop):
+        for attempt in range(self.max_retries + 1):
+            try:
+                await asyncio.to_thread(session.send, msg, loop.time())
+                self.sent += 1
+                return
+            except Exception as e:
+                logger.warning(f"Failed to send email to {msg['To']} (attempt {attempt + 1}): {e}")
+                await asyncio.to_thread(session.close)
+                if attempt < self.max_retries:
+                    self.retries += 1
+                    await asyncio.sleep(min(0.5 * 2 ** attempt, 10.0))
+        logger.error(f"Giving up on email to {msg['To']} after {self.max_retries + 1} attempts")
+        self.failed += 1
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "connections_opened": sum(session.opened for session in self._sessions),
+        }
+
+
+mailer = Mailer()
@@ -1,24 +1,47 @@
+import asyncio
 import os
 import logging
-import random
 import shutil
-import smtplib
 import json
 from pathlib import Path
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request, Form, HTTPException, Response, Query, UploadFile, File, WebSocket, \
     WebSocketDisconnect
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from pymongo import MongoClient
-from pymongo.server_api import ServerApi
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
 from bson import ObjectId
-from datetime import datetime
-from typing import Dict
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import PlainTextResponse, JSONResponse
+from contextlib import asynccontextmanager
+from pymongo.errors import DuplicateKeyError
+from catalog import fetch_product_page, fetch_ranked_page, PRODUCT_CARD_PROJECTION
+from database import connect, close as close_database, ping, products_collection, users_collection, \
+    carts_collection, reviews_collection, sellers_collection, product_stats_collection, seller_stats_collection, \
+    sessions_collection
+from search import search_index, SEARCH_REBUILD_SECONDS
+from recommendations import related_products, RECOMMEND_REBUILD_SECONDS
+from cache import catalog_cache
+from chat import ConnectionManager
+from presence import presence, search_users, DIRECTORY_PAGE_SIZE, ONLINE_PAGE_SIZE
+from chat_store import message_writer, new_message, serialize_message, fetch_messages, latest_message_id, \
+    mark_read, record_unread, recent_message_count, unread_counts, CHAT_HISTORY_PAGE_SIZE
+import carts
+from auth import current_user, hash_password, verify_password, set_session_cookie, clear_session, \
+    revoke_user_sessions, session_cache, shutdown_executor
+from mailer import mailer, MailQueueFull
+from otp import issue_otp, verify_otp, consume_otp
+import images
+from assets import AssetStaticFiles, asset_manifest
+from templating import create_templates, stream_template
+from ratings import rating_update_pipeline, display_average
+import sellers
+import bulk
+from engagement import engagement, seller_trend, product_totals, VIEWS, CART_ADDS, RATINGS, \
+    ENGAGEMENT_PRODUCT_DAYS
+from reviews import PRODUCT_TARGET, USER_TARGET, add_review, fetch_review_page
+from indexes import ensure_indexes
+from metrics import METRICS_ENABLED, MetricsMiddleware, registry as metrics_registry
+from compression import CompressionMiddleware
+from conditional import make_etag, not_modified, tag
+from versions import bump_version, current_version
 
 
 # Set up logging
@@ -26,25 +49,99 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
-app = FastAPI()
-
-# MongoDB setup
-uri = os.getenv("MONGO_URI")
-client = MongoClient(uri, server_api=ServerApi('1'))
-
-try:
-    client.admin.command('ping')
-    logger.info("Pinged your deployment. You successfully connected to MongoDB!")
-except Exception as e:
-    logger.error(f"Failed to connect to MongoDB. Error details: {str(e)}")
-    raise RuntimeError("Failed to connect to MongoDB") from e
-
-# MongoDB Database and Collection references
-db = client["marketplace_db"]
-products_collection = db["products"]
-users_collection = db["users"]
-carts_collection = db["carts"]
-chat_messages_collection = db["chat_messages"]
+
+READINESS_PING_TIMEOUT_SECONDS = float(os.getenv("READINESS_PING_TIMEOUT_SECONDS", "2"))
+
+
+async def bootstrap_database(app: FastAPI):
+    """Connect, create indexes and load the search index, retrying until MongoDB is reachable.
+
+    Runs in the background so a worker starts serving (and answering
+    liveness probes) at once; /readyz reports ready only once this is done.
+    """
+    delay = 1.0
+    while True:
+        try:
+            await ping()
+            logger.info("Pinged your deployment. You successfully connected to MongoDB!")
+            await ensure_indexes()
+            await search_index.rebuild(products_collection)
+            break
+        except Exception as e:
+            logger.error(f"Database bootstrap failed, retrying in {delay:.0f}s: {str(e)}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+    app.state.ready = True
+
+    # Other workers only see their own incremental updates, so converge periodically
+    await asyncio.gather(
+        rebuild_periodically("search index", SEARCH_REBUILD_SECONDS,
+                             lambda: search_index.rebuild(products_collection), initial=False),
+        rebuild_periodically("related products", RECOMMEND_REBUILD_SECONDS, related_products.rebuild),
+    )
+
+
+async def rebuild_periodically(name: str, interval: int, rebuild, initial: bool = True):
+    """Run ``rebuild`` now (unless ``initial`` is False), then every ``interval`` seconds (0 for never)."""
+    if initial:
+        try:
+            await rebuild()
+        except Exception as e:
+            logger.error(f"Failed to build {name}: {str(e)}")
+    while interval > 0:
+        await asyncio.sleep(interval)
+        try:
+            await rebuild()
+        except Exception as e:
+            logger.error(f"Failed to refresh {name}: {str(e)}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    await connect()
+    await asyncio.to_thread(asset_manifest.build)
+    await mailer.start()
+    await message_writer.start()
+    await manager.start()
+    await engagement.start()
+    bootstrap = asyncio.create_task(bootstrap_database(app))
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        bootstrap.cancel()
+        # Close sockets first so nothing new is queued, then flush what is buffered
+        await manager.close()
+        await message_writer.close()
+        await engagement.close()
+        await mailer.close()
+        await asyncio.to_thread(images.shutdown_pool)
+        shutdown_executor()
+        close_database()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CompressionMiddleware)
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+
+@app.get("/livez")
+async def livez():
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    if not app.state.ready:
+        return JSONResponse({"status": "starting"}, status_code=503)
+    try:
+        await asyncio.wait_for(ping(), READINESS_PING_TIMEOUT_SECONDS)
+    except Exception as e:
+        return JSONResponse({"status": "database unavailable", "detail": str(e)}, status_code=503)
+    return {"status": "ready"}
+
 
 # File paths setup
 ROOT_DIR = Path(__file__).parent.parent
@@ -52,136 +149,168 @@ STATIC_DIR = ROOT_DIR / "frontend" / "static"
 TEMPLATE_DIR = ROOT_DIR / "frontend" / "templates"
 UPLOAD_DIR = STATIC_DIR / "uploads"
 
-app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
-templates = Jinja2Templates(directory=str(TEMPLATE_DIR))
-
-# OTP and SMTP setup
-OTP_STORE = {}
-SMTP_SERVER = "smtp.gmail.com"
-SMTP_PORT = 587
-SMTP_EMAIL = os.getenv("SMTP_EMAIL")
-SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
-
-# WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+app.mount("/static", AssetStaticFiles(directory=str(STATIC_DIR)), name="static")
+templates = create_templates(TEMPLATE_DIR)
 
-    async def connect(self, websocket: WebSocket, user_id: str):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
 
-    def disconnect(self, user_id: str):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
+# Embedded arrays that live in their own collections or aggregates now; never fetch them for pages
+PRODUCT_PAGE_PROJECTION = {"ratings": 0, "reviews": 0}
+USER_PROFILE_PROJECTION = {"ratings": 0, "reviews": 0, "password": 0}
 
-    async def send_personal_message(self, message: str, user_id: str):
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].send_text(message)
+# WebSocket connection manager
+manager = ConnectionManager(presence=presence)
 
-manager = ConnectionManager()
 
 # WebSocket endpoint
 @app.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    await manager.connect(websocket, user_id)
+    if await current_user(websocket) != user_id:
+        await websocket.close(code=1008)
+        return
+    connection = await manager.connect(websocket, user_id)
     try:
         while True:
             data = await websocket.receive_text()
             message_data = json.loads(data)
-
-            # Store the message in MongoDB
-            chat_message = {
-                "sender": message_data["sender"],
-                "receiver": message_data["receiver"],
-                "message": message_data["message"],
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            chat_messages_collection.insert_one(chat_message)
-
-            # Send the message to the recipient
-            await manager.send_personal_message(json.dumps(message_data), message_data["receiver"])
+            if message_data.get("type") == "ping":
+                # Client keepalive, so idle proxies don't cut the socket; presence has its own heartbeat
+                continue
+
+            # The sender is whoever owns this socket, whatever the payload claims
+            chat_message = new_message(user_id, message_data["receiver"], message_data["message"])
+
+            # Counted before the receiver can see the message and mark it read, and not by the
+            # write-behind flush, which could bump the counter again after it was cleared
+            try:
+                await record_unread([chat_message])
+            except Exception as e:
+                logger.error(f"Failed to count unread message for {chat_message['receiver']}: {str(e)}")
+
+            # Deliver first (to the sender's other tabs too, which also gives this one the
+            # message id); the write-behind buffer persists the message in the background
+            payload = json.dumps(serialize_message(chat_message))
+            await manager.send_personal_message(payload, chat_message["receiver"])
+            if chat_message["sender"] != chat_message["receiver"]:
+                await manager.send_personal_message(payload, chat_message["sender"])
+            await message_writer.write(chat_message)
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
+        await manager.disconnect(connection)
     except Exception as e:
         logger.error(f"Error in WebSocket connection: {str(e)}")
-        manager.disconnect(user_id)
+        await manager.disconnect(connection)
 
 # Chat page
 @app.get("/chat", response_class=HTMLResponse)
 async def chat_page(request: Request):
-    username = request.cookies.get("username")
+    username = await current_user(request)
     if not username:
         return RedirectResponse("/login", status_code=303)
 
-    users = list(users_collection.find({}, {"username": 1, "_id": 0}))
+    # The user list is loaded page by page from /chat/users
     return templates.TemplateResponse("chat.html", {
         "request": request,
-        "username": username,
-        "users": users
+        "username": username
     })
 
-# Get chat messages
-@app.get("/get-messages")
-async def get_messages(user1: str, user2: str):
-    messages = chat_messages_collection.find({
-        "$or": [
-            {"sender": user1, "receiver": user2},
-            {"sender": user2, "receiver": user1}
-        ]
-    }).sort("timestamp", 1)
-
-    # Convert ObjectId to string for JSON serialization
-    messages_list = []
-    for msg in messages:
-        msg['_id'] = str(msg['_id'])
-        messages_list.append(msg)
+# Chat user directory: prefix search over usernames, with presence and unread counts for the page
+@app.get("/chat/users")
+async def chat_users(request: Request, prefix: str = "", after: str = None, limit: int = DIRECTORY_PAGE_SIZE):
+    username = await current_user(request)
+    if not username:
+        raise HTTPException(status_code=401, detail="You must be logged in to chat.")
+    page = await search_users(prefix.strip(), after=after, limit=limit, exclude=username)
+    online = await presence.online_among(page["users"])
+    unread = await unread_counts(username, page["users"])
+    return {
+        "users": [{"username": user, "online": user in online, "unread": unread.get(user, 0)}
+                  for user in page["users"]],
+        "next_after": page["next_after"]
+    }
 
-    return messages_list
+@app.get("/chat/online")
+async def chat_online(request: Request, after: str = None, limit: int = ONLINE_PAGE_SIZE):
+    username = await current_user(request)
+    if not username:
+        raise HTTPException(status_code=401, detail="You must be logged in to chat.")
+    page = await presence.online_users(after=after, limit=limit)
+    page["users"] = [user for user in page["users"] if user != username]
+    return page
+
+@app.get("/chat/unread")
+async def chat_unread(request: Request):
+    username = await current_user(request)
+    if not username:
+        raise HTTPException(status_code=401, detail="You must be logged in to chat.")
+    return await unread_counts(username)
 
-# Existing functions
+@app.post("/chat/read")
+async def chat_read(request: Request, partner: str = Form(...)):
+    username = await current_user(request)
+    if not username:
+        raise HTTPException(status_code=401, detail="You must be logged in to chat.")
+    await mark_read(username, partner)
+    return {"status": "ok"}
 
-def send_otp(email: str, otp: str):
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = SMTP_EMAIL
-        msg['To'] = email
-        msg['Subject'] = "Your OTP for Registration"
-        body = f"Your OTP for registration is: {otp}"
-        msg.attach(MIMEText(body, 'plain'))
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(SMTP_EMAIL, SMTP_PASSWORD)
-        server.sendmail(SMTP_EMAIL, email, msg.as_string())
-        server.quit()
-    except Exception as e:
-        logger.error(f"Failed to send OTP: {e}")
-        raise HTTPException(status_code=500, detail="Failed to send OTP. Please try again.")
+# Get chat messages
+@app.get("/get-messages")
+async def get_messages(request: Request, user1: str, user2: str, before: str = None, since: str = None,
+                       limit: int = CHAT_HISTORY_PAGE_SIZE):
+    # Checked before anything else: even a 304 would reveal that the conversation exists
+    username = await current_user(request)
+    if not username:
+        raise HTTPException(status_code=401, detail="You must be logged in to chat.")
+    if username not in (user1, user2):
+        raise HTTPException(status_code=403, detail="You can only read your own conversations.")
+    latest = await latest_message_id(user1, user2)
+    # A message stored late doesn't move the latest id, but it does change what "since" returns
+    recent = await recent_message_count(user1, user2, since) if since else None
+    etag = make_etag("messages", user1, user2, latest, recent, before, since, limit)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    return tag(JSONResponse(await fetch_messages(user1, user2, before=before, since=since, limit=limit)), etag)
 
 @app.post("/generate-otp")
 async def generate_otp(email: str = Form(...)):
     if not email.endswith("@gmail.com"):
         raise HTTPException(status_code=400, detail="Only Gmail addresses are allowed.")
-    otp = str(random.randint(100000, 999999))
-    OTP_STORE[email] = otp
+    otp = await issue_otp(email)
     try:
-        send_otp(email, otp)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail="Failed to send OTP. Please try again.")
+        mailer.send(email, "Your OTP for Registration", f"Your OTP for registration is: {otp}")
+    except MailQueueFull:
+        logger.error(f"Mail queue full, could not send OTP to {email}")
+        raise HTTPException(status_code=503, detail="Failed to send OTP. Please try again shortly.")
     return {"message": "OTP sent to your email."}
 
 @app.get("/", response_class=HTMLResponse)
-async def home(request: Request, search: str = Query("", min_length=0)):
-    username = request.cookies.get("username")
-    cart = carts_collection.find_one({"username": username})
-    cart_count = len(cart["items"]) if cart else 0
-    query = {"name": {"$regex": search, "$options": "i"}} if search else {}
-    filtered_products = list(products_collection.find(query))
-    return templates.TemplateResponse("index.html", {
+async def home(request: Request, search: str = Query("", min_length=0), sort: str = None,
+               after: str = None, before: str = None, limit: int = None):
+    username = await current_user(request)
+    cart_count = await carts.cart_count(username)
+    sort = sort or ("relevance" if search else "newest")
+
+    async def load_page():
+        if not search:
+            return await fetch_product_page(products_collection, sort=sort, after=after, before=before, limit=limit)
+        ranked_ids = [ObjectId(doc_id) for doc_id, _ in search_index.search(search)]
+        if sort == "relevance":
+            return await fetch_ranked_page(products_collection, ranked_ids, after=after, before=before, limit=limit)
+        return await fetch_product_page(products_collection, {"_id": {"$in": ranked_ids}}, sort=sort,
+                                        after=after, before=before, limit=limit)
+
+    page = await catalog_cache.get_or_load(("listing", search, sort, after, before, limit), load_page,
+                                           tags=["listing"])
+    return stream_template(templates, "index.html", {
         "request": request,
-        "products": filtered_products,
+        "products": page["products"],
+        "next_cursor": page["next_cursor"],
+        "prev_cursor": page["prev_cursor"],
+        "sort": page["sort"],
         "username": username,
         "search": search,
+        "after": after,
+        "before": before,
+        "limit": limit,
         "cart_count": cart_count
     })
 
@@ -196,11 +325,11 @@ async def register_user(request: Request, username: str = Form(...), password: s
 
     if not email.endswith("@gmail.com"):
         error_message = "Only Gmail addresses are allowed."
-    elif email not in OTP_STORE or OTP_STORE[email] != otp:
+    elif not await verify_otp(email, otp):
         error_message = "Invalid OTP. Please try again."
-    elif users_collection.find_one({"username": username}):
+    elif await users_collection.find_one({"username": username}):
         error_message = "Username already exists."
-    elif users_collection.find_one({"email": email}):
+    elif await users_collection.find_one({"email": email}):
         error_message = "Email already registered."
 
     if error_message:
@@ -213,29 +342,47 @@ async def register_user(request: Request, username: str = Form(...), password: s
 
     new_user = {
         "username": username,
-        "password": password,  # Note: Passwords should be hashed for security reasons
+        "password": await hash_password(password),
         "email": email,
-        "reviews": [],
-        "ratings": [],
-        "description": "No description added yet."
+        "rating_count": 0,
+        "rating_sum": 0,
+        "average_rating": None,
+        "description": "No description added yet.",
+        "version": 1
     }
-    users_collection.insert_one(new_user)
-
-    if email in OTP_STORE:
-        del OTP_STORE[email]
+    try:
+        await users_collection.insert_one(new_user)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration; the unique indexes have the final say
+        return templates.TemplateResponse("register.html", {
+            "request": request,
+            "error_message": "Username or email already registered.",
+            "username": username,
+            "email": email
+        })
+    await consume_otp(email)
 
     return RedirectResponse("/", status_code=303)
 
 
 @app.get("/sellers", response_class=HTMLResponse)
-async def list_sellers(request: Request):
-    seller_usernames = set(products_collection.distinct("added_by"))
-    sellers = list(users_collection.find({"username": {"$in": list(seller_usernames)}}))
+async def list_sellers(request: Request, sort: str = "name", page: int = Query(1, ge=1)):
+    version = await current_version(sellers.DIRECTORY_VERSION)
+    etag = make_etag("sellers", version, sort, page, await current_user(request))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+
+    # Keyed by version too, so a write made through another worker is seen here at once
+    sellers_page = await catalog_cache.get_or_load(
+        ("sellers", version, sort, page), lambda: sellers.fetch_sellers_page(sort, page), tags=["sellers"]
+    )
 
-    return templates.TemplateResponse("sellers.html", {
+    return tag(stream_template(templates, "sellers.html", {
         "request": request,
-        "sellers": sellers
-    })
+        "version": version,
+        **sellers_page
+    }), etag)
 
 
 @app.get("/login", response_class=HTMLResponse)
@@ -245,10 +392,15 @@ async def login_form(request: Request):
 
 @app.post("/login")
 async def login(request: Request, response: Response, username: str = Form(...), password: str = Form(...)):
-    user = users_collection.find_one({"username": username, "password": password})
-    if user:
+    user = await users_collection.find_one({"username": username}, {"password": 1})
+    valid, new_hash = await verify_password(password, user.get("password") if user else None)
+    if valid:
+        if new_hash:
+            # Upgrade legacy plaintext (or outdated) hashes now that we have the password
+            await users_collection.update_one({"_id": user["_id"], "password": user["password"]},
+                                              {"$set": {"password": new_hash}})
         response = RedirectResponse("/", status_code=303)
-        response.set_cookie(key="username", value=username)
+        await set_session_cookie(response, username)
         return response
 
     error_message = "Invalid username or password"
@@ -260,97 +412,109 @@ async def login(request: Request, response: Response, username: str = Form(...),
 
 
 @app.get("/logout", response_class=HTMLResponse)
-async def logout(response: Response):
+async def logout(request: Request):
     response = RedirectResponse("/", status_code=303)
-    response.delete_cookie("username")
+    await clear_session(request, response)
     return response
 
 
 @app.get("/seller-profile/{username}", response_class=HTMLResponse)
-async def seller_profile(request: Request, username: str):
-    current_username = request.cookies.get("username")
+async def seller_profile(request: Request, username: str, reviews_before: str = None):
+    current_username = await current_user(request)
     if not current_username:
         return RedirectResponse("/login", status_code=303)
 
-    seller = users_collection.find_one({"username": username})
+    seller = await users_collection.find_one({"username": username}, USER_PROFILE_PROJECTION)
     if not seller:
         raise HTTPException(status_code=404, detail="Seller not found")
 
-    ratings = seller.get("ratings", [])
-    average_rating = round(sum(ratings) / len(ratings), 2) if ratings else "No ratings yet"
+    average_rating = display_average(seller)
+    review_page = await fetch_review_page(USER_TARGET, username, before=reviews_before)
 
     return templates.TemplateResponse("seller_profile.html", {
         "request": request,
         "seller": seller,
         "username": current_username,
-        "average_rating": average_rating
+        "average_rating": average_rating,
+        "seller_reviews": review_page["reviews"],
+        "reviews_next_cursor": review_page["next_cursor"]
     })
 
 
 @app.get("/seller-dashboard", response_class=HTMLResponse)
 async def seller_dashboard(request: Request):
-    username = request.cookies.get("username")
+    username = await current_user(request)
     if not username:
         return RedirectResponse("/login", status_code=303)
 
     # Get all products added by this seller
-    seller_products = list(products_collection.find({"added_by": username}))
+    seller_products = await catalog_cache.get_or_load(
+        ("seller_products", username),
+        lambda: products_collection.find({"added_by": username}, PRODUCT_PAGE_PROJECTION).to_list(None),
+        tags=[f"seller:{username}"]
+    )
+    # Daily rollups kept by the engagement counters; up to a flush interval behind
+    trend = await seller_trend(username)
+    totals = await product_totals(username)
 
     return templates.TemplateResponse("seller_dashboard.html", {
         "request": request,
         "username": username,
-        "products": seller_products
+        "products": seller_products,
+        "trend": trend,
+        "product_stats": totals,
+        "product_stats_days": ENGAGEMENT_PRODUCT_DAYS
     })
 
 
 @app.post("/delete-product/{product_id}")
 async def delete_product(product_id: str, request: Request):
-    username = request.cookies.get("username")
+    username = await current_user(request)
     if not username:
         return RedirectResponse("/login", status_code=303)
 
     # Verify the product belongs to the seller before deleting
-    product = products_collection.find_one({"_id": ObjectId(product_id)})
+    product = await products_collection.find_one({"_id": ObjectId(product_id)})
     if not product or product["added_by"] != username:
         raise HTTPException(status_code=403, detail="Unauthorized to delete this product")
 
     # Delete the product
-    products_collection.delete_one({"_id": ObjectId(product_id)})
+    await products_collection.delete_one({"_id": ObjectId(product_id)})
+    await reviews_collection.delete_many({"target_type": PRODUCT_TARGET, "target_id": product_id})
+    await carts.remove_product(ObjectId(product_id))
+    search_index.remove(product_id)
+    await sellers.record_removal(username)
+    catalog_cache.invalidate(f"product:{product_id}", f"seller:{username}", "listing", "sellers")
 
     return RedirectResponse("/seller-dashboard", status_code=303)
 
 @app.post("/review-seller")
 async def review_seller(request: Request, username: str = Form(...), review: str = Form(...), rating: int = Form(...)):
-    current_username = request.cookies.get("username")
+    current_username = await current_user(request)
     if not current_username:
         return RedirectResponse("/login", status_code=303)
 
     if current_username == username:
         raise HTTPException(status_code=400, detail="You cannot review yourself.")
 
-    seller = users_collection.find_one({"username": username})
+    seller = await users_collection.find_one({"username": username}, {"_id": 1})
     if not seller:
         raise HTTPException(status_code=404, detail="Seller not found")
 
-    existing_review = next((r for r in seller.get("reviews", []) if r["reviewer"] == current_username), None)
-    if existing_review:
+    # The unique (target, reviewer) index on reviews does the duplicate check
+    if not await add_review(USER_TARGET, username, current_username, review, rating):
         raise HTTPException(status_code=400, detail="You have already reviewed this seller.")
 
-    new_review = {"reviewer": current_username, "review": review, "rating": rating}
-    users_collection.update_one(
-        {"username": username},
-        {
-            "$push": {"reviews": new_review, "ratings": rating},
-            "$set": {"average_rating": {"$avg": "$ratings"}}
-        }
-    )
+    await users_collection.update_one({"username": username}, rating_update_pipeline(rating))
+    await sellers.record_rating(username, rating)
+    catalog_cache.invalidate("sellers")
 
     return RedirectResponse(f"/seller-profile/{username}", status_code=303)
 
 
 @app.get("/add-product", response_class=HTMLResponse)
 async def add_product_form(request: Request):
-    username = request.cookies.get("username")
+    username = await current_user(request)
     if not username:
         return RedirectResponse("/login", status_code=303)
     return templates.TemplateResponse("add_product.html", {"request": request, "username": username})
@@ -363,82 +527,165 @@ async def add_product(
         image_file: UploadFile = File(...),
         request: Request = None
 ):
-    username = request.cookies.get("username")
+    username = await current_user(request)
     if not username:
         return RedirectResponse("/login", status_code=303)
 
-    upload_dir = STATIC_DIR / "uploads"
-    upload_dir.mkdir(parents=True, exist_ok=True)
-    image_path = upload_dir / image_file.filename
-
-    with open(image_path, "wb") as buffer:
-        shutil.copyfileobj(image_file.file, buffer)
-    image = f"/static/uploads/{image_file.filename}"
+    image_urls = await images.save_upload(image_file)
 
     new_product = {
         "name": name,
         "price": price,
-        "image": image,
-        "added_by": username
+        "image": image_urls["full"],
+        "images": image_urls,
+        "added_by": username,
+        "rating_count": 0,
+        "rating_sum": 0,
+        "average_rating": None,
+        "version": 1
     }
 
-    products_collection.insert_one(new_product)
+    result = await products_collection.insert_one(new_product)
+    search_index.add(str(result.inserted_id), name)
+    await sellers.record_listing(username, result.inserted_id)
+    catalog_cache.invalidate(f"seller:{username}", "listing", "sellers")
 
     return RedirectResponse("/", status_code=303)
 
 
-@app.get("/profile", response_class=HTMLResponse)
-async def profile(request: Request, username: str = None):
+@app.post("/seller/products/import")
+async def import_products(request: Request, format: str = None):
+    """Bulk-add products from an NDJSON or CSV request body (fields: name, price, image).
+
+    The body is parsed as it streams in, e.g.
+    ``curl --data-binary @catalog.csv -H "Content-Type: text/csv" .../seller/products/import``.
+    Responds with counts and the row numbers and reasons of rejected rows.
+    """
+    username = await current_user(request)
     if not username:
-        username = request.cookies.get("username")
+        raise HTTPException(status_code=401, detail="You must be logged in to import products.")
+    fmt = bulk.resolve_format(format, request.headers.get("content-type"))
+
+    async def on_inserted(products: list):
+        for product in products:
+            search_index.add(str(product["_id"]), product["name"])
+        await sellers.record_listing(username, products[-1]["_id"], count=len(products))
+        catalog_cache.invalidate(f"seller:{username}", "listing", "sellers")
+
+    return await bulk.import_products(request.stream(), fmt, username, on_inserted)
+
+
+@app.get("/seller/products/export")
+async def export_products(request: Request, format: str = "ndjson"):
+    username = await current_user(request)
     if not username:
         return RedirectResponse("/login", status_code=303)
+    fmt = bulk.resolve_format(format)
+    return StreamingResponse(
+        bulk.export_products(username, fmt), media_type=bulk.FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="products.{fmt}"'}
+    )
 
-    user = users_collection.find_one({"username": username})
+
+@app.get("/profile", response_class=HTMLResponse)
+async def profile(request: Request, username: str = None, reviews_before: str = None):
+    viewer = await current_user(request)
+    username = username or viewer
+    if not username:
+        return RedirectResponse("/login", status_code=303)
+
+    current = await users_collection.find_one({"username": username}, {"version": 1})
+    if not current:
+        raise HTTPException(status_code=404, detail="User not found")
+    # _id too: a re-registered username starts again at version 1
+    etag = make_etag("user", current["_id"], current.get("version", 0), reviews_before, viewer)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+
+    user = await users_collection.find_one({"username": username}, USER_PROFILE_PROJECTION)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    ratings = user.get("ratings", [])
-    average_rating = round(sum(ratings) / len(ratings), 2) if ratings else "No ratings yet"
+    average_rating = display_average(user)
+    review_page = await fetch_review_page(USER_TARGET, username, before=reviews_before)
 
-    return templates.TemplateResponse("profile.html", {
+    return tag(templates.TemplateResponse("profile.html", {
         "request": request,
         "username": username,
+        "viewer": viewer,
         "user_email": user.get("email", "Not provided"),
         "user_description": user.get("description", "No description added yet."),
         "average_rating": average_rating,
-        "user_reviews": user.get("reviews", [])
-    })
+        "user_reviews": review_page["reviews"],
+        "reviews_next_cursor": review_page["next_cursor"]
+    }), etag)
 
 
 @app.get("/product/{product_id}", response_class=HTMLResponse)
-async def product_profile(request: Request, product_id: str):
-    username = request.cookies.get("username")
-    product = products_collection.find_one({"_id": ObjectId(product_id)})
+async def product_profile(request: Request, product_id: str, reviews_before: str = None):
+    username = await current_user(request)
+    # Just the version first: an unchanged page is answered without loading or rendering it
+    current = await products_collection.find_one({"_id": ObjectId(product_id)}, {"version": 1, "added_by": 1})
+    if not current:
+        raise HTTPException(status_code=404, detail="Product not found")
+    if username != current["added_by"]:
+        engagement.record(product_id, current["added_by"], VIEWS)
+    version = current.get("version", 0)
+    related = related_products.related(product_id)
+    etag = make_etag("product", product_id, version, reviews_before, username, [pid for pid, _ in related])
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+
+    def load_product():
+        return products_collection.find_one({"_id": ObjectId(product_id)}, PRODUCT_PAGE_PROJECTION)
+
+    product = await catalog_cache.get_or_load(("product", product_id), load_product, tags=[f"product:{product_id}"])
+    if product is not None and product.get("version", 0) != version:
+        # Cached before a write made through another worker
+        catalog_cache.invalidate(f"product:{product_id}")
+        product = await catalog_cache.get_or_load(("product", product_id), load_product,
+                                                  tags=[f"product:{product_id}"])
 
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
-    # Calculate average rating
-    ratings = product.get("ratings", [])
-    average_rating = round(sum(ratings) / len(ratings), 2) if ratings else "No ratings yet"
+    average_rating = display_average(product)
+    review_page = await fetch_review_page(PRODUCT_TARGET, product_id, before=reviews_before)
+
+    async def load_related():
+        cards = await products_collection.find(
+            {"_id": {"$in": [ObjectId(pid) for pid, _ in related]}}, PRODUCT_CARD_PROJECTION
+        ).to_list(None)
+        by_id = {str(card["_id"]): card for card in cards}
+        # Keep the ranking; anything deleted since the last build drops out
+        return [by_id[pid] for pid, _ in related if pid in by_id]
+
+    related_cards = []
+    if related:
+        related_cards = await catalog_cache.get_or_load(
+            ("related", product_id, tuple(pid for pid, _ in related)), load_related, tags=["listing"]
+        )
 
-    return templates.TemplateResponse("product_profile.html", {
+    return tag(templates.TemplateResponse("product_profile.html", {
         "request": request,
         "product": product,
         "username": username,
         "average_rating": average_rating,
-        "product_reviews": product.get("reviews", [])
-    })
+        "product_reviews": review_page["reviews"],
+        "reviews_next_cursor": review_page["next_cursor"],
+        "related_products": related_cards
+    }), etag)
 
 
 @app.post("/rate-product")
 async def rate_product(request: Request, product_id: str = Form(...), rating: int = Form(...), review: str = Form(...)):
-    username = request.cookies.get("username")
+    username = await current_user(request)
     if not username:
         raise HTTPException(status_code=403, detail="You must be logged in to leave a review.")
 
-    product = products_collection.find_one({"_id": ObjectId(product_id)})
+    product = await products_collection.find_one({"_id": ObjectId(product_id)}, {"added_by": 1})
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
@@ -448,24 +695,22 @@ async def rate_product(request: Request, product_id: str = Form(...), rating: in
     if not (1 <= rating <= 5):
         raise HTTPException(status_code=400, detail="Rating must be between 1 and 5")
 
-    new_review = {"reviewer": username, "review": review, "rating": rating}
-    products_collection.update_one(
-        {"_id": ObjectId(product_id)},
-        {
-            "$push": {"reviews": new_review, "ratings": rating},
-            "$set": {"average_rating": {"$avg": "$ratings"}}
-        }
-    )
+    if not await add_review(PRODUCT_TARGET, product_id, username, review, rating):
+        raise HTTPException(status_code=400, detail="You have already reviewed this product.")
+
+    await products_collection.update_one({"_id": ObjectId(product_id)}, rating_update_pipeline(rating))
+    engagement.record(product_id, product["added_by"], RATINGS, rating=rating)
+    catalog_cache.invalidate(f"product:{product_id}", f"seller:{product['added_by']}")
 
     return RedirectResponse(f"/product/{product_id}", status_code=303)
 
 @app.get("/edit-profile", response_class=HTMLResponse)
 async def edit_profile(request: Request):
-    username = request.cookies.get("username")
+    username = await current_user(request)
     if not username:
         return RedirectResponse("/login", status_code=303)
 
-    user = users_collection.find_one({"username": username})
+    user = await users_collection.find_one({"username": username})
     user_email = user.get("email", "example@example.com") if user else "example@example.com"
 
     return templates.TemplateResponse("edit_profile.html", {
@@ -477,24 +722,39 @@ async def edit_profile(request: Request):
 
 @app.post("/edit-profile")
 async def edit_profile_post(request: Request, username: str = Form(...), email: str = Form(...)):
-    current_username = request.cookies.get("username")
+    current_username = await current_user(request)
     if not current_username:
         return RedirectResponse("/login", status_code=303)
 
     if email.endswith("@gmail.com"):
-        users_collection.update_one(
-            {"username": current_username},
-            {"$set": {"username": username, "email": email}}
+        try:
+            await users_collection.update_one(
+                {"username": current_username},
+                {"$set": {"username": username, "email": email}, "$inc": {"version": 1}}
+            )
+        except DuplicateKeyError:
+            # Username or email belongs to someone else
+            return RedirectResponse("/edit-profile", status_code=303)
+        await reviews_collection.update_many(
+            {"target_type": USER_TARGET, "target_id": current_username},
+            {"$set": {"target_id": username}}
         )
+        await sellers.record_profile_change(current_username, username, email)
+        catalog_cache.invalidate("sellers")
+        if username != current_username:
+            # Sessions name the old username, which someone else may now register; this one
+            # included, so it is replaced with a session for the new name
+            await revoke_user_sessions(current_username)
+            response = RedirectResponse("/profile", status_code=303)
+            await set_session_cookie(response, username)
+            return response
 
-    response = RedirectResponse("/profile", status_code=303)
-    response.set_cookie(key="username", value=username)
-    return response
+    return RedirectResponse("/profile", status_code=303)
 
 
 @app.post("/rate-user")
 async def rate_user(request: Request, username: str = Form(...), rating: int = Form(...), review: str = Form(...)):
-    current_username = request.cookies.get("username")
+    current_username = await current_user(request)
     if not current_username:
         raise HTTPException(status_code=403, detail="You must be logged in to leave a review.")
 
@@ -504,30 +764,27 @@ async def rate_user(request: Request, username: str = Form(...), rating: int = F
     if not (1 <= rating <= 5):
         raise HTTPException(status_code=400, detail="Rating must be between 1 and 5")
 
-    user = users_collection.find_one({"username": username})
+    user = await users_collection.find_one({"username": username}, {"_id": 1})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    new_review = {"reviewer": current_username, "review": review, "rating": rating}
-    users_collection.update_one(
-        {"username": username},
-        {
-            "$push": {"reviews": new_review, "ratings": rating},
-            "$set": {"average_rating": {"$avg": "$ratings"}}
-        }
-    )
+    if not await add_review(USER_TARGET, username, current_username, review, rating):
+        raise HTTPException(status_code=400, detail="You have already reviewed this user.")
+
+    await users_collection.update_one({"username": username}, rating_update_pipeline(rating))
+    await sellers.record_rating(username, rating)
+    catalog_cache.invalidate("sellers")
 
     return RedirectResponse(f"/profile?username={username}", status_code=303)
 
 
 @app.get("/cart", response_class=HTMLResponse)
 async def view_cart(request: Request):
-    username = request.cookies.get("username")
+    username = await current_user(request)
     if not username:
         return RedirectResponse("/login", status_code=303)
 
-    cart = carts_collection.find_one({"username": username})
-    cart_items = cart["items"] if cart else []
+    cart_items = await carts.hydrate_cart(username)
     return templates.TemplateResponse("cart.html", {
         "request": request,
         "cart_items": cart_items,
@@ -537,9 +794,18 @@ async def view_cart(request: Request):
 
 @app.post("/clear-userbase", response_class=HTMLResponse)
 async def clear_userbase(request: Request):
-    products_collection.delete_many({})
-    users_collection.delete_many({})
-    carts_collection.delete_many({})
+    await products_collection.delete_many({})
+    await users_collection.delete_many({})
+    await carts_collection.delete_many({})
+    await reviews_collection.delete_many({})
+    await sellers_collection.delete_many({})
+    await product_stats_collection.delete_many({})
+    await seller_stats_collection.delete_many({})
+    await sessions_collection.delete_many({})
+    session_cache.clear()
+    await bump_version(sellers.DIRECTORY_VERSION)
+    search_index.clear()
+    catalog_cache.clear()
 
     if UPLOAD_DIR.exists():
         for file in UPLOAD_DIR.iterdir():
@@ -553,46 +819,69 @@ async def clear_userbase(request: Request):
 
 @app.post("/add-to-cart", response_class=HTMLResponse)
 async def add_to_cart(request: Request, product_id: str = Form(...)):
-    username = request.cookies.get("username")
+    username = await current_user(request)
     if not username:
         return RedirectResponse("/login", status_code=303)
 
-    product = products_collection.find_one({"_id": ObjectId(product_id)})
+    product = await products_collection.find_one({"_id": ObjectId(product_id)}, {"_id": 1, "added_by": 1})
     if product:
-        carts_collection.update_one(
-            {"username": username},
-            {"$addToSet": {"items": product}},
-            upsert=True
-        )
+        await carts.add_item(username, product["_id"])
+        engagement.record(product_id, product["added_by"], CART_ADDS)
 
     return RedirectResponse("/cart", status_code=303)
 
 @app.post("/remove-from-cart")
 async def remove_from_cart(request: Request, product_id: str = Form(...)):
-    username = request.cookies.get("username")
+    username = await current_user(request)
     if not username:
         return RedirectResponse("/login", status_code=303)
 
-    carts_collection.update_one(
-        {"username": username},
-        {"$pull": {"items": {"_id": ObjectId(product_id)}}}
-    )
+    await carts.remove_item(username, ObjectId(product_id))
 
     return RedirectResponse("/cart", status_code=303)
 
 @app.post("/edit-description")
 async def edit_description(request: Request, description: str = Form(...)):
-    current_username = request.cookies.get("username")
+    current_username = await current_user(request)
     if not current_username:
         return RedirectResponse("/login", status_code=303)
 
-    users_collection.update_one(
+    await users_collection.update_one(
         {"username": current_username},
-        {"$set": {"description": description}}
+        {"$set": {"description": description}, "$inc": {"version": 1}}
     )
 
     return RedirectResponse(f"/profile?username={current_username}", status_code=303)
 
+@app.get("/cache-stats")
+async def cache_stats():
+    return catalog_cache.stats()
+
+
+@app.get("/chat-stats")
+async def chat_stats():
+    return message_writer.stats()
+
+
+@app.get("/mail-stats")
+async def mail_stats():
+    return mailer.stats()
+
+
+metrics_registry.register_collector("chat_writer", message_writer.stats)
+metrics_registry.register_collector("mailer", mailer.stats)
+metrics_registry.register_collector("catalog_cache", catalog_cache.stats)
+metrics_registry.register_collector("engagement", engagement.stats)
+metrics_registry.register_collector("related_products", related_products.stats)
+
+
+@app.get("/metrics")
+async def metrics():
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+
 # Error handling
 @app.exception_handler(404)
 async def not_found_exception_handler(request: Request, exc: HTTPException):
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import argparse
+from assets import asset_manifest
+from database import products_collection, users_collection
+from carts import migrate_legacy_carts, merge_duplicate_carts, ensure_cart_indexes
+from chat_store import ensure_chat_indexes, migrate_legacy_messages
+from images import backfill_image_variants, shutdown_pool
+from indexes import ensure_indexes, explain_query_shapes
+from ratings import backfill_rating_aggregates
+from sellers import ensure_seller_indexes, rebuild_sellers
+from reviews import PRODUCT_TARGET, USER_TARGET, ensure_review_indexes, migrate_embedded_reviews
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def backfill_ratings(args):
+    for collection in (products_collection, users_collection):
+        await backfill_rating_aggregates(collection)
+
+
+async def migrate_reviews(args):
+    # The unique index must exist first so re-runs and repeat reviewers can't create duplicates
+    await ensure_review_indexes()
+    await migrate_embedded_reviews(products_collection, PRODUCT_TARGET, "_id")
+    await migrate_embedded_reviews(users_collection, USER_TARGET, "username")
+
+
+async def migrate_carts(args):
+    await migrate_legacy_carts()
+    # The unique index can only be built once each user is down to one cart
+    await merge_duplicate_carts()
+    await ensure_cart_indexes()
+
+
+async def migrate_messages(args):
+    await ensure_chat_indexes()
+    await migrate_legacy_messages()
+
+
+async def generate_image_variants(args):
+    try:
+        await backfill_image_variants(products_collection)
+    finally:
+        shutdown_pool()
+
+
+async def build_assets(args):
+    asset_manifest.build()
+
+
+async def rebuild_seller_directory(args):
+    await ensure_seller_indexes()
+    await rebuild_sellers()
+
+
+async def create_indexes(args):
+    await ensure_indexes()
+
+
+async def explain(args):
+    results = await explain_query_shapes()
+    for result in results:
+        marker = "!!" if result["flagged"] else "  "
+        plan = " > ".join(result["stages"])
+        indexes = ", ".join(result["indexes"]) or "-"
+        print(f"{marker} {result['query']:<26} {result['collection']:<14} {plan:<40} {indexes}")
+    flagged = [result["query"] for result in results if result["flagged"]]
+    if flagged:
+        print(f"\n{len(flagged)} query shape(s) fall back to a collection scan: {', '.join(flagged)}")
+        raise SystemExit(1)
+
+
+COMMANDS = {
+    "backfill-ratings": (backfill_ratings, "Compute rating count/sum/average for documents that predate them"),
+    "migrate-reviews": (migrate_reviews, "Move embedded product/user reviews into the reviews collection"),
+    "migrate-carts": (migrate_carts, "Rewrite carts that embed product documents as product_id/qty references"),
+    "migrate-messages": (migrate_messages, "Add conversation ids to chat messages stored before they existed"),
+    "generate-image-variants": (generate_image_variants, "Store pre-pipeline product images by hash and render their variants"),
+    "build-assets": (build_assets, "Fingerprint and precompress static assets (also done at startup)"),
+    "rebuild-sellers": (rebuild_seller_directory, "Recompute the sellers directory from products and users"),
+    "ensure-indexes": (create_indexes, "Create every index the routes rely on (also done at startup)"),
+    "explain": (explain, "Explain each route's query shape and fail if any does an unexpected collection scan"),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance commands for the marketplace database.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, (_, help_text) in COMMANDS.items():
+        subparsers.add_parser(name, help=help_text)
+    args = parser.parse_args()
+
+    handler, _ = COMMANDS[args.command]
+    asyncio.run(handler(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""Request and MongoDB command metrics, exposed in Prometheus text format.
+
+``MetricsMiddleware`` times every HTTP request per route template (so
+``/product/{product_id}`` rather than one series per product) and counts
+in-flight requests and websockets. ``CommandMetrics`` is a pymongo command
+listener; motor runs commands with the caller's context, so each command is
+attributed to the route whose handler issued it, or to "background" for
+work such as the chat writer and index bootstrap.
+
+Set METRICS_ENABLED=false to leave out both the middleware and the listener.
+"""
+import os
+import time
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional, Tuple
+from pymongo import monitoring
+from starlette.routing import Match
+
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() not in ("0", "false", "no")
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMMAND_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+COMMANDS_PER_REQUEST_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+BACKGROUND = "background"
+UNMATCHED = "unmatched"
+
+
+class _RequestContext:
+    __slots__ = ("route", "commands")
+
+    def __init__(self, route: str):
+        self.route = route
+        self.commands = 0
+
+
+_current: ContextVar[Optional[_RequestContext]] = ContextVar("metrics_request", default=None)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Histogram:
+    """Fixed-bucket histogram per label set. Observations may come from driver threads."""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts (the last slot is +Inf), then sum
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_format(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter (or, with ``kind="gauge"``, a value that also goes down) per label set."""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], kind: str = "counter"):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.kind = kind
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            snapshot = dict(self._values)
+        for labels, value in sorted(snapshot.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {_format(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.request_duration = Histogram(
+            "http_request_duration_seconds", "Time from request start to the last byte of the response.",
+            ("method", "route"), REQUEST_BUCKETS
+        )
+        self.requests = Counter("http_requests_total", "Completed HTTP requests.", ("method", "route", "status"))
+        self.in_flight = Counter(
+            "http_requests_in_flight", "Requests (and open websockets) currently being handled.", ("route",),
+            kind="gauge"
+        )
+        self.commands_per_request = Histogram(
+            "http_request_mongodb_commands", "MongoDB commands issued while handling one request.",
+            ("route",), COMMANDS_PER_REQUEST_BUCKETS
+        )
+        self.command_duration = Histogram(
+            "mongodb_command_duration_seconds", "MongoDB command round-trip time, by originating route.",
+            ("route", "command"), COMMAND_BUCKETS
+        )
+        self.command_failures = Counter(
+            "mongodb_command_failures_total", "MongoDB commands that returned an error.", ("route", "command")
+        )
+        self._collectors: Dict[str, Callable[[], dict]] = {}
+
+    def register_collector(self, prefix: str, collect: Callable[[], dict]):
+        """Export the numeric values of a ``stats()``-style dict as ``<prefix>_<key>`` gauges."""
+        self._collectors[prefix] = collect
+
+    def render(self) -> str:
+        lines = []
+        for metric in (self.request_duration, self.requests, self.in_flight, self.commands_per_request,
+                       self.command_duration, self.command_failures):
+            lines.extend(metric.render())
+        for prefix, collect in self._collectors.items():
+            for key, value in collect().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"# TYPE {prefix}_{key} gauge")
+                    lines.append(f"{prefix}_{key} {_format(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class CommandMetrics(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        context = _current.get()
+        if context is not None:
+            context.commands += 1
+        route = context.route if context is not None else BACKGROUND
+        registry.command_duration.observe((route, event.command_name), event.duration_micros / 1e6)
+
+    def failed(self, event):
+        context = _current.get()
+        if context is not None:
+            context.commands += 1
+        route = context.route if context is not None else BACKGROUND
+        registry.command_duration.observe((route, event.command_name), event.duration_micros / 1e6)
+        registry.command_failures.inc((route, event.command_name))
+
+
+command_listener = CommandMetrics()
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed bodies are timed to the last chunk and not buffered."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def _route(self, scope) -> str:
+        # Match the way the router will, to label by template before the handler runs
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return UNMATCHED
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        context = _RequestContext(self._route(scope))
+        token = _current.set(context)
+        registry.in_flight.inc((context.route,))
+        if scope["type"] == "websocket":
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                registry.in_flight.inc((context.route,), -1)
+                _current.reset(token)
+            return
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            method = scope["method"]
+            registry.request_duration.observe((method, context.route), time.perf_counter() - start)
+            registry.requests.inc((method, context.route, str(status[0])))
+            registry.commands_per_request.observe((context.route,), context.commands)
+            registry.in_flight.inc((context.route,), -1)
+            _current.reset(token)
@@ -0,0 +1,51 @@
+import os
+import hmac
+import hashlib
+import secrets
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from database import otps_collection
+
+
+OTP_TTL_SECONDS = int(os.getenv("OTP_TTL_SECONDS", "600"))
+OTP_MAX_ATTEMPTS = int(os.getenv("OTP_MAX_ATTEMPTS", "5"))
+
+# One pending code per email, shared by every worker and expired by MongoDB's TTL monitor:
+#   {"_id": email, "code_hash": sha256 hex, "expires_at": datetime, "attempts": int}
+
+
+def _hash(code: str) -> str:
+    return hashlib.sha256(code.encode()).hexdigest()
+
+
+async def ensure_otp_indexes():
+    # The TTL monitor deletes documents once expires_at has passed
+    await otps_collection.create_index("expires_at", expireAfterSeconds=0, name="otp_expiry")
+
+
+async def issue_otp(email: str) -> str:
+    """Create (or replace) the pending code for ``email`` and return it."""
+    code = f"{secrets.randbelow(1000000):06d}"
+    await otps_collection.replace_one(
+        {"_id": email},
+        {"code_hash": _hash(code), "expires_at": datetime.utcnow() + timedelta(seconds=OTP_TTL_SECONDS),
+         "attempts": 0},
+        upsert=True
+    )
+    return code
+
+
+async def verify_otp(email: str, code: str) -> bool:
+    # The TTL monitor only runs about once a minute, so check expiry here as well
+    pending = await otps_collection.find_one_and_update(
+        {"_id": email, "expires_at": {"$gt": datetime.utcnow()}, "attempts": {"$lt": OTP_MAX_ATTEMPTS}},
+        {"$inc": {"attempts": 1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if pending is None:
+        return False
+    return hmac.compare_digest(pending["code_hash"], _hash(code))
+
+
+async def consume_otp(email: str):
+    await otps_collection.delete_one({"_id": email})
@@ -0,0 +1,142 @@
+import os
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Iterable, Set
+from pymongo import ASCENDING
+from database import presence_collection, users_collection
+
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_TTL_SECONDS = int(os.getenv("PRESENCE_TTL_SECONDS", "90"))
+PRESENCE_HEARTBEAT_SECONDS = int(os.getenv("PRESENCE_HEARTBEAT_SECONDS", "30"))
+ONLINE_PAGE_SIZE = int(os.getenv("ONLINE_PAGE_SIZE", "50"))
+ONLINE_MAX_PAGE_SIZE = 200
+DIRECTORY_PAGE_SIZE = int(os.getenv("DIRECTORY_PAGE_SIZE", "50"))
+DIRECTORY_MAX_PAGE_SIZE = 200
+
+# One document per (user, worker) while that worker holds at least one socket for the user:
+#   {"user": username, "worker": worker id, "since": datetime, "expires_at": datetime}
+# A worker refreshes expires_at for all of its users with a single write per heartbeat, so
+# a worker that dies without cleaning up stops counting once its documents expire.
+
+
+async def ensure_presence_indexes():
+    # Serves "is anyone on this page online", the online list in username order, and the heartbeat
+    await presence_collection.create_index(
+        [("user", ASCENDING), ("worker", ASCENDING)], unique=True, name="presence_by_user"
+    )
+    await presence_collection.create_index("worker", name="presence_by_worker")
+    await presence_collection.create_index("expires_at", expireAfterSeconds=0, name="presence_expiry")
+
+
+def _expiry() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=PRESENCE_TTL_SECONDS)
+
+
+class PresenceTracker:
+    """Who is online, as seen by every worker.
+
+    ``ConnectionManager`` calls ``online`` when a user's first socket on this
+    worker opens and ``offline`` when the last one closes. The TTL monitor only
+    runs about once a minute, so reads check expires_at themselves.
+    """
+
+    def __init__(self, heartbeat_interval: float = PRESENCE_HEARTBEAT_SECONDS):
+        self.worker_id = uuid.uuid4().hex
+        self.heartbeat_interval = heartbeat_interval
+        self._heartbeat = None
+
+    async def start(self):
+        self._heartbeat = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._heartbeat:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        try:
+            await presence_collection.delete_many({"worker": self.worker_id})
+        except Exception as e:
+            logger.error(f"Failed to clear presence for worker {self.worker_id}: {str(e)}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.heartbeat()
+            except Exception as e:
+                logger.error(f"Presence heartbeat failed: {str(e)}")
+
+    async def heartbeat(self):
+        await presence_collection.update_many(
+            {"worker": self.worker_id}, {"$set": {"expires_at": _expiry()}}
+        )
+
+    async def online(self, user: str):
+        await presence_collection.update_one(
+            {"user": user, "worker": self.worker_id},
+            {"$set": {"expires_at": _expiry()}, "$setOnInsert": {"since": datetime.utcnow()}},
+            upsert=True
+        )
+
+    async def offline(self, user: str):
+        await presence_collection.delete_one({"user": user, "worker": self.worker_id})
+
+    async def online_among(self, users: Iterable[str]) -> Set[str]:
+        """Which of ``users`` have a live socket on any worker."""
+        users = list(users)
+        if not users:
+            return set()
+        online = await presence_collection.distinct(
+            "user", {"user": {"$in": users}, "expires_at": {"$gt": datetime.utcnow()}}
+        )
+        return set(online)
+
+    async def online_users(self, after: str = None, limit: int = ONLINE_PAGE_SIZE) -> dict:
+        """Online usernames in order, a page at a time: ``{"users": [...], "next_after": str or None}``."""
+        limit = max(1, min(limit, ONLINE_MAX_PAGE_SIZE))
+        match = {"expires_at": {"$gt": datetime.utcnow()}}
+        if after:
+            match["user"] = {"$gt": after}
+        # Documents are per worker, so a user on several workers is grouped into one row
+        rows = await presence_collection.aggregate([
+            {"$match": match},
+            {"$group": {"_id": "$user"}},
+            {"$sort": {"_id": 1}},
+            {"$limit": limit + 1},
+        ]).to_list(None)
+        users = [row["_id"] for row in rows]
+        has_next = len(users) > limit
+        users = users[:limit]
+        return {"users": users, "next_after": users[-1] if has_next else None}
+
+
+async def search_users(prefix: str = "", after: str = None, limit: int = DIRECTORY_PAGE_SIZE,
+                       exclude: str = None) -> dict:
+    """Usernames starting with ``prefix`` in order, a page at a time, off the unique_username index.
+
+    Returns ``{"users": [...], "next_after": str or None}``; pass ``next_after``
+    back as ``after`` for the next page.
+    """
+    limit = max(1, min(limit, DIRECTORY_MAX_PAGE_SIZE))
+    bounds = {"$gte": prefix}
+    if prefix:
+        # Every string with this prefix sorts below prefix + the highest BMP code point
+        bounds["$lt"] = prefix + "\uffff"
+    if after and after >= prefix:
+        bounds = {**bounds, "$gt": after}
+        del bounds["$gte"]
+    query = {"username": bounds}
+    if exclude:
+        query = {"$and": [query, {"username": {"$ne": exclude}}]}
+    rows = await users_collection.find(query, {"username": 1, "_id": 0}) \
+        .sort("username", ASCENDING).limit(limit + 1).to_list(None)
+    users = [row["username"] for row in rows]
+    has_next = len(users) > limit
+    users = users[:limit]
+    return {"users": users, "next_after": users[-1] if has_next else None}
+
+
+presence = PresenceTracker()
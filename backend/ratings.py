@@ -0,0 +1,74 @@
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# Products and users carry a "version" that every write bumps; conditional GETs build
+# their ETags from it (see conditional.py)
+VERSION_BUMP = {"$add": [{"$ifNull": ["$version", 0]}, 1]}
+
+
+def _average_expression():
+    return {
+        "$cond": [
+            {"$gt": ["$rating_count", 0]},
+            {"$divide": ["$rating_sum", "$rating_count"]},
+            None
+        ]
+    }
+
+
+def rating_update_pipeline(rating: int, extra_set: dict = None) -> list:
+    """Update pipeline that folds one new rating into a document's aggregates.
+
+    The count, sum and average are recomputed on the server in a single
+    atomic update, so concurrent ratings never lose increments. Documents
+    written before the aggregates existed are seeded from their legacy
+    ``ratings`` array on their first new rating, and the array is dropped.
+    """
+    first_stage = {
+        "rating_count": {"$add": [{"$ifNull": ["$rating_count", {"$size": {"$ifNull": ["$ratings", []]}}]}, 1]},
+        "rating_sum": {"$add": [{"$ifNull": ["$rating_sum", {"$sum": "$ratings"}]}, rating]},
+        "version": VERSION_BUMP,
+    }
+    if extra_set:
+        first_stage.update(extra_set)
+    return [
+        {"$set": first_stage},
+        {"$set": {"average_rating": _average_expression()}},
+        {"$project": {"ratings": 0}},
+    ]
+
+
+def display_average(doc: dict):
+    """The value the templates show for a document's average rating."""
+    if doc.get("rating_count"):
+        return round(doc.get("rating_sum", 0) / doc["rating_count"], 2)
+    return "No ratings yet"
+
+
+async def backfill_rating_aggregates(collection) -> int:
+    """Compute rating_count/rating_sum/average_rating for documents that predate them.
+
+    Also repairs the literal ``{"$avg": "$ratings"}`` objects the old handlers
+    stored in ``average_rating``. Safe to run repeatedly and while the app is
+    serving traffic: it only touches documents that still need it.
+    """
+    result = await collection.update_many(
+        {"$or": [
+            {"ratings": {"$exists": True}},
+            {"rating_count": {"$exists": False}},
+            {"average_rating": {"$type": "object"}},
+        ]},
+        [
+            {"$set": {
+                "rating_count": {"$ifNull": ["$rating_count", {"$size": {"$ifNull": ["$ratings", []]}}]},
+                "rating_sum": {"$ifNull": ["$rating_sum", {"$sum": "$ratings"}]},
+                "version": VERSION_BUMP,
+            }},
+            {"$set": {"average_rating": _average_expression()}},
+            {"$project": {"ratings": 0}},
+        ]
+    )
+    logger.info(f"Backfilled rating aggregates on {result.modified_count} documents in {collection.name}")
+    return result.modified_count
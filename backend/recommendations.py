@@ -0,0 +1,173 @@
+import os
+import time
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+import numpy as np
+from database import products_collection, carts_collection, reviews_collection
+from reviews import PRODUCT_TARGET
+
+
+logger = logging.getLogger(__name__)
+
+RECOMMEND_TOP_K = int(os.getenv("RECOMMEND_TOP_K", "12"))
+RECOMMEND_MIN_SUPPORT = int(os.getenv("RECOMMEND_MIN_SUPPORT", "1"))
+# Baskets longer than this are truncated; pairs grow with the square of the length
+RECOMMEND_MAX_BASKET = int(os.getenv("RECOMMEND_MAX_BASKET", "100"))
+# Damps pairs seen only a few times: score *= support / (support + shrinkage)
+RECOMMEND_SHRINKAGE = float(os.getenv("RECOMMEND_SHRINKAGE", "1"))
+RECOMMEND_REBUILD_SECONDS = int(os.getenv("RECOMMEND_REBUILD_SECONDS", "900"))
+
+# Upper bound on pair keys materialised at once while counting
+_PAIR_CHUNK = 1 << 22
+# Scores are in [0, 1]; sorting uses them as 31-bit integers
+_SCORE_SCALE = float((1 << 31) - 1)
+
+
+def _count_pairs(baskets: List[List[int]], n_items: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Distinct ``(i, j)`` pairs with ``i < j`` (encoded as ``i * n_items + j``) and their co-occurrence counts.
+
+    Baskets of the same length are stacked into one matrix, so each length
+    takes a handful of array operations however many baskets share it.
+    """
+    by_size = defaultdict(list)
+    for basket in baskets:
+        by_size[len(basket)].append(basket)
+
+    keys, counts = [], []
+    for size, group in by_size.items():
+        upper, lower = np.triu_indices(size, 1)
+        matrix = np.array(group, dtype=np.int64)
+        rows_per_chunk = max(1, _PAIR_CHUNK // len(upper))
+        for start in range(0, len(matrix), rows_per_chunk):
+            chunk = matrix[start:start + rows_per_chunk]
+            # Each basket is sorted, so the upper-triangle pairs always have i < j
+            chunk_keys, chunk_counts = np.unique(
+                (chunk[:, upper] * n_items + chunk[:, lower]).ravel(), return_counts=True
+            )
+            keys.append(chunk_keys)
+            counts.append(chunk_counts)
+    if not keys:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    merged, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+    return merged, np.bincount(inverse, weights=np.concatenate(counts)).astype(np.int64)
+
+
+class RelatedProductsIndex:
+    """Top-K related products per product, from item-item co-occurrence.
+
+    Two products co-occur when the same user has both in their cart or has
+    reviewed both. Scores are the cosine of the products' user sets,
+    ``count(i, j) / sqrt(users(i) * users(j))``, shrunk towards zero for
+    pairs with little support. Only the K best neighbours of each product
+    are kept, in CSR arrays, so a lookup is a slice.
+    """
+
+    def __init__(self):
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._neighbors = np.zeros(0, dtype=np.int32)
+        self._scores = np.zeros(0, dtype=np.float32)
+        self.baskets = 0
+        self.pairs = 0
+        self.build_ms = 0.0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def related(self, product_id: str, limit: int = RECOMMEND_TOP_K) -> List[Tuple[str, float]]:
+        """``(product_id, score)`` of the products most often found with ``product_id``, best first."""
+        row = self._rows.get(product_id)
+        if row is None:
+            return []
+        start = int(self._indptr[row])
+        end = min(int(self._indptr[row + 1]), start + limit)
+        return [(self._ids[neighbor], score) for neighbor, score in
+                zip(self._neighbors[start:end].tolist(), self._scores[start:end].tolist())]
+
+    @classmethod
+    def from_baskets(cls, baskets: Iterable[Iterable[str]], top_k: int = RECOMMEND_TOP_K,
+                     min_support: int = RECOMMEND_MIN_SUPPORT, max_basket: int = RECOMMEND_MAX_BASKET,
+                     shrinkage: float = RECOMMEND_SHRINKAGE):
+        """Build from each user's products (cart items and reviewed products, in any order)."""
+        start_time = time.perf_counter()
+        index = cls()
+        encoded = []
+        occurrences = []
+        for basket in baskets:
+            rows = []
+            for product_id in dict.fromkeys(basket):
+                row = index._rows.get(product_id)
+                if row is None:
+                    row = index._rows[product_id] = len(index._ids)
+                    index._ids.append(product_id)
+                rows.append(row)
+            rows = sorted(rows[:max_basket])
+            occurrences.extend(rows)
+            if len(rows) > 1:
+                encoded.append(rows)
+            index.baskets += 1
+
+        n_items = len(index._ids)
+        keys, support = _count_pairs(encoded, n_items)
+        keep = support >= min_support
+        keys, support = keys[keep], support[keep]
+        first, second = keys // n_items, keys % n_items
+
+        users = np.bincount(np.array(occurrences, dtype=np.int64), minlength=n_items).astype(np.float64)
+        scores = support / np.sqrt(users[first] * users[second])
+        if shrinkage:
+            scores *= support / (support + shrinkage)
+
+        # Both directions, then the top_k per row: one argsort on row << 32 | (1 - score) quantised,
+        # which is several times faster than lexsort over (row, -score)
+        rows = np.concatenate([first, second])
+        neighbors = np.concatenate([second, first])
+        scores = np.concatenate([scores, scores])
+        order = np.argsort((rows << 32) | ((1.0 - scores) * _SCORE_SCALE).astype(np.int64))
+        rows, neighbors, scores = rows[order], neighbors[order], scores[order]
+        rank = np.arange(len(rows)) - np.searchsorted(rows, rows, side="left")
+        keep = rank < top_k
+        rows, neighbors, scores = rows[keep], neighbors[keep], scores[keep]
+
+        index._indptr = np.zeros(n_items + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n_items), out=index._indptr[1:])
+        index._neighbors = neighbors.astype(np.int32)
+        index._scores = scores.astype(np.float32)
+        index.pairs = len(keys)
+        index.build_ms = (time.perf_counter() - start_time) * 1000
+        return index
+
+    async def rebuild(self):
+        """Replace the index with one built from every cart and product review."""
+        products = {str(product["_id"]) async for product in products_collection.find({}, {"_id": 1})}
+        baskets = defaultdict(list)
+        async for cart in carts_collection.find({}, {"username": 1, "items.product_id": 1, "items._id": 1}):
+            for item in cart.get("items", []):
+                # Carts saved before product_id existed hold the product's _id instead
+                product_id = item.get("product_id", item.get("_id"))
+                if product_id is not None:
+                    baskets[cart["username"]].append(str(product_id))
+        async for review in reviews_collection.find({"target_type": PRODUCT_TARGET}, {"target_id": 1, "reviewer": 1}):
+            baskets[review["reviewer"]].append(review["target_id"])
+        # Deleted products still sit in old carts and reviews
+        baskets = [[product_id for product_id in basket if product_id in products] for basket in baskets.values()]
+
+        fresh = await asyncio.to_thread(RelatedProductsIndex.from_baskets, baskets)
+        self.__dict__.update(fresh.__dict__)
+        logger.info(f"Related products built for {len(self)} products from {self.baskets} users "
+                    f"({self.pairs} pairs, {self.build_ms:.0f} ms)")
+
+    def stats(self) -> dict:
+        return {
+            "products": len(self),
+            "baskets": self.baskets,
+            "pairs": self.pairs,
+            "neighbors": len(self._neighbors),
+            "build_ms": round(self.build_ms, 1),
+        }
+
+
+related_products = RelatedProductsIndex()
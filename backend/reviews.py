@@ -0,0 +1,108 @@
+import os
+import logging
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from database import reviews_collection
+
+
+logger = logging.getLogger(__name__)
+
+REVIEWS_PAGE_SIZE = int(os.getenv("REVIEWS_PAGE_SIZE", "10"))
+
+# Review targets: products are keyed by their ObjectId string, users by username
+PRODUCT_TARGET = "product"
+USER_TARGET = "user"
+
+
+async def ensure_review_indexes():
+    # One review per reviewer per target; also serves the duplicate check
+    await reviews_collection.create_index(
+        [("target_type", ASCENDING), ("target_id", ASCENDING), ("reviewer", ASCENDING)],
+        unique=True, name="one_review_per_reviewer"
+    )
+    # Newest-first pages of a target's reviews
+    await reviews_collection.create_index(
+        [("target_type", ASCENDING), ("target_id", ASCENDING), ("_id", DESCENDING)],
+        name="reviews_by_target"
+    )
+
+
+async def add_review(target_type: str, target_id: str, reviewer: str, review: str, rating: int) -> bool:
+    """Insert a review; returns False if this reviewer already reviewed the target."""
+    try:
+        await reviews_collection.insert_one({
+            "target_type": target_type,
+            "target_id": target_id,
+            "reviewer": reviewer,
+            "review": review,
+            "rating": rating,
+            "created_at": datetime.utcnow()
+        })
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+async def fetch_review_page(target_type: str, target_id: str, before: str = None,
+                            limit: int = REVIEWS_PAGE_SIZE) -> dict:
+    """Newest-first page of a target's reviews, seeking on _id.
+
+    ``next_cursor`` is the id to pass as ``before`` to load the next (older)
+    page, or None when there are no more reviews.
+    """
+    query = {"target_type": target_type, "target_id": target_id}
+    if before:
+        try:
+            query["_id"] = {"$lt": ObjectId(before)}
+        except (InvalidId, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid review cursor")
+
+    reviews = await reviews_collection.find(query, {"reviewer": 1, "review": 1, "rating": 1}) \
+        .sort("_id", DESCENDING).limit(limit + 1).to_list(None)
+    has_more = len(reviews) > limit
+    reviews = reviews[:limit]
+    return {
+        "reviews": reviews,
+        "next_cursor": str(reviews[-1]["_id"]) if has_more else None
+    }
+
+
+async def migrate_embedded_reviews(collection, target_type: str, key_field: str) -> int:
+    """Move the embedded ``reviews`` arrays of ``collection`` into the reviews collection.
+
+    Runs online: each document is migrated on its own, duplicates that already
+    exist in the reviews collection are skipped, and the embedded array is only
+    removed if it did not change while it was being copied. Safe to re-run.
+    """
+    moved = 0
+    async for doc in collection.find({"reviews.0": {"$exists": True}}, {key_field: 1, "reviews": 1}):
+        target_id = str(doc[key_field])
+        embedded = doc["reviews"]
+        new_reviews = [
+            {
+                "target_type": target_type,
+                "target_id": target_id,
+                "reviewer": r.get("reviewer"),
+                "review": r.get("review", ""),
+                "rating": r.get("rating"),
+                "created_at": datetime.utcnow()
+            }
+            for r in embedded
+        ]
+        try:
+            result = await reviews_collection.insert_many(new_reviews, ordered=False)
+            moved += len(result.inserted_ids)
+        except BulkWriteError as e:
+            # Already-migrated or repeated reviewer entries hit the unique index; keep the rest
+            moved += e.details.get("nInserted", 0)
+
+        await collection.update_one(
+            {"_id": doc["_id"], "reviews": {"$size": len(embedded)}},
+            {"$unset": {"reviews": ""}}
+        )
+    logger.info(f"Migrated {moved} embedded reviews from {collection.name}")
+    return moved
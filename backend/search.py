@@ -0,0 +1,278 @@
+import os
+import re
+import asyncio
+import math
+import heapq
+import bisect
+import logging
+import itertools
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "500"))
+SEARCH_MAX_EXPANSIONS = int(os.getenv("SEARCH_MAX_EXPANSIONS", "50"))
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", "2000"))
+SEARCH_REBUILD_SECONDS = int(os.getenv("SEARCH_REBUILD_SECONDS", "300"))
+
+# Relative weight of a query token matching a term exactly, by prefix or with one typo
+EXACT_WEIGHT = 1.0
+PREFIX_WEIGHT = 0.7
+TYPO_WEIGHT = 0.4
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase, strip accents and split on anything that isn't a letter or digit."""
+    if not text:
+        return []
+    normalized = unicodedata.normalize("NFKD", text)
+    normalized = "".join(c for c in normalized if not unicodedata.combining(c))
+    return _TOKEN_RE.findall(normalized.lower())
+
+
+def _deletes(term: str) -> set:
+    """Every variant of ``term`` with exactly one character removed."""
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+class ProductSearchIndex:
+    """In-process inverted index over product names.
+
+    Each term keeps its postings twice: a ``{doc_id: tf}`` map for scoring and
+    a list ordered by impact (higher term frequency, then shorter name) for
+    candidate generation. A sorted term list answers prefix queries with a
+    binary search, and a symmetric-delete map (every term with one character
+    removed -> terms) finds terms within one edit of a misspelt token without
+    scanning the vocabulary.
+
+    Queries are driven by their rarest token: candidates come from at most
+    ``SEARCH_MAX_CANDIDATES`` of its highest-impact postings and are scored
+    against every token, falling back to the next rarest token only while too
+    few documents match them all. Work per query is therefore bounded by the
+    candidate cap, not by the size of the catalog.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._impacts: Dict[str, List[Tuple[int, int, str]]] = {}
+        self._doc_terms: Dict[str, List[str]] = {}
+        self._sorted_terms: List[str] = []
+        self._delete_map: Dict[str, set] = defaultdict(set)
+        self._total_length = 0
+        # Changes made while a rebuild is loading, replayed onto the rebuilt index
+        self._journal: Optional[list] = None
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def clear(self):
+        journal = self._journal
+        self.__init__()
+        if journal is not None:
+            journal.append(("clear",))
+            self._journal = journal
+
+    def add(self, doc_id: str, text: str):
+        if self._journal is not None:
+            self._journal.append(("add", doc_id, text))
+        if doc_id in self._doc_terms:
+            self._remove(doc_id)
+        terms = tokenize(text)
+        self._doc_terms[doc_id] = terms
+        self._total_length += len(terms)
+        for term, tf in Counter(terms).items():
+            if term not in self._postings:
+                self._postings[term] = {}
+                self._impacts[term] = []
+                self._index_term(term)
+            self._postings[term][doc_id] = tf
+            bisect.insort(self._impacts[term], (-tf, len(terms), doc_id))
+
+    def remove(self, doc_id: str):
+        if self._journal is not None:
+            self._journal.append(("remove", doc_id))
+        self._remove(doc_id)
+
+    def _remove(self, doc_id: str):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self._total_length -= len(terms)
+        for term in set(terms):
+            postings = self._postings.get(term)
+            if postings is None or doc_id not in postings:
+                continue
+            entry = (-postings.pop(doc_id), len(terms), doc_id)
+            impacts = self._impacts[term]
+            i = bisect.bisect_left(impacts, entry)
+            if i < len(impacts) and impacts[i] == entry:
+                del impacts[i]
+            if not postings:
+                del self._postings[term]
+                del self._impacts[term]
+                self._unindex_term(term)
+
+    def _index_term(self, term: str):
+        bisect.insort(self._sorted_terms, term)
+        if len(term) >= 4:
+            for variant in _deletes(term):
+                self._delete_map[variant].add(term)
+
+    def _unindex_term(self, term: str):
+        i = bisect.bisect_left(self._sorted_terms, term)
+        if i < len(self._sorted_terms) and self._sorted_terms[i] == term:
+            del self._sorted_terms[i]
+        if len(term) >= 4:
+            for variant in _deletes(term):
+                bucket = self._delete_map.get(variant)
+                if bucket is not None:
+                    bucket.discard(term)
+                    if not bucket:
+                        del self._delete_map[variant]
+
+    def _prefix_terms(self, prefix: str) -> List[str]:
+        terms = []
+        i = bisect.bisect_left(self._sorted_terms, prefix)
+        while i < len(self._sorted_terms) and len(terms) < SEARCH_MAX_EXPANSIONS:
+            term = self._sorted_terms[i]
+            if not term.startswith(prefix):
+                break
+            if term != prefix:
+                terms.append(term)
+            i += 1
+        return terms
+
+    def _typo_terms(self, token: str) -> set:
+        """Indexed terms within one insertion, deletion or substitution of ``token``."""
+        if len(token) < 4:
+            return set()
+        candidates = set(self._delete_map.get(token, ()))
+        for variant in _deletes(token):
+            if variant in self._postings:
+                candidates.add(variant)
+            candidates.update(self._delete_map.get(variant, ()))
+        candidates.discard(token)
+        return set(sorted(candidates)[:SEARCH_MAX_EXPANSIONS])
+
+    def _expand(self, token: str) -> Dict[str, float]:
+        """Map each index term a query token can match to that match's weight."""
+        matches = {}
+        if token in self._postings:
+            matches[token] = EXACT_WEIGHT
+        if len(token) >= 2:
+            for term in self._prefix_terms(token):
+                matches.setdefault(term, PREFIX_WEIGHT)
+        for term in self._typo_terms(token):
+            matches.setdefault(term, TYPO_WEIGHT)
+        return matches
+
+    def _candidates(self, expansions: Dict[str, float]):
+        """The highest-impact postings across one token's expansions, best first."""
+        merged = heapq.merge(*(self._impacts[term] for term in expansions))
+        return (doc_id for _, _, doc_id in itertools.islice(merged, SEARCH_MAX_CANDIDATES))
+
+    def search(self, query: str, limit: int = SEARCH_MAX_RESULTS) -> List[Tuple[str, float]]:
+        """Return up to ``limit`` ``(doc_id, score)`` pairs, best match first.
+
+        Documents matching more of the query tokens always outrank documents
+        matching fewer; ties are broken by the summed BM25 score. Tokens that
+        match nothing in the index are ignored.
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens or not self._doc_terms:
+            return []
+        expansions = [e for e in (self._expand(token) for token in tokens) if e]
+        if not expansions:
+            return []
+        doc_count = len(self._doc_terms)
+        avg_length = self._total_length / doc_count
+        idf = {}
+        for token_expansions in expansions:
+            for term in token_expansions:
+                df = len(self._postings[term])
+                idf[term] = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+
+        def score(doc_id):
+            terms = self._doc_terms[doc_id]
+            norm = K1 * (1 - B + B * len(terms) / avg_length)
+            total, matched = 0.0, 0
+            for token_expansions in expansions:
+                best = 0.0
+                for term in terms:
+                    weight = token_expansions.get(term)
+                    if weight:
+                        tf = self._postings[term][doc_id]
+                        best = max(best, weight * idf[term] * tf * (K1 + 1) / (tf + norm))
+                if best:
+                    total += best
+                    matched += 1
+            return matched, total
+
+        by_rarity = sorted(expansions, key=lambda e: sum(len(self._postings[t]) for t in e))
+        scored: Dict[str, Tuple[int, float]] = {}
+        for token_expansions in by_rarity:
+            for doc_id in self._candidates(token_expansions):
+                if doc_id not in scored:
+                    scored[doc_id] = score(doc_id)
+            if sum(1 for matched, _ in scored.values() if matched == len(expansions)) >= limit:
+                break
+
+        ranked = heapq.nlargest(limit, scored.items(), key=lambda item: item[1])
+        return [(doc_id, total) for doc_id, (_, total) in ranked]
+
+    @classmethod
+    def from_items(cls, items):
+        """Bulk-build an index from ``(doc_id, text)`` pairs, sorting each postings list once."""
+        index = cls()
+        for doc_id, text in items:
+            terms = tokenize(text)
+            index._doc_terms[doc_id] = terms
+            index._total_length += len(terms)
+            for term, tf in Counter(terms).items():
+                index._postings.setdefault(term, {})[doc_id] = tf
+                index._impacts.setdefault(term, []).append((-tf, len(terms), doc_id))
+        for term, impacts in index._impacts.items():
+            impacts.sort()
+        index._sorted_terms = sorted(index._postings)
+        for term in index._sorted_terms:
+            if len(term) >= 4:
+                for variant in _deletes(term):
+                    index._delete_map[variant].add(term)
+        return index
+
+    async def rebuild(self, collection):
+        """Replace the index contents with a fresh load of every product name.
+
+        ``add``/``remove``/``clear`` calls made while the snapshot loads are
+        recorded and replayed onto the new index before it is swapped in, so
+        products changed during the rebuild are neither lost nor brought back.
+        """
+        self._journal = []
+        try:
+            items = [(str(product["_id"]), product.get("name", ""))
+                     async for product in collection.find({}, {"name": 1})]
+            fresh = await asyncio.to_thread(ProductSearchIndex.from_items, items)
+            # Replay and swap with no await in between, so nothing can slip past the journal
+            for op in self._journal:
+                if op[0] == "add":
+                    fresh.add(op[1], op[2])
+                elif op[0] == "remove":
+                    fresh.remove(op[1])
+                else:
+                    fresh.clear()
+        finally:
+            self._journal = None
+        self.__dict__.update(fresh.__dict__)
+        logger.info(f"Search index built with {len(self)} products")
+
+
+search_index = ProductSearchIndex()
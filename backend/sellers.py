@@ -0,0 +1,146 @@
+import os
+import logging
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo import ASCENDING, DESCENDING, ReplaceOne
+from database import sellers_collection, products_collection, users_collection
+from ratings import rating_update_pipeline
+from versions import bump_version
+
+
+logger = logging.getLogger(__name__)
+
+SELLERS_PAGE_SIZE = int(os.getenv("SELLERS_PAGE_SIZE", "50"))
+SELLERS_REBUILD_BATCH = int(os.getenv("SELLERS_REBUILD_BATCH", "500"))
+
+# One summary per user with at least one listed product, kept in step by the handlers
+# that change products or seller ratings:
+#   {"_id": username, "email", "product_count", "last_listed_at",
+#    "rating_count", "rating_sum", "average_rating"}
+# Bumped on every change, for the directory's ETags and cache keys
+DIRECTORY_VERSION = "sellers"
+
+SORT_KEYS = {
+    "name": [("_id", ASCENDING)],
+    "products": [("product_count", DESCENDING), ("_id", ASCENDING)],
+    "rating": [("average_rating", DESCENDING), ("rating_count", DESCENDING), ("_id", ASCENDING)],
+    "recent": [("last_listed_at", DESCENDING), ("_id", ASCENDING)],
+}
+
+
+async def ensure_seller_indexes():
+    # One per sort order except "name", which walks _id
+    await sellers_collection.create_index(SORT_KEYS["products"], name="sellers_by_products")
+    await sellers_collection.create_index(SORT_KEYS["rating"], name="sellers_by_rating")
+    await sellers_collection.create_index(SORT_KEYS["recent"], name="sellers_by_recent")
+
+
+def _rating_fields(user: dict) -> dict:
+    return {
+        "rating_count": user.get("rating_count") or 0,
+        "rating_sum": user.get("rating_sum") or 0,
+        "average_rating": user.get("average_rating") if user.get("rating_count") else None,
+    }
+
+
+async def record_listing(username: str, product_id: ObjectId, count: int = 1):
+    """Count newly added products (``product_id`` being the latest) towards their seller's summary."""
+    result = await sellers_collection.update_one(
+        {"_id": username},
+        {"$inc": {"product_count": count}, "$max": {"last_listed_at": product_id.generation_time}},
+        upsert=True
+    )
+    if result.upserted_id is not None:
+        # First product: copy the profile fields the directory shows
+        user = await users_collection.find_one(
+            {"username": username}, {"email": 1, "rating_count": 1, "rating_sum": 1, "average_rating": 1}
+        ) or {}
+        await sellers_collection.update_one(
+            {"_id": username}, {"$set": {"email": user.get("email"), **_rating_fields(user)}}
+        )
+    await bump_version(DIRECTORY_VERSION)
+
+
+async def record_removal(username: str):
+    """Uncount a deleted product; sellers with nothing left drop out of the directory."""
+    await sellers_collection.update_one({"_id": username}, {"$inc": {"product_count": -1}})
+    await sellers_collection.delete_one({"_id": username, "product_count": {"$lte": 0}})
+    await bump_version(DIRECTORY_VERSION)
+
+
+async def record_rating(username: str, rating: int):
+    # Same server-side fold as users_collection, so the two aggregates agree
+    result = await sellers_collection.update_one({"_id": username}, rating_update_pipeline(rating))
+    if result.matched_count:
+        await bump_version(DIRECTORY_VERSION)
+
+
+async def record_profile_change(old_username: str, new_username: str, email: str):
+    if old_username != new_username:
+        # Products keep their original added_by, which no longer names a user, so the
+        # seller leaves the directory just as rebuild_sellers would decide
+        await sellers_collection.delete_one({"_id": old_username})
+    else:
+        await sellers_collection.update_one({"_id": old_username}, {"$set": {"email": email}})
+    await bump_version(DIRECTORY_VERSION)
+
+
+async def fetch_sellers_page(sort: str = "name", page: int = 1, limit: int = None) -> dict:
+    """One page of the directory in the given order.
+
+    Pages are numbered rather than keyset-paginated: the directory has one
+    row per seller, not per product, and every order is served by an index.
+    """
+    if sort not in SORT_KEYS:
+        raise HTTPException(status_code=400, detail="Unknown sort order")
+    page = max(1, page)
+    page_size = max(1, min(limit or SELLERS_PAGE_SIZE, 100))
+    sellers = await sellers_collection.find({}).sort(SORT_KEYS[sort]) \
+        .skip((page - 1) * page_size).limit(page_size + 1).to_list(None)
+    return {
+        "sellers": sellers[:page_size],
+        "sort": sort,
+        "page": page,
+        "has_next": len(sellers) > page_size,
+    }
+
+
+async def rebuild_sellers() -> int:
+    """Recompute every summary from products and users and drop stale ones.
+
+    A consistency repair; updates made by handlers while it runs may need a
+    second run to be reflected.
+    """
+    counts = await products_collection.aggregate([
+        {"$group": {"_id": "$added_by", "product_count": {"$sum": 1}, "last_product_id": {"$max": "$_id"}}}
+    ]).to_list(None)
+
+    written = []
+    for start in range(0, len(counts), SELLERS_REBUILD_BATCH):
+        batch = counts[start:start + SELLERS_REBUILD_BATCH]
+        users = await users_collection.find(
+            {"username": {"$in": [row["_id"] for row in batch]}},
+            {"username": 1, "email": 1, "rating_count": 1, "rating_sum": 1, "average_rating": 1}
+        ).to_list(None)
+        by_username = {user["username"]: user for user in users}
+
+        requests = []
+        for row in batch:
+            user = by_username.get(row["_id"])
+            if user is None:
+                # Products whose seller no longer exists aren't listed
+                continue
+            requests.append(ReplaceOne({"_id": row["_id"]}, {
+                "email": user.get("email"),
+                "product_count": row["product_count"],
+                "last_listed_at": row["last_product_id"].generation_time,
+                **_rating_fields(user),
+            }, upsert=True))
+            written.append(row["_id"])
+        if requests:
+            await sellers_collection.bulk_write(requests, ordered=False)
+
+    removed = await sellers_collection.delete_many({"_id": {"$nin": written}})
+    await bump_version(DIRECTORY_VERSION)
+    logger.info(f"Rebuilt {len(written)} seller summaries, removed {removed.deleted_count} stale ones")
+    return len(written)
@@ -0,0 +1,116 @@
+"""A local stand-in for the SMTP server, for development and tests.
+
+Accepts every message, and any AUTH credentials, without TLS, and logs it
+(and optionally appends it to a file) instead of delivering it. Point the
+app at it with:
+
+    SMTP_SERVER=localhost SMTP_PORT=1025 SMTP_STARTTLS=false
+    python -m smtp_sink --port 1025
+"""
+import asyncio
+import logging
+import argparse
+from email import message_from_bytes
+
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPSink:
+    """Just enough of RFC 5321 for smtplib: EHLO/HELO, AUTH, MAIL, RCPT, DATA, RSET, NOOP, QUIT."""
+
+    def __init__(self, outbox: str = None):
+        self.outbox = outbox
+        self.messages = []
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        async def reply(line: str):
+            writer.write(f"{line}\r\n".encode())
+            await writer.drain()
+
+        await reply("220 smtp-sink ready")
+        sender, recipients = None, []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode(errors="replace").strip()
+                verb = command[:4].upper()
+                if verb == "EHLO":
+                    await reply("250-smtp-sink")
+                    await reply("250-AUTH PLAIN LOGIN")
+                    await reply("250 8BITMIME")
+                elif verb == "HELO":
+                    await reply("250 smtp-sink")
+                elif verb == "AUTH":
+                    # Any credentials will do; just walk through the exchange
+                    mechanism, _, initial = command[5:].strip().partition(" ")
+                    if mechanism.upper() == "LOGIN":
+                        for prompt in ("VXNlcm5hbWU6", "UGFzc3dvcmQ6")[1 if initial else 0:]:
+                            await reply(f"334 {prompt}")
+                            await reader.readline()
+                    elif not initial:
+                        await reply("334 ")
+                        await reader.readline()
+                    await reply("235 Authentication successful")
+                elif verb == "MAIL":
+                    sender, recipients = command.partition(":")[2].strip(), []
+                    await reply("250 OK")
+                elif verb == "RCPT":
+                    recipients.append(command.partition(":")[2].strip())
+                    await reply("250 OK")
+                elif verb == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    lines = []
+                    while True:
+                        data = await reader.readline()
+                        if data in (b".\r\n", b".\n", b""):
+                            break
+                        lines.append(data[1:] if data.startswith(b"..") else data)
+                    self._store(sender, recipients, b"".join(lines))
+                    sender, recipients = None, []
+                    await reply("250 OK: queued")
+                elif verb in ("RSET", "NOOP"):
+                    if verb == "RSET":
+                        sender, recipients = None, []
+                    await reply("250 OK")
+                elif verb == "QUIT":
+                    await reply("221 Bye")
+                    break
+                else:
+                    await reply("502 Command not implemented")
+        finally:
+            writer.close()
+
+    def _store(self, sender: str, recipients: list, raw: bytes):
+        message = message_from_bytes(raw)
+        self.messages.append(message)
+        logger.info(f"Message from {sender} to {', '.join(recipients)}: {message['Subject']}")
+        if self.outbox:
+            with open(self.outbox, "ab") as out:
+                out.write(raw + b"\n")
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 1025):
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info(f"SMTP sink listening on {host}:{port}")
+        return server
+
+
+async def _run(args):
+    server = await SMTPSink(args.outbox).serve(args.host, args.port)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1025)
+    parser.add_argument("--outbox", help="also append raw messages to this file")
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
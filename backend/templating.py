@@ -0,0 +1,96 @@
+import os
+from jinja2 import nodes
+from jinja2.ext import Extension
+from fastapi.responses import StreamingResponse
+from fastapi.templating import Jinja2Templates
+from markupsafe import Markup
+from assets import asset_url
+from cache import catalog_cache
+from images import image_variant
+
+
+# Streamed pages go out as soon as the first STREAM_FIRST_CHUNK_SIZE characters (roughly the
+# <head> and navigation) are rendered, then in chunks of at least STREAM_CHUNK_SIZE
+STREAM_FIRST_CHUNK_SIZE = int(os.getenv("STREAM_FIRST_CHUNK_SIZE", "2048"))
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "8192"))
+
+
+class FragmentCacheExtension(Extension):
+    """``{% cache name, tags, *keys %}...{% endcache %}`` caches rendered HTML.
+
+    ``tags`` is a data tag or list of them (the same tags write handlers pass
+    to ``catalog_cache.invalidate``). The fragment is stored in catalog_cache
+    under the name, the current version of those tags and ``keys``, so an
+    invalidation both drops it and guarantees that a render which read the
+    old data can't be stored where the next request would find it::
+
+        {% cache "sellers", "sellers" %}...{% endcache %}
+        {% cache "product-grid", "listing", search, sort, after, before %}...{% endcache %}
+    """
+
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=catalog_cache)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            args.append(parser.parse_expression())
+        if len(args) < 2:
+            parser.fail("cache needs a fragment name and its data tags", lineno)
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method("_cache_support", [args[0], args[1], nodes.List(args[2:])]), [], [], body
+        ).set_lineno(lineno)
+
+    def _cache_support(self, name, tags, keys, caller):
+        cache = self.environment.fragment_cache
+        tags = [tags] if isinstance(tags, str) else list(tags)
+        key = ("fragment", name, cache.version(*tags), *map(str, keys))
+
+        html = cache.get(key)
+        if html is not None:
+            cache.hits["fragment"] += 1
+            return Markup(html)
+        cache.misses["fragment"] += 1
+        html = caller()
+        # Same TTL as the data it was rendered from, so other workers' writes show up just as soon
+        cache.set(key, html, tags=tags)
+        return Markup(html)
+
+
+def create_templates(directory) -> Jinja2Templates:
+    templates = Jinja2Templates(directory=str(directory), extensions=[FragmentCacheExtension])
+    templates.env.globals["image_variant"] = image_variant
+    templates.env.globals["asset_url"] = asset_url
+    return templates
+
+
+def stream_template(templates: Jinja2Templates, name: str, context: dict, status_code: int = 200):
+    """Like ``templates.TemplateResponse`` but sends the page as it renders.
+
+    Rendering stays on the event loop (as TemplateResponse does, so the
+    fragment cache is never touched from another thread); the output is
+    flushed in chunks, the first one small, so the head and navigation reach
+    the browser (which starts fetching CSS) before a long listing is rendered.
+    """
+    template = templates.get_template(name)
+
+    async def body():
+        buffer = []
+        size = 0
+        threshold = STREAM_FIRST_CHUNK_SIZE
+        for piece in template.generate(context):
+            buffer.append(piece)
+            size += len(piece)
+            if size >= threshold:
+                yield "".join(buffer)
+                buffer, size = [], 0
+                threshold = STREAM_CHUNK_SIZE
+        if buffer:
+            yield "".join(buffer)
+
+    return StreamingResponse(body(), status_code=status_code, media_type="text/html")
@@ -0,0 +1,19 @@
+from pymongo import ReturnDocument
+from database import versions_collection
+
+
+# Version counters for data that isn't a single document, e.g. the sellers directory:
+#   {"_id": name, "version": int}
+# Single documents (products, users) carry their own "version" field instead.
+
+
+async def bump_version(name: str) -> int:
+    doc = await versions_collection.find_one_and_update(
+        {"_id": name}, {"$inc": {"version": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return doc["version"]
+
+
+async def current_version(name: str) -> int:
+    doc = await versions_collection.find_one({"_id": name})
+    return doc["version"] if doc else 0